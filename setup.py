@@ -66,11 +66,14 @@ setup(
 	'nti.metadata',
         'nti.property',
         'nti.schema',
+        'nti.zope_catalog',
         'nti.app.site',
         'requests',
+        'perfmetrics',
         'pyramid',
         'six',
         'zc.intid',
+        'zope.annotation',
         'zope.cachedescriptors',
         'zope.component',
         'zope.event',
@@ -79,11 +82,15 @@ setup(
         'zope.intid',
         'zope.interface',
         'zope.location',
+        'zope.processlifetime',
         'zope.security',
         'zope.traversing',
     ],
     extras_require={
         'test': TESTS_REQUIRE,
+        'bitmaps': [
+            'pyroaring',
+        ],
         'docs': [
             'Sphinx',
             'repoze.sphinx.autointerface',
@@ -18,8 +18,29 @@ SEGMENTS = u'Segments'
 #: Segment membership path adapter name
 MEMBERS = u'members'
 
+#: View name for the number of segment members
+VIEW_MEMBER_COUNT = u'count'
+
+#: View name for the changes in segment membership since a token
+VIEW_MEMBER_CHANGES = u'changes'
+
+#: View name for the background refresh settings of a segment
+VIEW_REFRESH = u'refresh'
+
 #: View name for CSV member export
 VIEW_EXPORT_MEMBERS = u'Export'
 
+#: View name for the status (GET) and cancellation (DELETE) of an export job
+VIEW_EXPORT_JOB = u'ExportJob'
+
+#: View name for downloading the output of an export job
+VIEW_EXPORT_JOB_DOWNLOAD = u'ExportJobDownload'
+
 #: View name for previewing membership after segment changes
 VIEW_MEMBERS_PREVIEW = u'members_preview'
+
+#: View name for explaining the evaluation plan of a segment
+VIEW_EXPLAIN = u'explain'
+
+#: View name for evaluating many segments of a site at once
+VIEW_BULK_EVALUATE = u'BulkEvaluate'
@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Offline benchmarks of segment evaluation and the segment views.
+
+The ``bench_*`` modules run against the same mock dataserver layers as the
+tests, on synthetic sites grown to each of the user counts in
+``NTI_SEGMENTS_BENCHMARK_SIZES`` (e.g. ``10000,100000,1000000``)::
+
+    NTI_SEGMENTS_BENCHMARK_OUTPUT=results.json \\
+    zope-testrunner --test-path=src --tests-pattern='^benchmarks$' \\
+        --test-file-pattern='^bench_' -m nti.app.segments.benchmarks
+
+Results are compared with
+``python -m nti.app.segments.benchmarks.harness``.  The remaining modules
+are standalone and run with ``python -m``.
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
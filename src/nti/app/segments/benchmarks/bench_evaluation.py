@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of filter set evaluation against synthetic sites.
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from contextlib import contextmanager
+
+from unittest import TestCase
+
+from zope import component
+
+from zope.component.hooks import getSite
+
+from zope.interface.interfaces import IComponents
+
+from nti.app.segments.benchmarks.harness import benchmark_sizes
+from nti.app.segments.benchmarks.harness import clear_caches
+from nti.app.segments.benchmarks.harness import measure
+
+from nti.app.segments.benchmarks.synthetic import FILTER_TREES
+from nti.app.segments.benchmarks.synthetic import populate_site
+
+from nti.app.segments.bitmap import new_intid_set
+
+from nti.app.segments.planner import evaluate_filter_set
+
+from nti.app.segments.tests import SharedConfiguringTestLayer
+
+from nti.app.site.hostpolicy import create_site
+
+from nti.appserver.policies.sites import BASEADULT
+
+from nti.dataserver.tests import mock_dataserver
+
+from nti.dataserver.tests.mock_dataserver import WithMockDS
+
+from nti.dataserver.users.utils import intids_of_users_by_site
+
+SITE_NAME = 'segments-benchmark-site'
+
+
+@contextmanager
+def _provide_utility(util, iface, **kwargs):
+    gsm = component.getGlobalSiteManager()
+
+    gsm.registerUtility(util, iface, **kwargs)
+    try:
+        yield
+    finally:
+        gsm.unregisterUtility(util, iface, **kwargs)
+
+
+class TestEvaluationBenchmarks(TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def _benchmark_trees(self, size, conn):
+        measure('site-users[%s]' % size,
+                lambda: intids_of_users_by_site(getSite(),
+                                                filter_deactivated=False),
+                connection=conn, users=size)
+
+        initial_intids = intids_of_users_by_site(getSite(),
+                                                 filter_deactivated=False)
+        for name, factory in FILTER_TREES.items():
+            filter_set = factory()
+
+            def apply_leaf(filter_set=filter_set):
+                clear_caches()
+                filter_set.apply(new_intid_set(initial_intids))
+
+            def evaluate(filter_set=filter_set):
+                clear_caches()
+                evaluate_filter_set(filter_set, new_intid_set(initial_intids))
+
+            if getattr(filter_set, 'filter_sets', None) is None:
+                measure('apply[%s,%s]' % (name, size), apply_leaf,
+                        connection=conn, users=size)
+            measure('evaluate[%s,%s]' % (name, size), evaluate,
+                    connection=conn, users=size)
+
+    @WithMockDS
+    def test_evaluation(self):
+        with mock_dataserver.mock_db_trans():
+            create_site(SITE_NAME)
+
+        created = 0
+        with _provide_utility(BASEADULT, IComponents, name='genericadultbase'):
+            # Sites grow between sizes rather than being recreated
+            for size in sorted(benchmark_sizes()):
+                populate_site(SITE_NAME, size, start=created)
+                created = size
+                with mock_dataserver.mock_db_trans(site_name=SITE_NAME) as conn:
+                    self._benchmark_trees(size, conn)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the segment member and listing views against synthetic
+sites.
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from nti.app.segments.benchmarks.harness import benchmark_sizes
+from nti.app.segments.benchmarks.harness import clear_caches
+from nti.app.segments.benchmarks.harness import measure
+
+from nti.app.segments.benchmarks.synthetic import FILTER_TREES
+from nti.app.segments.benchmarks.synthetic import populate_site
+
+from nti.app.segments.tests.test_views import SegmentManagementTest
+
+from nti.app.testing.decorators import WithSharedApplicationMockDS
+
+from nti.externalization import to_external_object
+
+SITE_NAME = 'alpha.nextthought.com'
+
+#: Unfiltered segments created, beyond one per filter tree, for listings
+EXTRA_SEGMENTS = 100
+
+PAGE = {'batchStart': 0, 'batchSize': 50}
+
+
+class TestViewBenchmarks(SegmentManagementTest):
+
+    def _create_segments(self):
+        segments = {}
+        for name, factory in FILTER_TREES.items():
+            filter_set = to_external_object(factory())
+            segment = self._create_segment(name, simple_filter_set=filter_set)
+            segments[name] = segment.json_body
+        for index in range(EXTRA_SEGMENTS):
+            self._create_segment(u'Segment %03d' % index)
+        return segments
+
+    def _benchmark_members(self, size, segments):
+        for name, segment in segments.items():
+            members_url = self.require_link_href_with_rel(segment, 'members')
+
+            def members(members_url=members_url):
+                clear_caches()
+                self.testapp.get(members_url, params=PAGE)
+
+            def cached_members(members_url=members_url):
+                self.testapp.get(members_url, params=PAGE)
+
+            def csv(members_url=members_url):
+                clear_caches()
+                self.testapp.get(members_url,
+                                 headers={'accept': str('text/csv')})
+
+            measure('members[%s,%s]' % (name, size), members, users=size)
+            measure('members-cached[%s,%s]' % (name, size), cached_members,
+                    users=size)
+            measure('members-csv[%s,%s]' % (name, size), csv, users=size)
+
+    def _benchmark_listing(self, size, segments):
+        count = len(segments) + EXTRA_SEGMENTS
+        for name, params in (('title', dict(PAGE, sortOn='title')),
+                             ('createdTime', dict(PAGE, sortOn='createdTime')),
+                             ('creator', dict(PAGE, sortOn='creator')),
+                             ('filter', dict(PAGE, filter='segment 01'))):
+
+            def listing(params=params):
+                self._list_segments(via_workspace=False, params=params)
+
+            measure('site-segments[%s,%s]' % (name, size), listing,
+                    users=size, segments=count)
+
+    @WithSharedApplicationMockDS(users=True,
+                                 testapp=True,
+                                 default_authenticate=True)
+    def test_views(self):
+        segments = self._create_segments()
+
+        created = 0
+        # Sites grow between sizes rather than being recreated
+        for size in sorted(benchmark_sizes()):
+            populate_site(SITE_NAME, size, start=created)
+            created = size
+            self._benchmark_members(size, segments)
+            self._benchmark_listing(size, segments)
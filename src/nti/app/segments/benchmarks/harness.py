@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measurement and reporting for the segment benchmarks.
+
+Each benchmark reports its latency over a number of warm loops, along with
+the peak memory allocated and the number of objects loaded from ZODB by a
+cold run (one with emptied connection caches).  Results are written in a
+pyperf-like JSON format, and two result files can be compared, failing
+on regressions, with::
+
+    python -m nti.app.segments.benchmarks.harness baseline.json current.json
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import os
+import sys
+import timeit
+
+from zope import component
+
+from nti.app.segments.interfaces import IFilterSetResultCache
+from nti.app.segments.interfaces import ISegmentMembershipCache
+from nti.app.segments.interfaces import ISegmentSortCache
+
+from nti.dataserver.interfaces import IDataserver
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+#: Comma separated user counts of the synthetic sites
+SIZES_ENV = 'NTI_SEGMENTS_BENCHMARK_SIZES'
+DEFAULT_SIZES = (10000,)
+
+#: The number of warm loops timed
+LOOPS_ENV = 'NTI_SEGMENTS_BENCHMARK_LOOPS'
+DEFAULT_LOOPS = 5
+
+#: A file results are appended to
+OUTPUT_ENV = 'NTI_SEGMENTS_BENCHMARK_OUTPUT'
+
+#: The default factor by which a metric may grow before it is a regression
+DEFAULT_THRESHOLD = 1.2
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def benchmark_sizes():
+    sizes = os.environ.get(SIZES_ENV)
+    if not sizes:
+        return DEFAULT_SIZES
+    return tuple(int(size) for size in sizes.split(',') if size.strip())
+
+
+def benchmark_loops():
+    return int(os.environ.get(LOOPS_ENV) or DEFAULT_LOOPS)
+
+
+class LoadCounter(object):
+    """
+    A ZODB activity monitor counting the objects loaded by connections
+    as they are closed.
+    """
+
+    def __init__(self):
+        self.loads = 0
+
+    def closedConnection(self, conn):
+        loads, _ = conn.getTransferCounts(True)
+        self.loads += loads
+
+
+def clear_caches():
+    """
+    Empty the process-local caches, so evaluation is measured rather than
+    cache hits.
+    """
+    for iface in (ISegmentMembershipCache,
+                  ISegmentSortCache,
+                  IFilterSetResultCache):
+        cache = component.queryUtility(iface)
+        if cache is not None:
+            cache.invalidate()
+
+
+def _database():
+    return component.getUtility(IDataserver).db
+
+
+def _peak_memory(func):
+    """
+    Call ``func``, returning the peak bytes allocated during the call, or
+    None without tracemalloc.
+    """
+    if tracemalloc is None:
+        func()
+        return None
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(name, func, loops=None, connection=None, **metadata):
+    """
+    Benchmark ``func``, returning a result mapping.
+
+    Objects loaded are counted on the given open connection, or (when
+    ``func`` opens its own connections, e.g. a request) by monitoring the
+    dataserver's database.
+    """
+    loops = benchmark_loops() if loops is None else loops
+    db = _database() if connection is None else connection.db()
+    gc.collect()
+
+    # Cold run
+    db.cacheMinimize()
+    if connection is not None:
+        connection.getTransferCounts(True)
+        peak_memory = _peak_memory(func)
+        loads = connection.getTransferCounts(True)[0]
+    else:
+        previous = db.getActivityMonitor()
+        counter = LoadCounter()
+        db.setActivityMonitor(counter)
+        try:
+            peak_memory = _peak_memory(func)
+        finally:
+            db.setActivityMonitor(previous)
+        loads = counter.loads
+
+    values = []
+    for _ in range(loops):
+        start = timeit.default_timer()
+        func()
+        values.append(timeit.default_timer() - start)
+
+    metadata.update(peak_memory=peak_memory, objects_loaded=loads)
+    result = {'name': name, 'values': values, 'metadata': metadata}
+    report(result)
+    return result
+
+
+def _mean(values):
+    return sum(values) / len(values) if values else 0
+
+
+def report(result):
+    metadata = result['metadata']
+    print('%-50s %10.2f ms %12s B %10s loads' % (result['name'],
+                                                 _mean(result['values']) * 1000,
+                                                 metadata['peak_memory'],
+                                                 metadata['objects_loaded']),
+          file=sys.stderr)
+    output = os.environ.get(OUTPUT_ENV)
+    if output:
+        write_results(output, [result])
+
+
+def read_results(path):
+    if not os.path.exists(path):
+        return {'benchmarks': []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_results(path, results):
+    """
+    Add the results to the file at ``path``, replacing any of the same
+    name.
+    """
+    data = read_results(path)
+    names = set(result['name'] for result in results)
+    data['benchmarks'] = [result for result in data['benchmarks']
+                          if result['name'] not in names] + list(results)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare two result sets, returning descriptions of the metrics of
+    benchmarks in both that grew by more than ``threshold``.
+    """
+    baseline = dict((result['name'], result)
+                    for result in baseline['benchmarks'])
+    regressions = []
+    for result in current['benchmarks']:
+        previous = baseline.get(result['name'])
+        if previous is None:
+            continue
+        metrics = [('latency', _mean(previous['values']), _mean(result['values']))]
+        metrics.extend((key, previous['metadata'].get(key), result['metadata'].get(key))
+                       for key in ('peak_memory', 'objects_loaded'))
+        for metric, before, after in metrics:
+            if before and after is not None and after > before * threshold:
+                regressions.append('%s %s: %s -> %s' % (result['name'], metric,
+                                                        before, after))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Compare benchmark results")
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('-t', '--threshold', type=float,
+                        default=DEFAULT_THRESHOLD,
+                        help='Allowed growth factor of each metric')
+    options = parser.parse_args(args)
+    regressions = compare(read_results(options.baseline),
+                          read_results(options.current),
+                          options.threshold)
+    for regression in regressions:
+        print(regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
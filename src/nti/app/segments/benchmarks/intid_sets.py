@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares the BTrees and roaring bitmap intid sets used during filter set
+evaluation: time to intersect and union, and memory held.
+
+Run with ``python -m nti.app.segments.benchmarks.intid_sets``.
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import gc
+import pickle
+import random
+import timeit
+
+import BTrees
+
+from nti.app.segments.bitmap import BitMap64
+from nti.app.segments.bitmap import BitmapIntIdSet
+from nti.app.segments.bitmap import union
+
+from nti.segments.model import IntIdSet
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+family = BTrees.family64
+
+#: Intids are allocated sparsely over a large range, as zope.intid does
+INTID_RANGE = 2 ** 40
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def random_intids(count, seed):
+    rand = random.Random(seed)
+    base = rand.randrange(INTID_RANGE)
+    # Users are registered in bursts, so ids cluster
+    return family.IF.Set(base + rand.randrange(count * 8) for _ in range(count))
+
+
+def allocated(factory):
+    """
+    The number of bytes allocated while building an object, or None
+    without tracemalloc.
+    """
+    if tracemalloc is None:
+        return None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = factory()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return after - before
+
+
+def measure(factory, one, two, repeat):
+    left, right = factory(one), factory(two)
+    timings = {
+        'intersection': min(timeit.repeat(lambda: left.intersection(right.intids()),
+                                          number=1, repeat=repeat)),
+        'union': min(timeit.repeat(lambda: union(left, right),
+                                   number=1, repeat=repeat)),
+    }
+    memory = allocated(lambda: factory(one))
+    pickled = len(pickle.dumps(left.intids(), pickle.HIGHEST_PROTOCOL))
+    return timings['intersection'], timings['union'], memory, pickled
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-n', '--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000],
+                        help='Number of intids in each set')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Timing repetitions; the best is reported')
+    options = parser.parse_args(args)
+
+    factories = [('btrees', IntIdSet)]
+    if BitMap64 is not None:
+        factories.append(('bitmap', BitmapIntIdSet))
+    else:
+        print('pyroaring is not installed; only BTrees sets are measured')
+
+    row = '%-8s %-10s %14s %14s %14s %14s'
+    print(row % ('backend', 'size', 'intersect (ms)', 'union (ms)',
+                 'memory (B)', 'pickled (B)'))
+    for size in options.sizes:
+        one = random_intids(size, 1)
+        two = family.IF.union(random_intids(size // 2, 2),
+                              family.IF.Set(list(one)[::2]))
+        for name, factory in factories:
+            intersection, union_time, memory, pickled = \
+                measure(factory, one, two, options.repeat)
+            print(row % (name, size,
+                         '%.3f' % (intersection * 1000),
+                         '%.3f' % (union_time * 1000),
+                         'n/a' if memory is None else memory,
+                         pickled))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Synthetic sites and filter trees for the segment benchmarks.
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import random
+import time
+
+from collections import OrderedDict
+
+from datetime import timedelta
+
+from zope import interface
+
+from zope.lifecycleevent import modified
+
+from nti.app.segments.interfaces import GRANULARITY_DAY
+from nti.app.segments.interfaces import RANGE_OP_AFTER
+from nti.app.segments.interfaces import RANGE_OP_BEFORE
+
+from nti.app.segments.model import CreatedTimeFilterSet
+from nti.app.segments.model import IsDeactivatedFilterSet
+from nti.app.segments.model import LastActiveFilterSet
+from nti.app.segments.model import RelativeOffset
+
+from nti.coremetadata.interfaces import IDeactivatedUser
+
+from nti.dataserver.tests import mock_dataserver
+
+from nti.dataserver.users import User
+
+from nti.segments.model import IntersectionUserFilterSet
+from nti.segments.model import UnionUserFilterSet
+
+#: Users are created and committed in batches of this size
+DEFAULT_BATCH_SIZE = 1000
+
+#: The share of users that have never been seen
+NEVER_SEEN_RATIO = 0.15
+
+#: The share of users that are deactivated
+DEACTIVATED_RATIO = 0.05
+
+DAY = timedelta(days=1).total_seconds()
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def populate_site(site_name, count, start=0, seed=0,
+                  batch_size=DEFAULT_BATCH_SIZE, prefix=u'bench.user'):
+    """
+    Create users ``start`` up to ``count`` in the given (existing) site,
+    with creation and last seen times spread over the past two years and
+    half year, and some deactivated.  Users are committed in batches so
+    large sites don't accumulate in a single transaction.
+    """
+    rand = random.Random(seed + start)
+    now = time.time()
+    for batch_start in range(start, count, batch_size):
+        with mock_dataserver.mock_db_trans(site_name=site_name):
+            for index in range(batch_start, min(count, batch_start + batch_size)):
+                user = User.create_user(username=u'%s.%07d' % (prefix, index))
+                user.createdTime = now - rand.uniform(0, 730) * DAY
+                if rand.random() >= NEVER_SEEN_RATIO:
+                    user.lastSeenTime = now - rand.uniform(0, 180) * DAY
+                if rand.random() < DEACTIVATED_RATIO:
+                    interface.alsoProvides(user, IDeactivatedUser)
+                modified(user)
+        logger.info('Created %s of %s users in %s',
+                    min(count, batch_start + batch_size), count, site_name)
+    return count - start
+
+
+def _last_active(days, operator=RANGE_OP_AFTER, granularity=None):
+    return LastActiveFilterSet(period=RelativeOffset(duration=timedelta(days=-days),
+                                                     operator=operator,
+                                                     granularity=granularity))
+
+
+def _created(days, operator=RANGE_OP_AFTER, granularity=None):
+    return CreatedTimeFilterSet(period=RelativeOffset(duration=timedelta(days=-days),
+                                                      operator=operator,
+                                                      granularity=granularity))
+
+
+#: Factories of filter trees of varied shape, by name
+FILTER_TREES = OrderedDict((
+    ('deactivated',
+     lambda: IsDeactivatedFilterSet(Deactivated=True)),
+    ('active-30d',
+     lambda: _last_active(30)),
+    ('active-30d-snapped',
+     lambda: _last_active(30, granularity=GRANULARITY_DAY)),
+    ('active-and-established',
+     lambda: IntersectionUserFilterSet(filter_sets=[
+         _last_active(30),
+         _created(365, RANGE_OP_BEFORE),
+     ])),
+    ('new-or-dormant',
+     lambda: UnionUserFilterSet(filter_sets=[
+         _created(30),
+         _last_active(90, RANGE_OP_BEFORE),
+     ])),
+    ('nested',
+     lambda: IntersectionUserFilterSet(filter_sets=[
+         UnionUserFilterSet(filter_sets=[
+             _last_active(7),
+             _created(7),
+         ]),
+         UnionUserFilterSet(filter_sets=[
+             IsDeactivatedFilterSet(Deactivated=False),
+         ]),
+         _last_active(60),
+     ])),
+))
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Intid sets for filter set evaluation, optionally backed by compressed
+(roaring) bitmaps.
+
+Evaluation creates its intid sets through the registered
+:class:`.IIntIdSetFactory`: BTrees backed :class:`nti.segments.model.IntIdSet`
+by default, or :class:`BitmapIntIdSet` where the ``segments-bitmaps`` ZCML
+feature is provided and ``pyroaring`` is installed.  Catalog results are
+BTrees sets, often much larger than the bitmap they are combined with, so
+rather than being converted they are combined on the BTrees path, with the
+bitmap converted instead; evaluation results are converted back by
+:func:`to_btree_set`.
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import operator
+
+import BTrees
+
+from zope import component
+
+from nti.app.segments.interfaces import IIntIdSetFactory
+
+from nti.segments.model import IntIdSet
+
+try:
+    from pyroaring import BitMap64
+except ImportError:  # pragma: no cover
+    BitMap64 = None
+
+logger = __import__('logging').getLogger(__name__)
+
+
+class BitmapIntIdSet(object):
+    """
+    An :class:`nti.segments.model.IntIdSet` work-alike holding its
+    (non-negative) intids in a 64-bit roaring bitmap.
+    """
+
+    family = BTrees.family64
+
+    def __init__(self, intids=()):
+        self._bitmap = self._bitmap_of(intids)
+
+    @staticmethod
+    def _bitmap_of(intids):
+        if isinstance(intids, BitmapIntIdSet):
+            return intids._bitmap
+        if isinstance(intids, IntIdSet):
+            intids = intids.intids()
+        if isinstance(intids, BitMap64):
+            return intids
+        return BitMap64(intids)
+
+    def _btree_operand(self, other):
+        if isinstance(other, IntIdSet):
+            other = other.intids()
+        if isinstance(other, (self.family.IF.Set, self.family.IF.TreeSet)):
+            return other
+        return None
+
+    def _combine(self, other, op, btree_op):
+        operand = self._btree_operand(other)
+        if operand is not None:
+            return IntIdSet(btree_op(self.family.IF.Set(self._bitmap), operand))
+        return BitmapIntIdSet(op(self._bitmap, self._bitmap_of(other)))
+
+    def intids(self):
+        return self._bitmap
+
+    def intersection(self, other):
+        return self._combine(other, operator.and_, self.family.IF.intersection)
+
+    def difference(self, other):
+        return self._combine(other, operator.sub, self.family.IF.difference)
+
+    def union(self, other):
+        return self._combine(other, operator.or_, self.family.IF.union)
+
+    def __len__(self):
+        return len(self._bitmap)
+
+    def __iter__(self):
+        return iter(self._bitmap)
+
+    def __contains__(self, intid):
+        return intid in self._bitmap
+
+
+def new_intid_set(intids=()):
+    """
+    Create an intid set with the registered :class:`.IIntIdSetFactory`.
+    """
+    factory = component.queryUtility(IIntIdSetFactory, default=IntIdSet)
+    return factory(intids)
+
+
+def like(intid_set, intids):
+    """
+    Create an intid set of the same kind as ``intid_set``.
+    """
+    if isinstance(intid_set, BitmapIntIdSet):
+        return BitmapIntIdSet(intids)
+    return IntIdSet(intids)
+
+
+def union(one, two):
+    """
+    The union of the given intid sets, of the same kind as the first.
+    """
+    if isinstance(one, BitmapIntIdSet):
+        return one.union(two)
+    family = BTrees.family64
+    other = two.intids()
+    if not isinstance(other, (family.IF.Set, family.IF.TreeSet)):
+        other = family.IF.Set(other)
+    return IntIdSet(family.IF.union(one.intids(), other))
+
+
+def to_btree_set(intids):
+    """
+    Return the given intids (or intid set) as a BTrees set, converting
+    bitmaps.
+    """
+    family = BTrees.family64
+    if isinstance(intids, (IntIdSet, BitmapIntIdSet)):
+        intids = intids.intids()
+    if isinstance(intids, (family.IF.Set, family.IF.TreeSet)):
+        return intids
+    return family.IF.Set(intids)
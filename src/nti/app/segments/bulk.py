@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Evaluation of many segments against the same site at once.
+
+Each distinct leaf filter set is applied once, to the full set of site
+users, and composite filter sets are then answered by combining leaf
+results.  Leaves that always select the same users (the same index and
+range, or the same deactivated flag) are shared across segments.
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from nti.app.segments.bitmap import like
+from nti.app.segments.bitmap import new_intid_set
+from nti.app.segments.bitmap import to_btree_set
+from nti.app.segments.bitmap import union
+
+from nti.app.segments.interfaces import IIsDeactivatedFilterSet
+from nti.app.segments.interfaces import ITimeRangeFilterSet
+
+from nti.segments.interfaces import IIntersectionUserFilterSet
+from nti.segments.interfaces import IUnionUserFilterSet
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def _period_key(period):
+    if getattr(period, 'is_stable', False):
+        return ('range',) + tuple(period.range_tuple)
+    # Relative offsets without a granularity move with the clock, but
+    # equal definitions select the same users at any given moment
+    duration = getattr(period, 'duration', None)
+    operator = getattr(period, 'operator', None)
+    if duration is not None and operator is not None:
+        return ('offset', duration, operator)
+    return None
+
+
+def leaf_key(filter_set):
+    """
+    A hashable key shared by leaf filter sets that always select the same
+    users, or None if the filter set can't be compared.
+    """
+    if ITimeRangeFilterSet.providedBy(filter_set):
+        period_key = _period_key(filter_set.period)
+        if period_key is None:
+            return None
+        return ('time-range', filter_set.index_name) + period_key
+    if IIsDeactivatedFilterSet.providedBy(filter_set):
+        return ('deactivated', bool(filter_set.Deactivated))
+    return None
+
+
+class BulkEvaluator(object):
+    """
+    Evaluates filter sets against a fixed initial intid set, sharing leaf
+    results between evaluations.
+    """
+
+    def __init__(self, initial_set):
+        self.initial_set = initial_set
+        self.leaf_evaluations = 0
+        self.shared_leaves = 0
+        self._leaves = {}
+
+    def _leaf(self, filter_set):
+        key = leaf_key(filter_set)
+        if key is not None and key in self._leaves:
+            self.shared_leaves += 1
+            return self._leaves[key]
+
+        result = filter_set.apply(self.initial_set)
+        self.leaf_evaluations += 1
+        if key is not None:
+            self._leaves[key] = result
+        return result
+
+    def _intersection(self, filter_set):
+        result = self.initial_set
+        for child in filter_set.filter_sets or ():
+            result = result.intersection(self._evaluate(child).intids())
+            if not len(result.intids()):
+                break
+        return result
+
+    def _union(self, filter_set):
+        result = like(self.initial_set, ())
+        for child in filter_set.filter_sets or ():
+            result = union(result, self._evaluate(child))
+        return result
+
+    def _evaluate(self, filter_set):
+        if IIntersectionUserFilterSet.providedBy(filter_set):
+            return self._intersection(filter_set)
+        if IUnionUserFilterSet.providedBy(filter_set):
+            return self._union(filter_set)
+        return self._leaf(filter_set)
+
+    def evaluate(self, filter_set):
+        """
+        Return the intids selected by the filter set (all of the initial
+        set if None), as a BTrees set.
+        """
+        if filter_set is None:
+            return to_btree_set(self.initial_set)
+        return to_btree_set(self._evaluate(filter_set))
+
+
+def bulk_evaluator(initial_intids):
+    """
+    Create a :class:`BulkEvaluator` for the given intids, e.g. those of the
+    users of a site.
+    """
+    return BulkEvaluator(new_intid_set(to_btree_set(initial_intids)))
@@ -0,0 +1,466 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+import time
+import weakref
+
+from collections import OrderedDict
+
+import BTrees
+
+import transaction
+
+from zope import component
+from zope import interface
+
+from nti.app.segments.fingerprint import filter_set_fingerprint
+from nti.app.segments.fingerprint import filter_set_indexes
+
+from nti.app.segments.interfaces import IAbsoluteRangeCache
+from nti.app.segments.interfaces import ICreatorDisplayNameCache
+from nti.app.segments.interfaces import IFilterSetResultCache
+from nti.app.segments.interfaces import IIntIdSetCache
+from nti.app.segments.interfaces import ISegmentMembershipCache
+from nti.app.segments.interfaces import ISegmentSortCache
+from nti.app.segments.interfaces import ISiteAdminIntIdCache
+
+logger = __import__('logging').getLogger(__name__)
+
+#: Seconds a materialized membership set is considered fresh.  This bounds
+#: staleness from events fired in other processes and from relative time
+#: ranges moving with the clock.
+DEFAULT_MEMBERSHIP_TTL = 300
+
+#: Maximum number of materialized membership sets retained per process
+DEFAULT_MEMBERSHIP_MAX_ENTRIES = 500
+
+#: Maximum number of member orderings retained per process
+DEFAULT_SORT_MAX_ENTRIES = 200
+
+#: Maximum number of memoized filter set results retained per process
+DEFAULT_RESULT_MAX_ENTRIES = 200
+
+#: Maximum number of absolute time range results retained per process
+DEFAULT_RANGE_MAX_ENTRIES = 200
+
+#: Maximum number of site admin intid sets retained per process
+DEFAULT_SITE_ADMIN_MAX_ENTRIES = 500
+
+#: Seconds a creator display name is reused across requests
+DEFAULT_DISPLAY_NAME_TTL = 60
+
+#: Maximum number of creator display names retained per process
+DEFAULT_DISPLAY_NAME_MAX_ENTRIES = 1000
+
+#: Response header indicating whether membership was served from cache
+CACHE_STATUS_HEADER = 'X-NTI-Segment-Cache'
+
+CACHE_HIT = 'hit'
+CACHE_MISS = 'miss'
+
+
+class LRUCache(object):
+    """
+    A process-local, size-bounded LRU of values scoped by (e.g.) site
+    name, expiring after ``ttl`` seconds (never if None).
+
+    Values are shared across connections and threads, so must be
+    immutable or treated as read-only.
+    """
+
+    def __init__(self, ttl=DEFAULT_MEMBERSHIP_TTL,
+                 max_entries=DEFAULT_MEMBERSHIP_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._global_generation = 0
+
+    def generation(self, scope):
+        with self._lock:
+            return (self._global_generation,
+                    self._generations.get(scope, 0))
+
+    def _expired(self, stored, unused_key=None):
+        return self.ttl is not None and time.time() - stored > self.ttl
+
+    def get(self, scope, key):
+        entry_key = (scope, key)
+        with self._lock:
+            entry = self._entries.pop(entry_key, None)
+            if entry is None or self._expired(entry[0], key):
+                return None
+            # Re-insert to mark as most recently used
+            self._entries[entry_key] = entry
+            return entry[1]
+
+    def _copy(self, value):
+        return value
+
+    def set(self, scope, key, value, generation=None):
+        value = self._copy(value)
+        with self._lock:
+            current = (self._global_generation,
+                       self._generations.get(scope, 0))
+            if generation is not None and generation != current:
+                return False
+            entry_key = (scope, key)
+            self._entries.pop(entry_key, None)
+            self._entries[entry_key] = (time.time(), value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def invalidate(self, scope=None):
+        with self._lock:
+            if scope is None:
+                self._global_generation += 1
+                self._entries.clear()
+                return
+            self._generations[scope] = self._generations.get(scope, 0) + 1
+            for entry_key in [k for k in self._entries if k[0] == scope]:
+                del self._entries[entry_key]
+
+    def invalidate_entries(self, matches, scope=None):
+        with self._lock:
+            # Evaluations racing with the change can't store their results
+            if scope is None:
+                self._global_generation += 1
+            else:
+                self._generations[scope] = self._generations.get(scope, 0) + 1
+            for entry_key, (_, value) in list(self._entries.items()):
+                if     (scope is None or entry_key[0] == scope) \
+                    and matches(entry_key[1], value):
+                    del self._entries[entry_key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+@interface.implementer(IIntIdSetCache)
+class IntIdSetCache(LRUCache):
+    """
+    A process-local, size-bounded LRU of intid sets.
+
+    Stored values are copied into non-persistent sets so they can be
+    safely shared across connections and threads; callers must treat
+    returned sets as read-only.
+    """
+
+    family = BTrees.family64
+
+    def _copy(self, intids):
+        return self.family.IF.Set(intids)
+
+
+@interface.implementer(ISegmentMembershipCache)
+class SegmentMembershipCache(IntIdSetCache):
+    pass
+
+
+class SortedIntIds(tuple):
+    """
+    Intids in a requested order.  If not ``complete`` this is only the
+    leading portion of the ordering, with ``total`` the number of intids
+    in the full ordering.
+    """
+
+    def __new__(cls, intids=(), complete=True, total=None):
+        result = super(SortedIntIds, cls).__new__(cls, intids)
+        result.complete = complete
+        result.total = len(result) if total is None else total
+        return result
+
+
+@interface.implementer(ISegmentSortCache)
+class SegmentSortCache(IntIdSetCache):
+
+    def __init__(self, ttl=DEFAULT_MEMBERSHIP_TTL,
+                 max_entries=DEFAULT_SORT_MAX_ENTRIES):
+        super(SegmentSortCache, self).__init__(ttl, max_entries)
+
+    def _copy(self, intids):
+        # Order matters here, so these aren't stored as sets
+        if isinstance(intids, SortedIntIds):
+            return intids
+        return SortedIntIds(intids)
+
+
+@interface.implementer(IFilterSetResultCache)
+class FilterSetResultCache(IntIdSetCache):
+
+    def __init__(self, ttl=DEFAULT_MEMBERSHIP_TTL,
+                 max_entries=DEFAULT_RESULT_MAX_ENTRIES):
+        super(FilterSetResultCache, self).__init__(ttl, max_entries)
+
+
+@interface.implementer(ISiteAdminIntIdCache)
+class SiteAdminIntIdCache(IntIdSetCache):
+
+    def __init__(self, ttl=DEFAULT_MEMBERSHIP_TTL,
+                 max_entries=DEFAULT_SITE_ADMIN_MAX_ENTRIES):
+        super(SiteAdminIntIdCache, self).__init__(ttl, max_entries)
+
+
+def _in_range(value, start, end):
+    # Matches the exclusive upper bound of our range queries
+    return  value is not None \
+        and (start is None or value >= start) \
+        and (end is None or value < end)
+
+
+@interface.implementer(IAbsoluteRangeCache)
+class AbsoluteRangeCache(IntIdSetCache):
+
+    def __init__(self, ttl=DEFAULT_MEMBERSHIP_TTL,
+                 max_entries=DEFAULT_RANGE_MAX_ENTRIES):
+        super(AbsoluteRangeCache, self).__init__(ttl, max_entries)
+
+    def _expired(self, stored, key=None):
+        # Changes in other processes aren't invalidated here, but users
+        # are only indexed at (or after) the current time, so ranges that
+        # have ended are kept until invalidated
+        end = key[1] if key is not None else None
+        if end is not None and end < time.time():
+            return False
+        return super(AbsoluteRangeCache, self)._expired(stored, key)
+
+    def invalidate_document(self, scope, doc_id, value=None):
+        def _affected(key, intids):
+            start, end = key
+            return doc_id in intids or _in_range(value, start, end)
+        self.invalidate_entries(_affected, scope)
+
+
+@interface.implementer(ICreatorDisplayNameCache)
+class CreatorDisplayNameCache(LRUCache):
+
+    def __init__(self, ttl=DEFAULT_DISPLAY_NAME_TTL,
+                 max_entries=DEFAULT_DISPLAY_NAME_MAX_ENTRIES):
+        super(CreatorDisplayNameCache, self).__init__(ttl, max_entries)
+
+
+def membership_cache_key(segment):
+    """
+    A key identifying the members of the given segment within a site: the
+    fingerprint of its filter set, shared by all segments with equivalent
+    filter sets and unaffected by changes to anything else, followed by
+    the indexes it selects on (None if unknown).
+    """
+    filter_set = segment.filter_set
+    return ('filter-set',
+            filter_set_fingerprint(filter_set),
+            filter_set_indexes(filter_set))
+
+
+#: Invalidations to repeat once the transaction they happened in commits
+_pending_invalidations = weakref.WeakKeyDictionary()
+_pending_lock = threading.Lock()
+
+
+def _invalidate_after_commit(success, txn):
+    with _pending_lock:
+        invalidations = _pending_invalidations.pop(txn, {})
+    if success:
+        for func, args in invalidations:
+            func(*args)
+
+
+def _invalidate_now_and_after_commit(func, *args):
+    """
+    Call ``func`` with ``args`` both immediately and again once the
+    current transaction commits, so that evaluations racing with the
+    change can't repopulate stale data.  Repeated invalidations within a
+    transaction share a single commit hook and are only repeated once.
+    """
+    func(*args)
+    txn = transaction.get()
+    with _pending_lock:
+        invalidations = _pending_invalidations.get(txn)
+        if invalidations is None:
+            invalidations = _pending_invalidations[txn] = OrderedDict()
+            txn.addAfterCommitHook(_invalidate_after_commit, args=(txn,))
+        invalidations[(func, args)] = True
+
+
+def _invalidate_scope(cache, scope):
+    cache.invalidate(scope)
+
+
+def _invalidate(cache, scope=None):
+    _invalidate_now_and_after_commit(_invalidate_scope, cache, scope)
+
+
+def invalidate_membership(site_name=None):
+    """
+    Invalidate cached membership, member orderings and site admins for the
+    given site (or all sites).  This happens both immediately and again
+    once the current transaction commits, so that evaluations racing with
+    the change can't repopulate stale data.
+    """
+    for iface in (ISegmentMembershipCache, ISegmentSortCache, ISiteAdminIntIdCache):
+        cache = component.queryUtility(iface)
+        if cache is not None:
+            _invalidate(cache, site_name)
+
+
+def _depends_on(key, index_name, sort_on=None):
+    # Membership (and sort) keys hold the indexes selected on, or None if
+    # they aren't known; sort keys also hold the sort parameters
+    indexes = key[2]
+    if indexes is None or index_name in indexes:
+        return True
+    if sort_on is not None and len(key) > 3:
+        return any(k == 'sorton' and (v or '').lower() == sort_on.lower()
+                   for k, v in key[3])
+    return False
+
+
+def _invalidate_index(cache, scope, index_name, sort_on):
+    cache.invalidate_entries(lambda key, _: _depends_on(key, index_name, sort_on),
+                             scope)
+
+
+def invalidate_index_membership(index_name, site_name=None, sort_on=None):
+    """
+    Invalidate cached membership and member orderings for the given site
+    (or all sites) selecting on the given index, as well as orderings by
+    the given ``sort_on`` parameter, if any.  As with
+    :func:`invalidate_membership`, this happens both immediately and again
+    once the current transaction commits.
+    """
+    for iface in (ISegmentMembershipCache, ISegmentSortCache):
+        cache = component.queryUtility(iface)
+        if cache is not None:
+            _invalidate_now_and_after_commit(_invalidate_index, cache,
+                                             site_name, index_name, sort_on)
+
+
+def _key_ranges(key):
+    # Filter set results are keyed by an (index, start, end) leaf range,
+    # a tuple of (index, (start, end)) merged ranges, or otherwise by
+    # something other than ranges (e.g. deactivated users)
+    if len(key) == 3 and not isinstance(key[0], tuple):
+        return ((key[0], (key[1], key[2])),)
+    if key and all(isinstance(x, tuple) for x in key):
+        return key
+    return ()
+
+
+def _filter_result_affected(key, intids, doc_id, values, other):
+    ranges = _key_ranges(key)
+    if not ranges:
+        return other
+    affected = False
+    for index_name, (start, end) in ranges:
+        if index_name in values:
+            affected = True
+            if _in_range(values[index_name], start, end):
+                return True
+    return affected and doc_id in intids
+
+
+def _invalidate_filter_results(cache, doc_id, values, other):
+    values = dict(values)
+    cache.invalidate_entries(
+        lambda key, intids: _filter_result_affected(key, intids, doc_id,
+                                                    values, other))
+
+
+def invalidate_filter_results(doc_id, values, other=False):
+    """
+    Invalidate memoized filter set results affected by a change to the
+    given document, which is now indexed with the given ``values`` (a
+    mapping of index names to values): results of ranges over those
+    indexes holding the document or now including it.  Results other than
+    ranges are only invalidated if ``other`` is true.  As with
+    :func:`invalidate_membership`, this happens both immediately and again
+    once the current transaction commits.
+    """
+    cache = component.queryUtility(IFilterSetResultCache)
+    if cache is not None:
+        _invalidate_now_and_after_commit(_invalidate_filter_results, cache,
+                                         doc_id, tuple(sorted(values.items())),
+                                         other)
+
+
+def _invalidate_document(cache, scope, doc_id, value):
+    cache.invalidate_document(scope, doc_id, value)
+
+
+def invalidate_range_results(index_name, doc_id, value=None):
+    """
+    Invalidate results of absolute time ranges over the given index
+    affected by a change to the given document, which is now indexed with
+    the given value (if any).  As with :func:`invalidate_membership`, this
+    happens both immediately and again once the current transaction
+    commits.
+    """
+    cache = component.queryUtility(IAbsoluteRangeCache)
+    if cache is not None:
+        _invalidate_now_and_after_commit(_invalidate_document, cache,
+                                         index_name, doc_id, value)
+
+
+def peek_range_result(index_name, start, end):
+    """
+    Return the cached intid set for the given absolute time range over the
+    given index, if any, from the :class:`.IAbsoluteRangeCache`.
+    """
+    cache = component.queryUtility(IAbsoluteRangeCache)
+    return cache.get(index_name, (start, end)) if cache is not None else None
+
+
+def memoized_range_result(index_name, start, end, factory):
+    """
+    Return the intid set for the given absolute time range over the given
+    index from the :class:`.IAbsoluteRangeCache`, computing it with
+    ``factory`` if necessary.
+    """
+    cache = component.queryUtility(IAbsoluteRangeCache)
+    if cache is None:
+        return factory()
+
+    key = (start, end)
+    result = cache.get(index_name, key)
+    if result is None:
+        generation = cache.generation(index_name)
+        result = factory()
+        cache.set(index_name, key, result, generation)
+    return result
+
+
+def peek_filter_result(key):
+    """
+    Return the memoized intid set for the given key, if any, from the
+    :class:`.IFilterSetResultCache`.
+    """
+    cache = component.queryUtility(IFilterSetResultCache)
+    return cache.get(None, key) if cache is not None else None
+
+
+def memoized_filter_result(key, factory):
+    """
+    Return the intid set for the given key from the
+    :class:`.IFilterSetResultCache`, computing it with ``factory`` if
+    necessary.
+    """
+    cache = component.queryUtility(IFilterSetResultCache)
+    if cache is None:
+        return factory()
+
+    result = cache.get(None, key)
+    if result is None:
+        generation = cache.generation(None)
+        result = factory()
+        cache.set(None, key, result, generation)
+    return result
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tracking of users entering and leaving segments as they are materialized.
+
+When the membership of a segment is recorded it is compared with the
+previously recorded membership, logging the differences and firing
+:class:`.UserEnteredSegment` and :class:`.UserExitedSegment` events for
+them once the transaction commits, so consumers can follow membership
+changes incrementally.  The first recording only establishes a baseline.
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+import BTrees
+
+import transaction
+
+from persistent import Persistent
+
+from zope import component
+from zope import interface
+
+from zope.annotation import factory as an_factory
+
+from zope.container.contained import Contained
+
+from zope.event import notify
+
+from zope.intid.interfaces import IIntIds
+
+from nti.app.segments.interfaces import ISegmentMembershipLog
+from nti.app.segments.interfaces import UserEnteredSegment
+from nti.app.segments.interfaces import UserExitedSegment
+
+from nti.segments.interfaces import IUserSegment
+
+#: Maximum number of changes retained per segment
+DEFAULT_CHANGE_LOG_SIZE = 500
+
+logger = __import__('logging').getLogger(__name__)
+
+
+@component.adapter(IUserSegment)
+@interface.implementer(ISegmentMembershipLog)
+class SegmentMembershipLog(Persistent, Contained):
+
+    family = BTrees.family64
+
+    max_entries = DEFAULT_CHANGE_LOG_SIZE
+
+    def __init__(self):
+        # The members at the last materialization, None until there is one
+        self.members = None
+        self.sequence = 0
+        # sequence -> (timestamp, entered usernames, exited usernames)
+        self.entries = self.family.IO.BTree()
+
+    def diff(self, intids):
+        """
+        The intids entering and leaving the segment if the given intids
+        became its members.
+        """
+        IF = self.family.IF
+        if not isinstance(intids, (IF.Set, IF.TreeSet)):
+            intids = IF.Set(intids)
+        if self.members is None:
+            return IF.Set(), IF.Set()
+        return (IF.difference(intids, self.members),
+                IF.difference(self.members, intids))
+
+    def record(self, intids, entered=(), exited=()):
+        if self.members is None:
+            self.members = self.family.IF.TreeSet(intids)
+            return
+        entered_ids, exited_ids = self.diff(intids)
+        self.members.update(entered_ids)
+        for doc_id in exited_ids:
+            self.members.remove(doc_id)
+        if not entered and not exited:
+            return
+        self.sequence += 1
+        self.entries[self.sequence] = (time.time(), tuple(entered), tuple(exited))
+        while self.sequence - self.entries.minKey() >= self.max_entries:
+            del self.entries[self.entries.minKey()]
+
+    def changes_since(self, sequence):
+        if sequence < 0 or sequence > self.sequence:
+            return None
+        if sequence < self.sequence and sequence + 1 < self.entries.minKey():
+            return None
+        entered, exited = set(), set()
+        for _, added, removed in self.entries.values(sequence + 1):
+            for username in added:
+                if username in exited:
+                    exited.discard(username)
+                else:
+                    entered.add(username)
+            for username in removed:
+                if username in entered:
+                    entered.discard(username)
+                else:
+                    exited.add(username)
+        return sorted(entered), sorted(exited)
+
+
+_SegmentMembershipLogFactory = an_factory(SegmentMembershipLog,
+                                          'nti.app.segments.membership-log')
+
+
+def _users(intids, doc_ids):
+    result = []
+    for doc_id in doc_ids:
+        user = intids.queryObject(doc_id)
+        if user is not None:
+            result.append(user)
+    return result
+
+
+def _notify_after_commit(success, segment, entered, exited):
+    if not success:
+        return
+    for user in entered:
+        notify(UserEnteredSegment(user, segment))
+    for user in exited:
+        notify(UserExitedSegment(user, segment))
+
+
+def record_membership(segment, members):
+    """
+    Record the given intids as the members of the segment, firing events
+    for the users entering and leaving it since the last recording once
+    (and only if) the current transaction commits.  Subscribers run
+    outside of that transaction.
+    """
+    log = ISegmentMembershipLog(segment)
+    entered_ids, exited_ids = log.diff(members)
+    if log.members is not None and not entered_ids and not exited_ids:
+        return
+
+    intids = component.getUtility(IIntIds)
+    entered = _users(intids, entered_ids)
+    exited = _users(intids, exited_ids)
+    log.record(members,
+               [user.username for user in entered],
+               [user.username for user in exited])
+    if entered or exited:
+        transaction.get().addAfterCommitHook(_notify_after_commit,
+                                             args=(segment, entered, exited))
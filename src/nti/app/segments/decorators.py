@@ -11,13 +11,24 @@ from zope import interface
 from nti.app.renderers.decorators import AbstractAuthenticatedRequestAwareDecorator
 
 from nti.app.segments import MEMBERS
+from nti.app.segments import VIEW_EXPLAIN
 from nti.app.segments import VIEW_EXPORT_MEMBERS
+from nti.app.segments import VIEW_MEMBER_CHANGES
+from nti.app.segments import VIEW_MEMBER_COUNT
 from nti.app.segments import VIEW_MEMBERS_PREVIEW
+from nti.app.segments import VIEW_REFRESH
+
+from nti.app.segments.fingerprint import filter_set_fingerprint
+
+from nti.app.segments.membership import segment_member_count
 
 from nti.appserver.pyramid_authorization import has_permission
 
+from nti.common.string import is_true
+
 from nti.dataserver.authorization import ACT_DELETE
 from nti.dataserver.authorization import ACT_SEARCH
+from nti.dataserver.authorization import ACT_UPDATE
 
 from nti.externalization.interfaces import IExternalMappingDecorator
 from nti.externalization.interfaces import StandardExternalFields
@@ -25,6 +36,7 @@ from nti.externalization.interfaces import StandardExternalFields
 from nti.links import Link
 
 from nti.segments.interfaces import ISegment
+from nti.segments.interfaces import IUserSegment
 
 from pyramid.interfaces import IRequest
 
@@ -36,18 +48,43 @@ LINKS = StandardExternalFields.LINKS
 class SegmentLinkDecorator(AbstractAuthenticatedRequestAwareDecorator):
 
     def _do_decorate_external(self, context, result):
+        if IUserSegment.providedBy(context):
+            result['FilterSetFingerprint'] = filter_set_fingerprint(context.filter_set)
+
         links = []
         if has_permission(ACT_DELETE, context, self.request):
             links.append(Link(context,
                               rel='delete',
                               method='DELETE'))
 
+        if      IUserSegment.providedBy(context) \
+                and has_permission(ACT_UPDATE, context, self.request):
+            links.append(Link(context,
+                              rel='refresh',
+                              elements=(VIEW_REFRESH,),
+                              method='PUT'))
+
         if has_permission(ACT_SEARCH, context, self.request):
             links.append(Link(context,
                               rel='members',
                               elements=(MEMBERS,),
                               method='GET'))
 
+            links.append(Link(context,
+                              rel='member-count',
+                              elements=(MEMBERS, '@@' + VIEW_MEMBER_COUNT),
+                              method='GET'))
+
+            links.append(Link(context,
+                              rel='member-changes',
+                              elements=(MEMBERS, '@@' + VIEW_MEMBER_CHANGES),
+                              method='GET'))
+
+            links.append(Link(context,
+                              rel='record-member-changes',
+                              elements=(MEMBERS, '@@' + VIEW_MEMBER_CHANGES),
+                              method='POST'))
+
             links.append(Link(context,
                               rel='export-members',
                               elements=(MEMBERS, '@@' + VIEW_EXPORT_MEMBERS),
@@ -58,5 +95,15 @@ class SegmentLinkDecorator(AbstractAuthenticatedRequestAwareDecorator):
                               elements=(VIEW_MEMBERS_PREVIEW,),
                               method='PUT'))
 
+            links.append(Link(context,
+                              rel='explain',
+                              elements=(VIEW_EXPLAIN,),
+                              method='GET'))
+
+            # Opt-in, as this requires evaluating each segment
+            if      IUserSegment.providedBy(context) \
+                    and is_true(self.request.params.get('memberCount')):
+                result['MemberCount'] = segment_member_count(context)
+
         if links:
             result.setdefault(LINKS, []).extend(links)
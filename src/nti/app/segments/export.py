@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Chunked CSV rendering of segment members.
+
+Rows are produced from a sequence of user intids, resolving users a chunk
+at a time and minimizing the ZODB object cache between chunks, so memory
+use is independent of the number of members.
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import csv
+
+from BTrees.OOBTree import OOTreeSet
+
+import six
+
+import transaction
+
+from zope import component
+
+from zope.annotation.interfaces import IAnnotations
+
+from zope.component.hooks import site as current_site
+
+from zope.intid import IIntIds
+
+from nti.app.users.views.view_mixins import UsersCSVExportMixin
+
+from nti.dataserver.interfaces import IDataserver
+from nti.dataserver.interfaces import IDataserverFolder
+
+from nti.identifiers.interfaces import IUserExternalIdentityContainer
+
+from nti.traversal.traversal import find_interface
+
+logger = __import__('logging').getLogger(__name__)
+
+#: Number of users resolved between object cache minimizations
+DEFAULT_CHUNK_SIZE = 500
+
+#: Annotation key, on the dataserver folder, of the types of the external
+#: identifiers users have been given
+EXTERNAL_ID_TYPES_KEY = 'nti.app.segments.external-id-types'
+
+
+def _text(value):
+    if value is None:
+        return u''
+    return value if isinstance(value, six.text_type) else six.text_type(value)
+
+
+def csv_lines(rows):
+    """
+    Render the given rows as UTF-8 encoded CSV.
+    """
+    if six.PY2:  # pragma: no cover
+        stream = six.BytesIO()
+        rows = [[x.encode('utf-8') for x in row] for row in rows]
+    else:
+        stream = six.StringIO()
+    writer = csv.writer(stream)
+    for row in rows:
+        writer.writerow(row)
+    result = stream.getvalue()
+    if isinstance(result, six.text_type):
+        result = result.encode('utf-8')
+    return result
+
+
+def external_ids(user):
+    container = IUserExternalIdentityContainer(user, None)
+    return getattr(container, 'external_ids', None) or {}
+
+
+def known_external_id_types(ds_folder):
+    """
+    The sorted types of the external identifiers users have been given,
+    each a column of exports.
+    """
+    annotations = IAnnotations(ds_folder, None)
+    known = annotations.get(EXTERNAL_ID_TYPES_KEY) if annotations is not None else None
+    return sorted(known) if known else []
+
+
+def record_external_id_types(user):
+    """
+    Record the types of the user's external identifiers, writing only if
+    a type is new.
+    """
+    types = external_ids(user)
+    ds_folder = find_interface(user, IDataserverFolder) if types else None
+    if ds_folder is None:
+        return
+    annotations = IAnnotations(ds_folder)
+    known = annotations.get(EXTERNAL_ID_TYPES_KEY)
+    missing = [x for x in types if known is None or x not in known]
+    if missing:
+        if known is None:
+            known = annotations[EXTERNAL_ID_TYPES_KEY] = OOTreeSet()
+        known.update(missing)
+
+
+class MembersCSVExport(UsersCSVExportMixin):
+    """
+    The columns, and row values, of the users export, usable outside of
+    its views (and requests).
+    """
+
+    request = None
+
+    def header(self, external_id_types=()):
+        return [_text(x) for x in self._get_header(external_id_types)]
+
+    def row(self, user):
+        """
+        The values of the user, keyed by column.
+        """
+        return dict(self._build_user_info(user, ()))
+
+
+def iter_user_chunks(doc_ids, chunk_size=DEFAULT_CHUNK_SIZE, intids=None):
+    """
+    Yield lists of users for the given intids, in order, minimizing the
+    object cache of the connection they were loaded from after each chunk
+    has been consumed.
+    """
+    intids = intids if intids is not None else component.getUtility(IIntIds)
+    chunk = []
+    for doc_id in doc_ids:
+        user = intids.queryObject(doc_id)
+        if user is not None:
+            chunk.append(user)
+        if len(chunk) >= chunk_size:
+            jar = getattr(chunk[-1], '_p_jar', None)
+            yield chunk
+            chunk = []
+            if jar is not None:
+                jar.cacheMinimize()
+    if chunk:
+        yield chunk
+
+
+def iter_members_csv(doc_ids, chunk_size=DEFAULT_CHUNK_SIZE, intids=None,
+                     on_chunk=None, export=None, external_id_types=()):
+    """
+    Yield encoded CSV for the users with the given intids: a header row,
+    with a column for each of the given external identifier types,
+    followed by a chunk of rows at a time.  If given, ``on_chunk`` is
+    called with the number of rows in each chunk as it is produced.
+    """
+    export = export if export is not None else MembersCSVExport()
+    header = export.header(external_id_types)
+    yield csv_lines([header])
+    for chunk in iter_user_chunks(doc_ids, chunk_size, intids):
+        rows = []
+        for user in chunk:
+            values = export.row(user)
+            values.update(external_ids(user))
+            rows.append([_text(values.get(x)) for x in header])
+        lines = csv_lines(rows)
+        if on_chunk is not None:
+            on_chunk(len(chunk))
+        yield lines
+
+
+def iter_members_csv_detached(doc_ids, chunk_size=DEFAULT_CHUNK_SIZE,
+                              on_chunk=None, db=None, export=None):
+    """
+    As with :func:`iter_members_csv`, but loading users through a
+    dedicated, read-only connection, allowing the result to be consumed
+    (e.g. as a response ``app_iter``) after the current transaction and
+    connection have ended.  Every known external identifier type is a
+    column, so rows are written as users are loaded.
+    """
+    db = db if db is not None else component.getUtility(IDataserver).db
+    doc_ids = tuple(doc_ids)
+
+    def _iter():
+        tm = transaction.TransactionManager()
+        conn = db.open(transaction_manager=tm)
+        try:
+            tm.begin()
+            ds_folder = conn.root()['nti.dataserver']
+            with current_site(ds_folder):
+                intids = component.getUtility(IIntIds)
+            external_id_types = known_external_id_types(ds_folder)
+            lines_iter = iter_members_csv(doc_ids, chunk_size, intids,
+                                          on_chunk=on_chunk,
+                                          export=export,
+                                          external_id_types=external_id_types)
+            while True:
+                # Only hold the site while producing each chunk, never
+                # while suspended in the consumer
+                with current_site(ds_folder):
+                    lines = next(lines_iter, None)
+                if lines is None:
+                    break
+                yield lines
+        finally:
+            tm.abort()
+            conn.close()
+
+    return _iter()
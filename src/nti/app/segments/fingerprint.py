@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Canonical forms and fingerprints of filter set trees.
+
+Equivalent filter sets share a canonical form: children of unions and
+intersections are unordered and deduplicated, nested combinators of the
+same type are flattened and single children replace their combinator.
+Leaves are described by what they select (e.g. the index and range of a
+time range filter set) or, for leaves we don't know, their external form.
+
+The fingerprint is a hash of the canonical form, identifying "the same
+filter" across segments, previews and processes.
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+
+from nti.app.segments.interfaces import IIsDeactivatedFilterSet
+from nti.app.segments.interfaces import ITimeRangeFilterSet
+
+from nti.coremetadata.interfaces import IX_IS_DEACTIVATED
+
+from nti.externalization.externalization import to_external_object
+
+from nti.externalization.interfaces import StandardExternalFields
+
+from nti.segments.interfaces import IIntersectionUserFilterSet
+from nti.segments.interfaces import IUnionUserFilterSet
+
+OP_INTERSECTION = u'intersection'
+OP_UNION = u'union'
+
+#: The form of a missing child, which selects everything
+_NONE_FORM = (u'none',)
+
+#: External fields not affecting what a filter set selects
+_IGNORED_FIELDS = frozenset((StandardExternalFields.CONTAINER_ID,
+                             StandardExternalFields.CREATED_TIME,
+                             StandardExternalFields.CREATOR,
+                             StandardExternalFields.HREF,
+                             StandardExternalFields.ID,
+                             StandardExternalFields.LAST_MODIFIED,
+                             StandardExternalFields.LINKS,
+                             StandardExternalFields.NTIID,
+                             StandardExternalFields.OID))
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def _dumps(form):
+    return json.dumps(form, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(x) for x in value)
+    return value
+
+
+def _period_form(period):
+    if period is None:
+        return None
+    duration = getattr(period, 'duration', None)
+    if duration is not None:
+        return (u'offset', duration.total_seconds(), period.operator,
+                getattr(period, 'granularity', None))
+    start, end = period.range_tuple
+    return (u'range', start, end)
+
+
+def _leaf_form(filter_set):
+    if ITimeRangeFilterSet.providedBy(filter_set):
+        return (u'time-range', filter_set.index_name,
+                _period_form(filter_set.period))
+    if IIsDeactivatedFilterSet.providedBy(filter_set):
+        return (u'deactivated', bool(filter_set.Deactivated))
+    external = to_external_object(filter_set, decorate=False)
+    return (u'external', _freeze(dict((k, v) for k, v in external.items()
+                                      if k not in _IGNORED_FIELDS)))
+
+
+def canonical_filter_set(filter_set):
+    """
+    The canonical form of the given filter set (None for no filter set),
+    as nested tuples.  Equivalent filter sets have equal forms.
+    """
+    if filter_set is None:
+        return None
+    if IIntersectionUserFilterSet.providedBy(filter_set):
+        op = OP_INTERSECTION
+    elif IUnionUserFilterSet.providedBy(filter_set):
+        op = OP_UNION
+    else:
+        return _leaf_form(filter_set)
+
+    children = set()
+    for child in filter_set.filter_sets or ():
+        form = canonical_filter_set(child) if child is not None else _NONE_FORM
+        if form[0] == op:
+            children.update(form[1])
+        else:
+            children.add(form)
+    if len(children) == 1:
+        return children.pop()
+    return (op, tuple(sorted(children, key=_dumps)))
+
+
+def filter_set_fingerprint(filter_set):
+    """
+    A compact hash of the canonical form of the given filter set, equal for
+    equivalent filter sets.
+    """
+    form = _dumps(canonical_filter_set(filter_set))
+    return hashlib.sha1(form.encode('utf-8')).hexdigest()
+
+
+def filter_set_indexes(filter_set):
+    """
+    The sorted names of the indexes the given filter set selects on (empty
+    for no filter set), or None if it has leaves we don't know, which may
+    depend on anything.
+    """
+    if filter_set is None:
+        return ()
+    if     IIntersectionUserFilterSet.providedBy(filter_set) \
+        or IUnionUserFilterSet.providedBy(filter_set):
+        result = set()
+        for child in filter_set.filter_sets or ():
+            indexes = filter_set_indexes(child)
+            if indexes is None:
+                return None
+            result.update(indexes)
+        return tuple(sorted(result))
+    if ITimeRangeFilterSet.providedBy(filter_set):
+        return (filter_set.index_name,)
+    if IIsDeactivatedFilterSet.providedBy(filter_set):
+        return (IX_IS_DEACTIVATED,)
+    return None
@@ -10,6 +10,8 @@ from zope import interface
 
 from zope.component.hooks import site as current_site
 
+from nti.app.segments.generations.sites import process_host_sites
+
 from nti.app.segments.model import IsDeactivatedFilterSet
 
 from nti.dataserver.interfaces import IDataserver
@@ -18,8 +20,6 @@ from nti.dataserver.interfaces import IOIDResolver
 from nti.segments.interfaces import IIsDeactivatedFilterSet
 from nti.segments.interfaces import ISegmentsContainer
 
-from nti.site.hostpolicy import get_all_host_sites
-
 generation = 2
 
 logger = __import__('logging').getLogger(__name__)
@@ -57,21 +57,20 @@ def migrated_filterset(filter_set):
     return modified, result_fs
 
 
-def process_site(updated):
-    site_modified = False
+def process_site(_unused_site=None):
+    updated = 0
     segments_container = component.getUtility(ISegmentsContainer)
     for segment in segments_container.values():
         modified, result_fs = migrated_filterset(segment.filter_set)
         if modified:
             segment.filter_set = result_fs
-            site_modified = True
             segment._p_changed = True
-            updated.add(segment)
+            updated += 1
 
-    return site_modified
+    return updated
 
 
-def do_evolve(context, generation=generation):
+def do_evolve(context, generation=generation, commit=False):
     conn = context.connection
     ds_folder = conn.root()['nti.dataserver']
 
@@ -83,17 +82,14 @@ def do_evolve(context, generation=generation):
         assert component.getSiteManager() == ds_folder.getSiteManager(), \
             "Hooks not installed?"
 
-        sites = get_all_host_sites()
-        updated = set()
-        sites_updated = 0
-        for site in sites:
-            with current_site(site):
-                if process_site(updated):
-                    sites_updated += 1
-
-    component.getGlobalSiteManager().unregisterUtility(mock_ds, IDataserver)
+    try:
+        updated = process_host_sites(context, process_site, generation,
+                                     commit=commit)
+    finally:
+        component.getGlobalSiteManager().unregisterUtility(mock_ds, IDataserver)
     logger.info('Evolution %s done.  Updated %s segments in %d/%d sites',
-                generation, len(updated), sites_updated, len(sites))
+                generation, sum(updated), len([x for x in updated if x]),
+                len(updated))
 
 
 def evolve(context):
@@ -101,4 +97,4 @@ def evolve(context):
     Evolve to generation 2 by migrating all deactivated user filtersets to the
     new class in nti.app.segments (from nti.segments)
     """
-    do_evolve(context, generation)
+    do_evolve(context, generation, commit=True)
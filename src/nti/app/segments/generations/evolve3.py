@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+from zope import component
+from zope import interface
+
+from zope.component.hooks import site as current_site
+
+from nti.app.segments.generations.sites import process_host_sites
+
+from nti.app.segments.index import index_segments
+from nti.app.segments.index import install_segments_catalog
+
+from nti.dataserver.interfaces import IDataserver
+from nti.dataserver.interfaces import IOIDResolver
+
+from nti.segments.interfaces import ISegmentsContainer
+
+from nti.site.interfaces import IHostPolicyFolder
+
+from nti.traversal.traversal import find_interface
+
+generation = 3
+
+logger = __import__('logging').getLogger(__name__)
+
+
+@interface.implementer(IDataserver)
+class MockDataserver(object):
+
+    root = None
+
+    def get_by_oid(self, oid, ignore_creator=False):
+        resolver = component.queryUtility(IOIDResolver)
+        if resolver is None:
+            logger.warn("Using dataserver without a proper ISiteManager.")
+        else:
+            return resolver.get_object_by_oid(oid, ignore_creator=ignore_creator)
+        return None
+
+
+def process_site(site):
+    catalog = install_segments_catalog(site)
+    container = component.queryUtility(ISegmentsContainer)
+    # Ignore any container inherited from a parent site
+    if container is None or find_interface(container, IHostPolicyFolder) is not site:
+        return 0
+    return index_segments(catalog, container)
+
+
+def do_evolve(context, generation=generation, commit=False):
+    conn = context.connection
+    ds_folder = conn.root()['nti.dataserver']
+
+    mock_ds = MockDataserver()
+    mock_ds.root = ds_folder
+    component.provideUtility(mock_ds, IDataserver)
+
+    with current_site(ds_folder):
+        assert component.getSiteManager() == ds_folder.getSiteManager(), \
+            "Hooks not installed?"
+
+    try:
+        indexed = process_host_sites(context, process_site, generation,
+                                     commit=commit)
+    finally:
+        component.getGlobalSiteManager().unregisterUtility(mock_ds, IDataserver)
+    logger.info('Evolution %s done.  Indexed %s segments in %d sites',
+                generation, sum(indexed), len(indexed))
+
+
+def evolve(context):
+    """
+    Evolve to generation 3 by installing the segments catalog in all host
+    sites and indexing their existing segments.
+    """
+    do_evolve(context, generation, commit=True)
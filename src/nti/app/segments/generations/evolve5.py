@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+from zope import component
+from zope import interface
+
+from zope.component.hooks import site as current_site
+
+from zope.intid.interfaces import IIntIds
+
+from nti.app.segments.generations.sites import process_host_sites
+
+from nti.app.segments.index import IX_NAME
+from nti.app.segments.index import IX_NORMALIZED_TITLE
+from nti.app.segments.index import create_segments_catalog
+from nti.app.segments.index import get_segments_catalog
+
+from nti.dataserver.interfaces import IDataserver
+from nti.dataserver.interfaces import IOIDResolver
+
+from nti.segments.interfaces import ISegmentsContainer
+
+from nti.site.interfaces import IHostPolicyFolder
+
+from nti.traversal.traversal import find_interface
+
+generation = 5
+
+logger = __import__('logging').getLogger(__name__)
+
+
+@interface.implementer(IDataserver)
+class MockDataserver(object):
+
+    root = None
+
+    def get_by_oid(self, oid, ignore_creator=False):
+        resolver = component.queryUtility(IOIDResolver)
+        if resolver is None:
+            logger.warn("Using dataserver without a proper ISiteManager.")
+        else:
+            return resolver.get_object_by_oid(oid, ignore_creator=ignore_creator)
+        return None
+
+
+def process_site(site):
+    catalog = get_segments_catalog(site)
+    if catalog is None:
+        return 0
+    intids = component.getUtility(IIntIds)
+    if IX_NAME not in catalog:
+        create_segments_catalog(catalog)
+        intids.register(catalog[IX_NAME])
+    # Never queried, so not worth maintaining
+    if IX_NORMALIZED_TITLE in catalog:
+        unused = catalog[IX_NORMALIZED_TITLE]
+        if intids.queryId(unused) is not None:
+            intids.unregister(unused)
+        del catalog[IX_NORMALIZED_TITLE]
+
+    container = component.queryUtility(ISegmentsContainer)
+    # Ignore any container inherited from a parent site
+    if container is None or find_interface(container, IHostPolicyFolder) is not site:
+        return 0
+    index = catalog[IX_NAME]
+    count = 0
+    for segment in container.values():
+        doc_id = intids.queryId(segment)
+        if doc_id is not None:
+            index.index_doc(doc_id, segment)
+            count += 1
+    return count
+
+
+def do_evolve(context, generation=generation, commit=False):
+    conn = context.connection
+    ds_folder = conn.root()['nti.dataserver']
+
+    mock_ds = MockDataserver()
+    mock_ds.root = ds_folder
+    component.provideUtility(mock_ds, IDataserver)
+
+    with current_site(ds_folder):
+        assert component.getSiteManager() == ds_folder.getSiteManager(), \
+            "Hooks not installed?"
+
+    try:
+        indexed = process_host_sites(context, process_site, generation,
+                                     commit=commit)
+    finally:
+        component.getGlobalSiteManager().unregisterUtility(mock_ds, IDataserver)
+    logger.info('Evolution %s done.  Indexed %s segment names in %d sites',
+                generation, sum(indexed), len(indexed))
+
+
+def evolve(context):
+    """
+    Evolve to generation 5 by adding the name index to the segments
+    catalogs, so listings cover segments lacking other indexed values,
+    and removing the unused normalized title index.
+    """
+    do_evolve(context, generation, commit=True)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+from zope.component.hooks import site as current_site
+
+from nti.app.segments.export import known_external_id_types
+from nti.app.segments.export import record_external_id_types
+
+from nti.app.segments.generations.sites import batch_size
+
+from nti.coremetadata.interfaces import IUser
+
+generation = 6
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def do_evolve(context, generation=generation, size=None):  # pylint: disable=redefined-outer-name
+    conn = context.connection
+    tm = conn.transaction_manager
+    ds_folder = conn.root()['nti.dataserver']
+    size = batch_size() if size is None else size
+
+    count = 0
+    with current_site(ds_folder):
+        for user in ds_folder['users'].values():
+            if not IUser.providedBy(user):
+                continue
+            record_external_id_types(user)
+            count += 1
+            if count % size == 0:
+                # Changes are out of the cache, so everything may be released
+                tm.savepoint(optimistic=True)
+                conn.cacheMinimize()
+        types = known_external_id_types(ds_folder)
+    logger.info('Evolution %s done.  Recorded %d external identifier types of %d users',
+                generation, len(types), count)
+
+
+def evolve(context):
+    """
+    Evolve to generation 6 by recording the external identifier types of
+    existing users, so exports know their columns before any rows.
+    """
+    do_evolve(context, generation)
@@ -14,15 +14,18 @@ from zope.generations.generations import SchemaManager as BaseSchemaManager
 
 from zope.generations.interfaces import IInstallableSchemaManager
 
+from nti.app.segments.generations.sites import process_host_sites
+
+from nti.app.segments.index import index_segments
+from nti.app.segments.index import install_segments_catalog
+
 from nti.coremetadata.interfaces import IDataserver
 
 from nti.dataserver.interfaces import IOIDResolver
 
 from nti.segments.model import install_segments_container
 
-from nti.site import get_all_host_sites
-
-generation = 2
+generation = 6
 
 logger = __import__('logging').getLogger(__name__)
 
@@ -57,7 +60,15 @@ class MockDataserver(object):
         return None
 
 
-def do_evolve(context, generation=generation):  # pylint: disable=redefined-outer-name
+def process_site(site):
+    container = install_segments_container(site)
+    catalog = install_segments_catalog(site)
+    index_segments(catalog, container)
+    logger.info('Installed segments container for site %s',
+                site.__name__)
+
+
+def do_evolve(context, generation=generation, commit=False):  # pylint: disable=redefined-outer-name
     conn = context.connection
     ds_folder = conn.root()['nti.dataserver']
 
@@ -69,14 +80,14 @@ def do_evolve(context, generation=generation):  # pylint: disable=redefined-oute
         assert component.getSiteManager() == ds_folder.getSiteManager(), \
             "Hooks not installed?"
 
-        for site in get_all_host_sites():
-            install_segments_container(site)
-            logger.info('Installed segments container for site %s',
-                        site.__name__)
+    try:
+        process_host_sites(context, process_site, generation, commit=commit)
+    finally:
+        component.getGlobalSiteManager().unregisterUtility(mock_ds, IDataserver)
 
 
 def evolve(context):
     """
-    Ensure a segment container is installed in all host sites.
+    Ensure a segment container and catalog are installed in all host sites.
     """
-    do_evolve(context, generation)
+    do_evolve(context, generation, commit=True)
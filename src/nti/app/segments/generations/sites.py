@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Processing of every host site in generations.
+
+Sites are processed in batches, with a savepoint (or commit) and the
+connection cache minimized after each batch, so memory use is bounded by
+the batch rather than by all sites.  When committing, the sites completed
+are recorded in the database so an interrupted evolution resumes from
+where it stopped, and batches may be spread across worker threads, each
+with its own connection.
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import threading
+import time
+
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
+
+from six.moves import queue as Queue
+
+import transaction
+
+from zope.component.hooks import site as current_site
+
+from nti.site.hostpolicy import get_all_host_sites
+from nti.site.hostpolicy import get_host_site
+
+#: Sites processed between savepoints (or commits)
+BATCH_SIZE_ENV = 'NTI_SEGMENTS_EVOLVE_BATCH_SIZE'
+DEFAULT_BATCH_SIZE = 50
+
+#: Worker threads committing batches in parallel; zero to process sites
+#: serially
+WORKERS_ENV = 'NTI_SEGMENTS_EVOLVE_WORKERS'
+DEFAULT_WORKERS = 0
+
+#: Attempts at committing a batch conflicting with other workers
+DEFAULT_BATCH_ATTEMPTS = 3
+
+#: Database root key of the sites completed by interrupted evolutions
+PROGRESS_KEY = 'nti.app.segments.generations.progress'
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def batch_size():
+    return int(os.environ.get(BATCH_SIZE_ENV) or DEFAULT_BATCH_SIZE)
+
+
+def worker_count():
+    return int(os.environ.get(WORKERS_ENV) or DEFAULT_WORKERS)
+
+
+def _batches(names, size):
+    size = max(1, size)
+    for i in range(0, len(names), size):
+        yield names[i:i + size]
+
+
+def _completed_sites(conn, generation, create=False):
+    root = conn.root()
+    progress = root.get(PROGRESS_KEY)
+    if progress is None:
+        if not create:
+            return None
+        progress = root[PROGRESS_KEY] = OOBTree()
+    completed = progress.get(generation)
+    if completed is None and create:
+        completed = progress[generation] = OOTreeSet()
+    return completed
+
+
+def _clear_progress(conn, generation):
+    root = conn.root()
+    progress = root.get(PROGRESS_KEY)
+    if progress is not None:
+        progress.pop(generation, None)
+        if not progress:
+            del root[PROGRESS_KEY]
+
+
+class _Progress(object):
+    """
+    Logs the sites processed so far, and the rate, as batches finish.
+    """
+
+    def __init__(self, generation, total):
+        self.generation = generation
+        self.total = total
+        self.done = 0
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def batch_done(self, count):
+        with self._lock:
+            self.done += count
+            elapsed = max(time.time() - self.started, 1e-6)
+            logger.info('Generation %s processed %d/%d sites (%.1f sites/s)',
+                        self.generation, self.done, self.total,
+                        self.done / elapsed)
+
+
+def _process_batch(conn, names, process, completed=None):
+    results = []
+    ds_folder = conn.root()['nti.dataserver']
+    with current_site(ds_folder):
+        for name in names:
+            site = get_host_site(name, True)
+            # Removed since we started
+            if site is not None:
+                with current_site(site):
+                    results.append(process(site))
+            if completed is not None:
+                completed.add(name)
+    return results
+
+
+def _process_serially(conn, names, process, progress, size, generation, commit):
+    results = []
+    tm = conn.transaction_manager
+    completed = _completed_sites(conn, generation) if commit else None
+    for batch in _batches(names, size):
+        results.extend(_process_batch(conn, batch, process, completed))
+        if commit:
+            tm.commit()
+        else:
+            tm.savepoint(optimistic=True)
+        # Changes are out of the cache, so everything may be released
+        conn.cacheMinimize()
+        progress.batch_done(len(batch))
+    return results
+
+
+def _process_in_parallel(db, names, process, progress, size, generation, workers):
+    results = []
+    errors = []
+    lock = threading.Lock()
+    batches = Queue.Queue()
+    for batch in _batches(names, size):
+        batches.put(batch)
+
+    def _work():
+        tm = transaction.TransactionManager()
+        conn = db.open(transaction_manager=tm)
+        try:
+            while not errors:
+                try:
+                    batch = batches.get_nowait()
+                except Queue.Empty:
+                    return
+                for attempt in tm.attempts(DEFAULT_BATCH_ATTEMPTS):
+                    with attempt:
+                        completed = _completed_sites(conn, generation)
+                        batch_results = _process_batch(conn, batch, process,
+                                                       completed)
+                conn.cacheMinimize()
+                with lock:
+                    results.extend(batch_results)
+                progress.batch_done(len(batch))
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception('Unable to process sites')
+            errors.append(e)
+        finally:
+            tm.abort()
+            conn.close()
+
+    threads = []
+    for i in range(workers):
+        thread = threading.Thread(target=_work,
+                                  name='segments-evolve-%s' % i)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def process_host_sites(context, process, generation, size=None,
+                       commit=False, workers=None):
+    """
+    Call ``process`` with each host site, within that site, returning the
+    results (which shouldn't be persistent objects).
+
+    Unless committing, each batch of ``size`` sites ends with a savepoint
+    and everything happens within the current transaction.  Otherwise each
+    batch is committed and recorded as completed, and sites completed by
+    a previous, interrupted, call for the generation are skipped.  Given
+    ``workers``, batches are committed in parallel by that many threads,
+    each on its own connection.
+    """
+    conn = context.connection
+    tm = conn.transaction_manager
+    size = batch_size() if size is None else size
+    workers = worker_count() if workers is None else workers
+    commit = commit or workers > 0
+
+    ds_folder = conn.root()['nti.dataserver']
+    with current_site(ds_folder):
+        names = [site.__name__ for site in get_all_host_sites()]
+
+    if commit:
+        completed = _completed_sites(conn, generation, create=True)
+        remaining = [x for x in names if x not in completed]
+        if len(remaining) < len(names):
+            logger.info('Generation %s resuming with %d/%d sites completed',
+                        generation, len(names) - len(remaining), len(names))
+        names = remaining
+        # Workers (and resumed evolutions) need the progress committed
+        tm.commit()
+
+    progress = _Progress(generation, len(names))
+    if workers > 0:
+        results = _process_in_parallel(conn.db(), names, process, progress,
+                                       size, generation, workers)
+        # See the workers' changes
+        tm.begin()
+    else:
+        results = _process_serially(conn, names, process, progress,
+                                    size, generation, commit)
+
+    if commit:
+        _clear_progress(conn, generation)
+    return results
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from hamcrest import assert_that
+from hamcrest import contains_inanyorder
+from hamcrest import is_
+from hamcrest import not_none
+
+from zope import component
+
+from zope.intid.interfaces import IIntIds
+
+from nti.app.segments.generations import evolve3
+
+from nti.app.segments.index import IX_CREATOR
+from nti.app.segments.index import IX_TITLE
+from nti.app.segments.index import get_segments_catalog
+
+from nti.app.site.hostpolicy import create_site
+
+from nti.dataserver.tests import mock_dataserver as mock_dataserver
+
+from nti.dataserver.tests.mock_dataserver import DataserverLayerTest
+from nti.dataserver.tests.mock_dataserver import WithMockDSTrans
+
+from nti.segments.model import UserSegment
+from nti.segments.model import install_segments_container
+
+__docformat__ = "restructuredtext en"
+
+
+class TestEvolve3(DataserverLayerTest):
+
+    @WithMockDSTrans
+    def test_evolve3(self):
+        conn = mock_dataserver.current_transaction
+
+        class _Context(object):
+            pass
+        context = _Context()
+        context.connection = conn
+
+        site_one = create_site('site.one')
+        site_one_segments = install_segments_container(site_one)
+        segment = UserSegment(title=u'Segment One')
+        segment.creator = u'creator.one'
+        site_one_segments['seg.one'] = segment
+        site_one_segments['seg.two'] = UserSegment(title=u'Segment Two')
+
+        site_two = create_site('site.two')
+        install_segments_container(site_two)
+
+        evolve3.do_evolve(context)
+
+        intids = component.getUtility(IIntIds)
+        catalog = get_segments_catalog(site_one)
+        assert_that(catalog, not_none())
+        title_index = catalog[IX_TITLE]
+        assert_that(list(title_index.documents_to_values.keys()),
+                    contains_inanyorder(intids.getId(site_one_segments['seg.one']),
+                                        intids.getId(site_one_segments['seg.two'])))
+        assert_that(list(catalog[IX_CREATOR].values_to_documents.keys()),
+                    contains_inanyorder(u'creator.one'))
+
+        catalog = get_segments_catalog(site_two)
+        assert_that(catalog, not_none())
+        assert_that(len(catalog[IX_TITLE].documents_to_values), is_(0))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from hamcrest import assert_that
+from hamcrest import has_entries
+from hamcrest import has_key
+
+from zope import component
+from zope import interface
+
+from zope.annotation.interfaces import IAnnotations
+from zope.annotation.interfaces import IAttributeAnnotatable
+
+from zope.intid.interfaces import IIntIds
+
+from nti.app.segments.generations import evolve4
+
+from nti.app.segments.index import IX_REFRESH_INTERVAL
+from nti.app.segments.index import REFRESH_SETTINGS_KEY
+from nti.app.segments.index import install_segments_catalog
+
+from nti.app.segments.refresh import SegmentRefreshSettings
+
+from nti.app.site.hostpolicy import create_site
+
+from nti.dataserver.tests import mock_dataserver as mock_dataserver
+
+from nti.dataserver.tests.mock_dataserver import DataserverLayerTest
+from nti.dataserver.tests.mock_dataserver import WithMockDSTrans
+
+from nti.segments.model import UserSegment
+from nti.segments.model import install_segments_container
+
+__docformat__ = "restructuredtext en"
+
+
+class TestEvolve4(DataserverLayerTest):
+
+    @WithMockDSTrans
+    def test_evolve4(self):
+        conn = mock_dataserver.current_transaction
+
+        class _Context(object):
+            pass
+        context = _Context()
+        context.connection = conn
+
+        site = create_site('site.one')
+        container = install_segments_container(site)
+        refreshed = UserSegment(title=u'Refreshed')
+        interface.alsoProvides(refreshed, IAttributeAnnotatable)
+        container['seg.one'] = refreshed
+        container['seg.two'] = UserSegment(title=u'On Demand')
+
+        settings = SegmentRefreshSettings()
+        settings.interval = 600
+        IAnnotations(refreshed)[REFRESH_SETTINGS_KEY] = settings
+
+        # A catalog from before the index existed
+        catalog = install_segments_catalog(site)
+        del catalog[IX_REFRESH_INTERVAL]
+
+        evolve4.do_evolve(context)
+
+        assert_that(catalog, has_key(IX_REFRESH_INTERVAL))
+        intids = component.getUtility(IIntIds)
+        assert_that(dict(catalog[IX_REFRESH_INTERVAL].documents_to_values),
+                    has_entries({intids.getId(refreshed): 600}))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from hamcrest import assert_that
+from hamcrest import has_entries
+from hamcrest import has_key
+from hamcrest import is_not
+
+from zope import component
+
+from zope.intid.interfaces import IIntIds
+
+from nti.app.segments.generations import evolve5
+
+from nti.app.segments.index import IX_NAME
+from nti.app.segments.index import IX_NORMALIZED_TITLE
+from nti.app.segments.index import SegmentNormalizedTitleIndex
+from nti.app.segments.index import install_segments_catalog
+
+from nti.app.site.hostpolicy import create_site
+
+from nti.dataserver.tests import mock_dataserver as mock_dataserver
+
+from nti.dataserver.tests.mock_dataserver import DataserverLayerTest
+from nti.dataserver.tests.mock_dataserver import WithMockDSTrans
+
+from nti.segments.model import UserSegment
+from nti.segments.model import install_segments_container
+
+__docformat__ = "restructuredtext en"
+
+
+class TestEvolve5(DataserverLayerTest):
+
+    @WithMockDSTrans
+    def test_evolve5(self):
+        conn = mock_dataserver.current_transaction
+
+        class _Context(object):
+            pass
+        context = _Context()
+        context.connection = conn
+
+        site = create_site('site.one')
+        container = install_segments_container(site)
+        segment = UserSegment(title=u'Learners')
+        container['seg.one'] = segment
+
+        # A catalog from before the index existed, with the index since
+        # dropped
+        catalog = install_segments_catalog(site)
+        del catalog[IX_NAME]
+        catalog[IX_NORMALIZED_TITLE] = SegmentNormalizedTitleIndex()
+
+        evolve5.do_evolve(context)
+
+        assert_that(catalog, has_key(IX_NAME))
+        assert_that(catalog, is_not(has_key(IX_NORMALIZED_TITLE)))
+        intids = component.getUtility(IIntIds)
+        assert_that(dict(catalog[IX_NAME].documents_to_values),
+                    has_entries({intids.getId(segment): 'seg.one'}))
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from hamcrest import assert_that
+from hamcrest import contains
+
+from zope.annotation.interfaces import IAnnotations
+
+from nti.app.segments.export import EXTERNAL_ID_TYPES_KEY
+from nti.app.segments.export import known_external_id_types
+
+from nti.app.segments.generations import evolve6
+
+from nti.dataserver.tests import mock_dataserver as mock_dataserver
+
+from nti.dataserver.tests.mock_dataserver import DataserverLayerTest
+from nti.dataserver.tests.mock_dataserver import WithMockDSTrans
+
+from nti.dataserver.users import User
+
+from nti.identifiers.interfaces import IUserExternalIdentityContainer
+
+__docformat__ = "restructuredtext en"
+
+
+class TestEvolve6(DataserverLayerTest):
+
+    @WithMockDSTrans
+    def test_evolve6(self):
+        conn = mock_dataserver.current_transaction
+
+        class _Context(object):
+            pass
+        context = _Context()
+        context.connection = conn
+
+        for username, id_type in ((u'user.one', u'ext id1'),
+                                  (u'user.two', u'ext id2'),
+                                  (u'user.three', u'ext id1')):
+            user = User.create_user(username=username)
+            container = IUserExternalIdentityContainer(user)
+            container.add_external_mapping(id_type, username)
+
+        # Types given before they were recorded
+        ds_folder = conn.root()['nti.dataserver']
+        IAnnotations(ds_folder).pop(EXTERNAL_ID_TYPES_KEY, None)
+
+        evolve6.do_evolve(context, size=2)
+
+        assert_that(known_external_id_types(ds_folder),
+                    contains(u'ext id1', u'ext id2'))
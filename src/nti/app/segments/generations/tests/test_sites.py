@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
+
+import fudge
+
+from hamcrest import assert_that
+from hamcrest import contains
+from hamcrest import contains_inanyorder
+from hamcrest import has_key
+from hamcrest import is_not
+
+from zope.component.hooks import getSite
+
+from nti.app.segments.generations import sites
+
+from nti.app.segments.generations.sites import PROGRESS_KEY
+from nti.app.segments.generations.sites import process_host_sites
+
+from nti.app.site.hostpolicy import create_site
+
+from nti.dataserver.tests import mock_dataserver as mock_dataserver
+
+from nti.dataserver.tests.mock_dataserver import DataserverLayerTest
+from nti.dataserver.tests.mock_dataserver import mock_db_trans
+
+__docformat__ = "restructuredtext en"
+
+SITE_NAMES = ('site.one', 'site.two', 'site.three')
+
+
+def _site_name(site):
+    assert getSite() is site
+    return site.__name__
+
+
+class TestProcessHostSites(DataserverLayerTest):
+
+    def _context(self, conn):
+        return fudge.Fake().has_attr(connection=conn)
+
+    def _create_sites(self):
+        with mock_db_trans(self.ds):
+            for name in SITE_NAMES:
+                create_site(name)
+
+    @mock_dataserver.WithMockDS
+    def test_batches(self):
+        self._create_sites()
+        with mock_db_trans(self.ds) as conn:
+            result = process_host_sites(self._context(conn), _site_name, 1,
+                                        size=2)
+            assert_that(result, contains_inanyorder(*SITE_NAMES))
+            assert_that(conn.root(), is_not(has_key(PROGRESS_KEY)))
+
+    @mock_dataserver.WithMockDS
+    def test_resume(self):
+        self._create_sites()
+        with mock_db_trans(self.ds) as conn:
+            # A previous evolution was interrupted after the first site
+            conn.root()[PROGRESS_KEY] = OOBTree({1: OOTreeSet(['site.one'])})
+
+        with mock_db_trans(self.ds) as conn:
+            result = process_host_sites(self._context(conn), _site_name, 1,
+                                        size=1, commit=True)
+            assert_that(result, contains_inanyorder('site.two', 'site.three'))
+            assert_that(conn.root(), is_not(has_key(PROGRESS_KEY)))
+
+    @mock_dataserver.WithMockDS
+    def test_parallel(self):
+        self._create_sites()
+        with mock_db_trans(self.ds) as conn:
+            result = process_host_sites(self._context(conn), _site_name, 1,
+                                        size=1, workers=2)
+            assert_that(result, contains_inanyorder(*SITE_NAMES))
+            assert_that(conn.root(), is_not(has_key(PROGRESS_KEY)))
+
+    def test_split_batches(self):
+        assert_that(list(sites._batches(['a', 'b', 'c'], 2)),
+                    contains(['a', 'b'], ['c']))
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Incremental evaluation of last active filter sets.
+
+The users seen within the last N days are maintained from one evaluation
+to the next rather than rescanning the whole range.  Last seen times only
+move forward, so the users seen since an evaluation at time T are exactly
+those now indexed at or after T, and users leaving the sliding window are
+those still indexed between the previous and current start of the range.
+Both are range scans of the sorted index proportional to activity, rather
+than to the number of users.
+
+Entries are re-evaluated in full once older than the store's TTL, bounding
+any drift (e.g. from last seen times being moved backwards).
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+import time
+
+from zope import interface
+
+from nti.app.segments.cache import IntIdSetCache
+
+from nti.app.segments.interfaces import IIncrementalRangeStore
+from nti.app.segments.interfaces import RANGE_OP_AFTER
+
+#: Seconds after which a maintained range is re-evaluated in full
+DEFAULT_INCREMENTAL_MAX_AGE = 3600
+
+#: Maximum number of maintained ranges retained per process
+DEFAULT_INCREMENTAL_MAX_ENTRIES = 500
+
+#: Seconds the users seen since an evaluation are looked back beyond it,
+#: covering last seen times committed late or from skewed clocks
+DEFAULT_INCREMENTAL_MARGIN = 60
+
+logger = __import__('logging').getLogger(__name__)
+
+
+class RangeSnapshot(object):
+    """
+    The intids indexed within ``[start, inf)`` as of ``evaluated_at``,
+    updated in place under ``lock``.
+    """
+
+    def __init__(self, intids, start, evaluated_at):
+        self.intids = intids
+        self.start = start
+        self.evaluated_at = evaluated_at
+        self.lock = threading.Lock()
+
+
+@interface.implementer(IIncrementalRangeStore)
+class IncrementalRangeStore(IntIdSetCache):
+
+    margin = DEFAULT_INCREMENTAL_MARGIN
+
+    def __init__(self, ttl=DEFAULT_INCREMENTAL_MAX_AGE,
+                 max_entries=DEFAULT_INCREMENTAL_MAX_ENTRIES):
+        super(IncrementalRangeStore, self).__init__(ttl, max_entries)
+
+    def _copy(self, snapshot):
+        return snapshot
+
+
+def incremental_key(filter_set):
+    """
+    A key for the given filter set's range, or None if its range can't be
+    maintained incrementally (only open ended "after" ranges can).
+    """
+    period = filter_set.period
+    if getattr(period, 'operator', None) != RANGE_OP_AFTER \
+            or getattr(period, 'duration', None) is None:
+        return None
+    return (filter_set.index_name, period.duration,
+            getattr(period, 'granularity', None))
+
+
+def _update(snapshot, filter_set, start, now, margin):
+    # Users leaving the window, unless seen since
+    if start > snapshot.start:
+        intids = snapshot.intids
+        for doc_id in filter_set.included_intids(snapshot.start, start):
+            if doc_id in intids:
+                intids.remove(doc_id)
+    # Users seen since the previous evaluation
+    snapshot.intids.update(filter_set.included_intids(snapshot.evaluated_at - margin,
+                                                      None))
+    snapshot.start = start
+    snapshot.evaluated_at = now
+
+
+def incremental_apply(filter_set, initial_set, store):
+    """
+    Apply the time range filter set to the initial set using (and
+    maintaining) its range in the given :class:`.IIncrementalRangeStore`.
+    Returns None if the filter set's range can't be maintained.
+    """
+    key = incremental_key(filter_set)
+    start, _ = filter_set.period.range_tuple
+    if key is None or start is None:
+        return None
+
+    now = time.time()
+    snapshot = store.get(None, key)
+    if snapshot is not None:
+        with snapshot.lock:
+            # Ranges shorter than the time since the previous evaluation
+            # (or moving backwards) can't be updated from it
+            if snapshot.start <= start <= snapshot.evaluated_at - store.margin:
+                _update(snapshot, filter_set, start, now, store.margin)
+                return initial_set.intersection(snapshot.intids)
+
+    generation = store.generation(None)
+    included = store.family.IF.TreeSet(filter_set.included_intids(start, None))
+    # Once stored, the snapshot may be updated by other threads
+    result = initial_set.intersection(included)
+    store.set(None, key, RangeSnapshot(included, start, now), generation)
+    return result
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+A per-site catalog of segments, allowing segment listings to be filtered,
+sorted and batched without loading every segment.
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import BTrees
+
+from zope import component
+from zope import interface
+
+from zope.annotation.interfaces import IAnnotations
+
+from zope.component.hooks import getSite
+
+from zope.intid.interfaces import IIntIds
+
+from zope.location import locate
+
+from nti.app.segments.interfaces import ISegmentsCatalog
+
+from nti.segments.interfaces import ISegment
+from nti.segments.interfaces import IUserSegment
+
+from nti.zope_catalog.catalog import Catalog
+
+from nti.zope_catalog.datetime import TimestampToNormalized64BitIntNormalizer
+
+from nti.zope_catalog.index import AttributeValueIndex as ValueIndex
+from nti.zope_catalog.index import IntegerValueIndex as RawIntegerValueIndex
+from nti.zope_catalog.index import NormalizationWrapper
+
+CATALOG_NAME = 'nti.dataserver.++etc++segments-catalog'
+
+IX_NAME = 'name'
+IX_TITLE = 'title'
+#: No longer created, removed from existing catalogs by generation 5
+IX_NORMALIZED_TITLE = 'normalizedTitle'
+IX_CREATOR = 'creator'
+IX_CREATEDTIME = 'createdTime'
+IX_LASTMODIFIED = 'lastModified'
+IX_REFRESH_INTERVAL = 'refreshInterval'
+
+#: Annotation key of the refresh settings of a segment
+REFRESH_SETTINGS_KEY = 'nti.app.segments.refresh-settings'
+
+logger = __import__('logging').getLogger(__name__)
+
+
+class ValidatingName(object):
+    """
+    The name of a segment within its container.  Every contained segment
+    has one, so the index covers all cataloged segments.
+    """
+
+    __slots__ = ('name',)
+
+    def __init__(self, obj, unused_default=None):
+        name = getattr(obj, '__name__', None) if ISegment.providedBy(obj) else None
+        if name:
+            self.name = name
+
+    def __reduce__(self):
+        raise TypeError()
+
+
+class ValidatingNormalizedTitle(object):
+    """
+    The lower-cased title of a segment, for case insensitive matching.
+    """
+
+    __slots__ = ('normalizedTitle',)
+
+    def __init__(self, obj, unused_default=None):
+        title = getattr(obj, 'title', None) if ISegment.providedBy(obj) else None
+        if title:
+            self.normalizedTitle = title.lower()
+
+    def __reduce__(self):
+        raise TypeError()
+
+
+class ValidatingCreator(object):
+    """
+    The username of the creator of a segment.
+    """
+
+    __slots__ = ('creator',)
+
+    def __init__(self, obj, unused_default=None):
+        creator = getattr(obj, 'creator', None) if ISegment.providedBy(obj) else None
+        creator = getattr(creator, 'username', creator)
+        if creator:
+            self.creator = creator
+
+    def __reduce__(self):
+        raise TypeError()
+
+
+class ValidatingRefreshInterval(object):
+    """
+    The background refresh interval of a user segment, if it has one.
+    """
+
+    __slots__ = ('refreshInterval',)
+
+    def __init__(self, obj, unused_default=None):
+        annotations = IAnnotations(obj, None) if IUserSegment.providedBy(obj) else None
+        # Read without creating the settings
+        settings = annotations.get(REFRESH_SETTINGS_KEY) if annotations is not None else None
+        interval = getattr(settings, 'interval', None)
+        if interval:
+            self.refreshInterval = interval
+
+    def __reduce__(self):
+        raise TypeError()
+
+
+class SegmentNameIndex(ValueIndex):
+    default_field_name = 'name'
+    default_interface = ValidatingName
+
+
+class SegmentTitleIndex(ValueIndex):
+    default_field_name = 'title'
+    default_interface = ISegment
+
+
+# Retained so catalogs from before generation 5 can be loaded
+class SegmentNormalizedTitleIndex(ValueIndex):
+    default_field_name = 'normalizedTitle'
+    default_interface = ValidatingNormalizedTitle
+
+
+class SegmentCreatorIndex(ValueIndex):
+    default_field_name = 'creator'
+    default_interface = ValidatingCreator
+
+
+class SegmentRefreshIntervalIndex(ValueIndex):
+    default_field_name = 'refreshInterval'
+    default_interface = ValidatingRefreshInterval
+
+
+class SegmentCreatedTimeRawIndex(RawIntegerValueIndex):
+    pass
+
+
+def SegmentCreatedTimeIndex(family=BTrees.family64):
+    return NormalizationWrapper(field_name='createdTime',
+                                interface=ISegment,
+                                index=SegmentCreatedTimeRawIndex(family=family),
+                                normalizer=TimestampToNormalized64BitIntNormalizer())
+
+
+class SegmentLastModifiedRawIndex(RawIntegerValueIndex):
+    pass
+
+
+def SegmentLastModifiedIndex(family=BTrees.family64):
+    return NormalizationWrapper(field_name='lastModified',
+                                interface=ISegment,
+                                index=SegmentLastModifiedRawIndex(family=family),
+                                normalizer=TimestampToNormalized64BitIntNormalizer())
+
+
+@interface.implementer(ISegmentsCatalog)
+class SegmentsCatalog(Catalog):
+    pass
+
+
+def create_segments_catalog(catalog=None, family=BTrees.family64):
+    if catalog is None:
+        catalog = SegmentsCatalog(family=family)
+    for name, clazz in ((IX_NAME, SegmentNameIndex),
+                        (IX_TITLE, SegmentTitleIndex),
+                        (IX_CREATOR, SegmentCreatorIndex),
+                        (IX_CREATEDTIME, SegmentCreatedTimeIndex),
+                        (IX_LASTMODIFIED, SegmentLastModifiedIndex),
+                        (IX_REFRESH_INTERVAL, SegmentRefreshIntervalIndex)):
+        if name in catalog:
+            continue
+        index = clazz(family=family)
+        locate(index, catalog, name)
+        catalog[name] = index
+    return catalog
+
+
+def get_segments_catalog(site_manager_container=None):
+    """
+    Return the segments catalog installed in the given (or current) site,
+    or None.  Catalogs of parent sites, which index different segments,
+    are never returned.
+    """
+    site = site_manager_container if site_manager_container is not None else getSite()
+    if site is None:
+        return None
+    lsm = site.getSiteManager()
+    catalog = lsm.queryUtility(ISegmentsCatalog, name=CATALOG_NAME)
+    if catalog is None or catalog.__parent__ is not site:
+        return None
+    return catalog
+
+
+def install_segments_catalog(site_manager_container, intids=None):
+    """
+    Install the segments catalog in the given site, if necessary,
+    returning it.  Existing segments are not indexed.
+    """
+    catalog = get_segments_catalog(site_manager_container)
+    if catalog is not None:
+        return catalog
+
+    lsm = site_manager_container.getSiteManager()
+    intids = lsm.getUtility(IIntIds) if intids is None else intids
+    catalog = create_segments_catalog()
+    locate(catalog, site_manager_container, CATALOG_NAME)
+    intids.register(catalog)
+    lsm.registerUtility(catalog,
+                        provided=ISegmentsCatalog,
+                        name=CATALOG_NAME)
+    for index in catalog.values():
+        intids.register(index)
+    return catalog
+
+
+def index_segments(catalog, container, intids=None):
+    """
+    Index all segments in the given container, returning the number indexed.
+    """
+    intids = component.getUtility(IIntIds) if intids is None else intids
+    count = 0
+    for segment in container.values():
+        doc_id = intids.queryId(segment)
+        if doc_id is not None:
+            catalog.index_doc(doc_id, segment)
+            count += 1
+    return count
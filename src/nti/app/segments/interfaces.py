@@ -8,7 +8,17 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+from zope.catalog.interfaces import ICatalogEdit
+from zope.catalog.interfaces import ICatalogQuery
+
+from zope.container.interfaces import IContainer
+
+from zope.interface import Attribute
 from zope.interface import Interface
+from zope.interface import implementer
+
+from zope.interface.interfaces import IObjectEvent
+from zope.interface.interfaces import ObjectEvent
 
 from zope.schema import vocabulary
 
@@ -33,6 +43,25 @@ RANGE_OP_VOCABULARY = vocabulary.SimpleVocabulary(
     tuple(vocabulary.SimpleTerm(x) for x in RANGE_OPS)
 )
 
+GRANULARITY_MINUTE = u"minute"
+GRANULARITY_HOUR = u"hour"
+GRANULARITY_DAY = u"day"
+
+#: Length, in seconds, of each supported granularity
+GRANULARITY_SECONDS = {
+    GRANULARITY_MINUTE: 60,
+    GRANULARITY_HOUR: 60 * 60,
+    GRANULARITY_DAY: 24 * 60 * 60,
+}
+
+GRANULARITIES = (GRANULARITY_MINUTE,
+                 GRANULARITY_HOUR,
+                 GRANULARITY_DAY)
+
+GRANULARITY_VOCABULARY = vocabulary.SimpleVocabulary(
+    tuple(vocabulary.SimpleTerm(x) for x in GRANULARITIES)
+)
+
 
 class ISegmentsCollection(ISiteAdminCollection):
     """
@@ -71,6 +100,31 @@ class IRelativeOffset(ITimeRange):
                            vocabulary=RANGE_OP_VOCABULARY,
                            required=True)
 
+    granularity = ValidChoice(title=u'Granularity',
+                              description=u'If given, the computed boundary is '
+                                          u'snapped down to the start of the '
+                                          u'enclosing minute, hour or day (UTC), '
+                                          u'so results may be shared until it '
+                                          u'changes.',
+                              vocabulary=GRANULARITY_VOCABULARY,
+                              required=False)
+
+
+class IAbsoluteTimeRange(ITimeRange):
+    """
+    Fixed period of time between two points (e.g. the first quarter of a
+    year), either of which may be omitted for an open-ended range.  Bounds
+    are epoch times, but may be given externally as ISO 8601 dates.
+    """
+
+    start = Number(title=u'Start',
+                   description=u'Start of the range (inclusive), as an epoch time.',
+                   required=False)
+
+    end = Number(title=u'End',
+                 description=u'End of the range (exclusive), as an epoch time.',
+                 required=False)
+
 
 class ITimeRangeFilterSet(IUserFilterSet):
     """
@@ -108,3 +162,335 @@ class IIsDeactivatedFilterSet(IUserFilterSet):
                        description=u'Whether to include only deactivated or activated users',
                        required=True,
                        default=False)
+
+
+class IIntIdSetFactory(Interface):
+    """
+    Creates the intid sets filter sets are evaluated against, e.g.
+    :class:`nti.segments.model.IntIdSet`.
+    """
+
+    def __call__(intids=()):
+        """
+        Return an intid set holding the given intids.
+        """
+
+
+class IIntIdSetCache(Interface):
+    """
+    Storage for intid sets, keyed by a scope (e.g. a site name) and a key
+    within that scope.  Entries may be invalidated per scope or entirely.
+    """
+
+    def generation(scope):
+        """
+        Return an opaque token that changes whenever entries for the given
+        scope are invalidated.  Callers should obtain this prior to
+        computing a value and pass it to :meth:`set` so results computed
+        against stale data are discarded.
+        """
+
+    def get(scope, key):
+        """
+        Return the cached intid set for the given scope and key, or None.
+        """
+
+    def set(scope, key, intids, generation=None):
+        """
+        Store the intid set for the given scope and key, unless the
+        scope has been invalidated since ``generation`` was obtained.
+        Returns a boolean indicating whether the value was stored.
+        """
+
+    def invalidate(scope=None):
+        """
+        Drop entries for the given scope, or for all scopes if None.
+        """
+
+    def invalidate_entries(matches, scope=None):
+        """
+        Drop entries for the given scope (or all scopes if None) for which
+        ``matches(key, intids)`` is true.
+        """
+
+
+class ISegmentMembershipCache(IIntIdSetCache):
+    """
+    Materialized segment membership, scoped by site name and keyed on the
+    segment definition.  Entries are invalidated when users in the site
+    are created, modified or deactivated, and entries selecting on last
+    seen times when users in the site are seen.
+    """
+
+
+class ISegmentSortCache(IIntIdSetCache):
+    """
+    Ordered segment member intids, scoped by site name and keyed on the
+    segment definition, the requested ordering and any filtering.  Values
+    are sequences rather than sets and may hold only a leading portion of
+    the ordering.  Entries are invalidated along with the
+    :class:`ISegmentMembershipCache`.
+    """
+
+
+class IFilterSetResultCache(IIntIdSetCache):
+    """
+    Memoized catalog results for individual filter sets (e.g. the users
+    within a given time range for an index).  Catalog results span all
+    sites, so entries are invalidated on any user change.
+    """
+
+
+class IAbsoluteRangeCache(IIntIdSetCache):
+    """
+    Catalog results for absolute time ranges, scoped by index name and
+    keyed on the range.  Entries are invalidated when a user within the
+    range is changed or one is indexed into it, and, as changes in other
+    processes aren't seen, expire unless the range has ended.
+    """
+
+    def invalidate_document(scope, doc_id, value=None):
+        """
+        Invalidate the entries for the given scope containing the given
+        intid, or whose range contains the given value.
+        """
+
+
+class ISiteAdminIntIdCache(IIntIdSetCache):
+    """
+    The intids of the site admins of each site, scoped by site name.
+    Entries are invalidated by changes to users of the site (including
+    roles being granted and revoked), and expire, bounding staleness from
+    changes in other processes.
+    """
+
+
+class IIncrementalRangeStore(IIntIdSetCache):
+    """
+    Maintained catalog results for open ended "seen since" time ranges,
+    keyed on the range definition and updated from changes to the index
+    rather than being invalidated.  Registering this utility enables
+    incremental evaluation of :class:`ILastActiveFilterSet` instances.
+    """
+
+
+class ICreatorDisplayNameCache(Interface):
+    """
+    Display names of segment creators, scoped by site name and keyed on
+    username.  Entries expire, so renames are eventually reflected.
+    """
+
+    def get(scope, key):
+        """
+        Return the cached display name, or None.
+        """
+
+    def set(scope, key, display_name, generation=None):
+        """
+        Store the display name for the given scope and username.
+        """
+
+    def invalidate(scope=None):
+        """
+        Drop entries for the given scope, or for all scopes if None.
+        """
+
+
+class ISegmentMembershipLog(Interface):
+    """
+    The members of a user segment as of its last materialization, along
+    with a bounded log of the users entering and leaving it, identified by
+    increasing sequence numbers.
+    """
+
+    sequence = Attribute("The sequence number of the latest change")
+
+    def record(intids, entered, exited):
+        """
+        Make the given intids the current members, logging the usernames
+        that ``entered`` and ``exited``.
+        """
+
+    def changes_since(sequence):
+        """
+        Return the net usernames entered and exited after the given
+        sequence number, or None if those changes are no longer retained.
+        """
+
+
+class IUserSegmentMembershipEvent(IObjectEvent):
+    """
+    A user's membership of a segment changed.  The object is the user.
+    """
+
+    segment = Attribute("The user segment")
+
+
+class IUserEnteredSegment(IUserSegmentMembershipEvent):
+    """
+    A user became a member of a segment.
+    """
+
+
+class IUserExitedSegment(IUserSegmentMembershipEvent):
+    """
+    A user ceased to be a member of a segment.
+    """
+
+
+class UserSegmentMembershipEvent(ObjectEvent):
+
+    def __init__(self, user, segment):
+        super(UserSegmentMembershipEvent, self).__init__(user)
+        self.segment = segment
+
+
+@implementer(IUserEnteredSegment)
+class UserEnteredSegment(UserSegmentMembershipEvent):
+    pass
+
+
+@implementer(IUserExitedSegment)
+class UserExitedSegment(UserSegmentMembershipEvent):
+    pass
+
+
+class ISegmentRefreshSettings(Interface):
+    """
+    How often the membership of a user segment is refreshed in the
+    background.
+    """
+
+    interval = Number(title=u"Interval",
+                      description=u"Seconds between background refreshes, or None "
+                                  u"if the segment is only evaluated on demand.",
+                      required=False,
+                      min=60.0,
+                      default=None)
+
+    snapshot = Attribute("The persistent membership snapshot of the latest "
+                         "background refresh, if any")
+
+
+class ISegmentSnapshotStore(IIntIdSetCache):
+    """
+    A process-local store of copies of the membership snapshots produced
+    by background refreshes, keyed by segment intid followed by the key
+    of the :class:`ISegmentMembershipCache`.  Unlike cached membership,
+    snapshots are not invalidated by changes to users.
+    """
+
+
+class ISegmentRefreshScheduler(Interface):
+    """
+    Periodically refreshes the membership of segments with a refresh
+    interval.
+    """
+
+    def schedule(site_name, doc_id, interval, now=None, last_refreshed=None):
+        """
+        Refresh the segment with the given intid, in the named site, every
+        ``interval`` seconds, or no longer if ``interval`` is None.  The
+        first refresh is due an interval after ``last_refreshed``, if
+        given, rather than immediately.
+        """
+
+    def discover():
+        """
+        Schedule every segment, in all sites, with a refresh interval.
+        """
+
+
+class ISegmentExportJob(Interface):
+    """
+    A background export of segment members to a CSV blob.
+    """
+
+    id = Attribute("The id of the job within its segment")
+
+    status = Attribute("Whether the job is pending, running, or has succeeded "
+                       "or failed")
+
+    output = Attribute("The blob holding the CSV once the job succeeds")
+
+    def run(tm, cancelled, db=None):
+        """
+        Write the CSV, committing progress with the given transaction
+        manager, and stopping once ``cancelled()`` is true.
+        """
+
+
+class IExportJobQueue(Interface):
+    """
+    Executes export jobs outside of the request.
+    """
+
+    def submit(job):
+        """
+        Schedule the given :class:`ISegmentExportJob` to be run.
+        """
+
+
+class IExportJobRegistry(Interface):
+    """
+    Tracks the export jobs of a segment so their status may be polled and
+    their output downloaded, from any process.
+    """
+
+    def add(job):
+        """
+        Track the given job.
+        """
+
+    def get(job_id):
+        """
+        Return the job with the given id, or None.
+        """
+
+    def remove(job_id):
+        """
+        Stop tracking the given job, cancelling it if running and
+        removing any output.
+        """
+
+
+class IMetricsSink(Interface):
+    """
+    Receives statsd-style metrics, e.g. the timings of segment requests.
+    """
+
+    def timing(name, value):
+        """
+        Record a duration, in milliseconds, for the named metric.
+        """
+
+    def incr(name, count=1):
+        """
+        Increment the named counter.
+        """
+
+
+class IRequestProfiler(Interface):
+    """
+    Profiles segment requests, keeping profiles of those that are slow.
+    Profiling is opt-in: without this utility, requests are not profiled.
+    """
+
+    threshold = Number(title=u"Threshold",
+                       description=u"Seconds a request may take before its profile is kept.",
+                       required=True,
+                       min=0.0)
+
+    def dump(profile, name, elapsed):
+        """
+        Keep the given :class:`cProfile.Profile` of a request that took
+        ``elapsed`` seconds, returning where it was written.
+        """
+
+
+class ISegmentsCatalog(ICatalogQuery, ICatalogEdit, IContainer):
+    """
+    Indexes the segments of a single site.  Deliberately not an
+    :class:`zope.catalog.interfaces.ICatalog`, so it is maintained only
+    by segment events rather than for every object in the site.
+    """
@@ -5,16 +5,32 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import calendar
+
+import six
+
 from zope import component
 from zope import interface
 
+from nti.app.segments.interfaces import IAbsoluteTimeRange
 from nti.app.segments.interfaces import ITimeRange
 
 from nti.externalization.datastructures import InterfaceObjectIO
 
+from nti.externalization.datetime import datetime_from_string
+
 from nti.externalization.interfaces import IInternalObjectUpdater
 
 
+def epoch_from_string(value):
+    """
+    The epoch time of the given ISO 8601 date or datetime, assumed to be
+    UTC if no timezone is given.
+    """
+    dt = datetime_from_string(value)
+    return calendar.timegm(dt.utctimetuple()) + dt.microsecond / 1e6
+
+
 @component.adapter(ITimeRange)
 @interface.implementer(IInternalObjectUpdater)
 class TimeRangeUpdater(InterfaceObjectIO):
@@ -25,3 +41,17 @@ class TimeRangeUpdater(InterfaceObjectIO):
     # info from the iface so we do it manually.
     _excluded_in_ivars_ = frozenset(
         getattr(InterfaceObjectIO, '_excluded_in_ivars_').union({'range_tuple'}))
+
+
+@component.adapter(IAbsoluteTimeRange)
+class AbsoluteTimeRangeUpdater(TimeRangeUpdater):
+
+    _ext_iface_upper_bound = IAbsoluteTimeRange
+
+    def updateFromExternalObject(self, parsed, *args, **kwargs):
+        for name in ('start', 'end'):
+            if isinstance(parsed.get(name), six.string_types):
+                parsed[name] = epoch_from_string(parsed[name])
+        return super(AbsoluteTimeRangeUpdater, self).updateFromExternalObject(parsed,
+                                                                              *args,
+                                                                              **kwargs)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Background export of segment members.
+
+Jobs are stored with their segment, and their output in a blob, so their
+status and output are available from every process.  A job is run by the
+:class:`.IExportJobQueue` of the process that accepted it, once the
+request creating it commits, on a dedicated connection, committing its
+progress as rows are written.  Removing a job from its segment cancels it.
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import tempfile
+import threading
+import time
+
+from uuid import uuid4
+
+from BTrees.LLBTree import LLBTree
+
+from BTrees.OOBTree import OOBTree
+
+from persistent import Persistent
+
+from six.moves import queue as Queue
+
+import transaction
+
+from ZODB.blob import Blob
+
+from zope import component
+from zope import interface
+
+from zope.annotation import factory as an_factory
+
+from zope.annotation.interfaces import IAnnotations
+
+from zope.component.hooks import site as current_site
+
+from zope.container.contained import Contained
+
+from zope.intid.interfaces import IIntIds
+
+from zope.location import locate
+
+from nti.app.segments.export import DEFAULT_CHUNK_SIZE
+from nti.app.segments.export import iter_members_csv_detached
+
+from nti.app.segments.interfaces import IExportJobQueue
+from nti.app.segments.interfaces import IExportJobRegistry
+from nti.app.segments.interfaces import ISegmentExportJob
+
+from nti.app.segments.utils import dataserver_connection
+
+from nti.segments.interfaces import IUserSegment
+
+from nti.site.hostpolicy import get_host_site
+
+logger = __import__('logging').getLogger(__name__)
+
+#: Annotation key of the export jobs of a segment
+EXPORT_JOBS_KEY = 'nti.app.segments.export-jobs'
+
+#: Number of export worker threads per process
+DEFAULT_EXPORT_WORKERS = 2
+
+#: Seconds a finished job (and its output) is retained
+DEFAULT_JOB_RETENTION = 60 * 60
+
+JOB_PENDING = u'Pending'
+JOB_RUNNING = u'Running'
+JOB_SUCCESS = u'Success'
+JOB_FAILED = u'Failed'
+
+JOB_FINISHED_STATES = (JOB_SUCCESS, JOB_FAILED)
+
+
+def _remove_file(path):
+    if path is None or not os.path.exists(path):
+        return
+    try:
+        os.remove(path)
+    except OSError:  # pragma: no cover
+        logger.warning('Unable to remove export file %s', path)
+
+
+@interface.implementer(ISegmentExportJob)
+class SegmentExportJob(Persistent, Contained):
+    """
+    Writes CSV for a fixed, ordered list of user intids to a blob,
+    reporting progress as rows are written.
+    """
+
+    def __init__(self, doc_ids, filename, creator, segment_id,
+                 site_name=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.id = uuid4().hex
+        # Positions to intids, in their own records, so they're written
+        # once rather than with each commit of the job's progress
+        self._doc_ids = LLBTree(enumerate(doc_ids))
+        self.filename = filename
+        self.creator = creator
+        self.segment_id = segment_id
+        self.site_name = site_name
+        self.chunk_size = chunk_size
+        self.total = len(self._doc_ids)
+        self.written = 0
+        self.status = JOB_PENDING
+        self.error = None
+        self.output = None
+        self.createdTime = self.lastModified = time.time()
+
+    @property
+    def doc_ids(self):
+        """
+        The intids of the users to export, in order.
+        """
+        return self._doc_ids.values()
+
+    @property
+    def finished(self):
+        return self.status in JOB_FINISHED_STATES
+
+    def _set_status(self, status):
+        self.status = status
+        self.lastModified = time.time()
+
+    def _progress(self, count):
+        self.written += count
+        self.lastModified = time.time()
+
+    def _fail(self, tm, error):
+        tm.abort()
+        self.error = error
+        self._set_status(JOB_FAILED)
+        tm.commit()
+
+    def run(self, tm, cancelled=lambda: False, db=None):
+        """
+        Write the CSV, committing progress with the transaction manager
+        ``tm`` as each chunk is written and stopping once ``cancelled()``
+        is true, then store it in a blob.
+        """
+        if cancelled():
+            return
+
+        self._set_status(JOB_RUNNING)
+        tm.commit()
+        fd, path = tempfile.mkstemp(prefix='segment-export-', suffix='.csv')
+        try:
+            with os.fdopen(fd, 'wb') as stream:
+                for lines in iter_members_csv_detached(self.doc_ids,
+                                                       self.chunk_size,
+                                                       on_chunk=self._progress,
+                                                       db=db):
+                    stream.write(lines)
+                    tm.commit()
+                    if cancelled():
+                        return
+            output = Blob()
+            # Moves, rather than copies, the file where possible
+            output.consumeFile(path)
+            self.output = output
+            self._set_status(JOB_SUCCESS)
+            tm.commit()
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception('Segment export job %s failed', self.id)
+            self._fail(tm, str(e))
+        finally:
+            _remove_file(path)
+
+
+@component.adapter(IUserSegment)
+@interface.implementer(IExportJobRegistry)
+class ExportJobRegistry(Persistent, Contained):
+    """
+    Tracks the export jobs of a segment by id, removing finished jobs (and
+    their output) once they have been retained for ``retention`` seconds
+    as others are added.
+    """
+
+    retention = DEFAULT_JOB_RETENTION
+
+    def __init__(self):
+        self._jobs = OOBTree()
+
+    def _expired(self, job, now=None):
+        now = time.time() if now is None else now
+        return job.finished and job.lastModified < now - self.retention
+
+    def add(self, job):
+        now = time.time()
+        for expired in [x for x in self._jobs.values() if self._expired(x, now)]:
+            del self._jobs[expired.id]
+        self._jobs[job.id] = job
+        locate(job, self, job.id)
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        return job if job is not None and not self._expired(job) else None
+
+    def remove(self, job_id):
+        return self._jobs.pop(job_id, None)
+
+
+_ExportJobRegistryFactory = an_factory(ExportJobRegistry, EXPORT_JOBS_KEY)
+
+
+def query_export_jobs(segment):
+    """
+    The export jobs of the segment, if it has had any, without creating
+    them.
+    """
+    annotations = IAnnotations(segment, None)
+    return annotations.get(EXPORT_JOBS_KEY) if annotations is not None else None
+
+
+def run_export_job(site_name, segment_id, job_id, db=None):
+    """
+    Run the pending export job with the given id, of the segment with the
+    given intid in the named site, on a dedicated connection.
+    """
+    with dataserver_connection(db) as tm:
+        site = get_host_site(site_name, True)
+        if site is None:
+            return
+        with current_site(site):
+            segment = component.getUtility(IIntIds).queryObject(segment_id)
+            registry = query_export_jobs(segment) if segment is not None else None
+            job = registry.get(job_id) if registry is not None else None
+            if job is None or job.status != JOB_PENDING:
+                return
+            job.run(tm, lambda: registry.get(job_id) is None, db)
+
+
+def _job_ref(job):
+    return (job.site_name, job.segment_id, job.id)
+
+
+def _submit_after_commit(success, queue, job):
+    if success:
+        queue.submit(job)
+
+
+def submit_export_job(job):
+    """
+    Submit the job to the :class:`.IExportJobQueue` once (and only if) the
+    current transaction, adding it, commits.
+    """
+    queue = component.getUtility(IExportJobQueue)
+    transaction.get().addAfterCommitHook(_submit_after_commit,
+                                         args=(queue, job))
+
+
+@interface.implementer(IExportJobQueue)
+class LocalExportJobQueue(object):
+    """
+    Holds submitted jobs until :meth:`run_pending` is called, running them in
+    the calling thread.  A stand-in for the thread pool in tests.
+    """
+
+    def __init__(self):
+        self.pending = []
+
+    def submit(self, job):
+        self.pending.append(_job_ref(job))
+
+    def run_pending(self):
+        while self.pending:
+            run_export_job(*self.pending.pop(0))
+
+
+@interface.implementer(IExportJobQueue)
+class ThreadPoolExportJobQueue(object):
+    """
+    Runs submitted jobs on a fixed number of daemon worker threads, started
+    on first use.
+    """
+
+    def __init__(self, workers=DEFAULT_EXPORT_WORKERS):
+        self.workers = workers
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                run_export_job(*job)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Unexpected error running export job')
+            finally:
+                self._queue.task_done()
+
+    def _ensure_started(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work,
+                                          name='segment-export-%s' % len(self._threads))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, job):
+        self._ensure_started()
+        # Workers load the job from their own connections
+        self._queue.put(_job_ref(job))
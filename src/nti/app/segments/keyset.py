@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Keyset (cursor) pagination of segment members.
+
+Members are ordered by their value in a sort index and then by intid, with
+members lacking a value following, by intid.  A page resumes directly from
+the key of the last member of the previous page, bisecting the ordered
+members for it, so the cost of a page doesn't depend on its depth and
+pages don't shift as members are added or removed.  The ordering covers
+only the members, so it may be computed once and shared across pages.
+
+Keys are ``(indexed, value, intid)`` triples, exchanged with clients as
+opaque cursors.
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import base64
+import binascii
+import json
+
+import six
+
+from nti.app.segments.cache import SortedIntIds
+
+from nti.app.segments.utils import unwrap_value_index
+
+logger = __import__('logging').getLogger(__name__)
+
+
+class InvalidCursor(ValueError):
+    """
+    A cursor that can't be decoded, or that was issued for a different
+    ordering.
+    """
+
+
+def encode_cursor(key, sort_on=None, reverse=False):
+    """
+    An opaque cursor for the given key in the given ordering.
+    """
+    indexed, value, doc_id = key
+    data = json.dumps([sort_on, reverse, indexed, value, doc_id])
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, sort_on=None, reverse=False):
+    """
+    The key encoded in the given cursor, which must have been issued for
+    the given ordering.
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        cursor_sort_on, cursor_reverse, indexed, value, doc_id = json.loads(data.decode('utf-8'))
+    except (binascii.Error, TypeError, ValueError):
+        raise InvalidCursor(cursor)
+    if     cursor_sort_on != sort_on or cursor_reverse != reverse \
+        or not isinstance(doc_id, six.integer_types):
+        raise InvalidCursor(cursor)
+    return (bool(indexed), value, doc_id)
+
+
+_MISSING = object()
+
+
+def _documents_to_values(index):
+    value_index, _ = unwrap_value_index(index)
+    return getattr(value_index, 'documents_to_values', None)
+
+
+def keyset_order(members, index=None, reverse=False):
+    """
+    The given member intids ordered by the given sort index (if any) and
+    intid, with members lacking a value following.
+    """
+    documents_to_values = _documents_to_values(index)
+    if documents_to_values is None:
+        return SortedIntIds(sorted(members, reverse=reverse))
+    indexed = []
+    missing = []
+    for doc_id in members:
+        value = documents_to_values.get(doc_id, _MISSING)
+        if value is _MISSING:
+            missing.append(doc_id)
+        else:
+            indexed.append((value, doc_id))
+    indexed.sort(reverse=reverse)
+    missing.sort(reverse=reverse)
+    return SortedIntIds([doc_id for _, doc_id in indexed] + missing)
+
+
+def _follows(key, after, reverse=False):
+    # Whether the key comes after the key ``after`` in the ordering
+    if key[0] != after[0]:
+        # Members lacking a value follow
+        return after[0]
+    if reverse:
+        return key[1:] < after[1:]
+    return key[1:] > after[1:]
+
+
+def keyset_page(ordered, index=None, reverse=False, after=None, limit=None):
+    """
+    The intids of at most ``limit`` of the members following the key
+    ``after`` (or from the first), given the members in their
+    :func:`keyset_order` for the same sort index and direction, along with
+    the key of the last member of the page if more members follow.
+    """
+    documents_to_values = _documents_to_values(index)
+
+    def key(doc_id):
+        value = _MISSING
+        if documents_to_values is not None:
+            value = documents_to_values.get(doc_id, _MISSING)
+        return (False, None, doc_id) if value is _MISSING else (True, value, doc_id)
+
+    start = 0
+    if after is not None:
+        end = len(ordered)
+        while start < end:
+            mid = (start + end) // 2
+            if _follows(key(ordered[mid]), after, reverse):
+                end = mid
+            else:
+                start = mid + 1
+
+    stop = None if limit is None else start + limit + 1
+    page = list(ordered[start:stop])
+    if limit is None or len(page) <= limit:
+        return page, None
+    page = page[:limit]
+    return page, key(page[-1])
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Evaluation of user segment membership.
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import BTrees
+
+from zope import component
+
+from zope.component.hooks import getSite
+
+from zope.intid.interfaces import IIntIds
+
+from nti.app.segments.bitmap import new_intid_set
+from nti.app.segments.bitmap import to_btree_set
+
+from nti.app.segments.cache import CACHE_HIT
+from nti.app.segments.cache import CACHE_MISS
+from nti.app.segments.cache import membership_cache_key
+
+from nti.app.segments.changes import record_membership
+
+from nti.app.segments.interfaces import ISegmentMembershipCache
+from nti.app.segments.interfaces import ISiteAdminIntIdCache
+
+from nti.app.segments.planner import evaluate_filter_set
+
+from nti.app.segments.timing import timed
+
+from nti.app.users.utils import get_site_admins
+
+from nti.dataserver.users.utils import intids_of_users_by_site
+
+from nti.site.interfaces import IHostPolicyFolder
+
+from nti.traversal.traversal import find_interface
+
+logger = __import__('logging').getLogger(__name__)
+
+
+def segment_site(segment):
+    """
+    The site (host policy folder) the given segment belongs to, if any.
+    """
+    return find_interface(segment, IHostPolicyFolder)
+
+
+def segment_site_name(segment):
+    """
+    The name of the site the given segment belongs to.
+    """
+    return getattr(segment_site(segment), '__name__', None)
+
+
+def evaluate_membership(segment, site=None):
+    """
+    Evaluate the filter set of the segment against the users of the given
+    site (or the current site), returning the intids of its members.
+    Deactivated users are not excluded unless the filter set does so.
+    """
+    with timed('scan'):
+        initial_intids = intids_of_users_by_site(site, filter_deactivated=False)
+    if segment.filter_set is not None:
+        with timed('evaluate'):
+            rs, _ = evaluate_filter_set(segment.filter_set,
+                                        new_intid_set(initial_intids))
+            initial_intids = to_btree_set(rs)
+    return initial_intids
+
+
+def segment_membership(segment, site=None, cache=None, record=False):
+    """
+    Return the intids of the members of the segment within the given site
+    (or the segment's own site) along with whether they were served from
+    the given :class:`.ISegmentMembershipCache` (``CACHE_HIT``), evaluated
+    and stored (``CACHE_MISS``) or evaluated without caching (None).
+
+    If ``record`` is true, evaluations for the segment's own site are
+    recorded in its :class:`.ISegmentMembershipLog`.
+    """
+    # We may be given either a site or its name
+    site_name = getattr(site, '__name__', site)
+    own_site_name = segment_site_name(segment)
+    record = record and site_name in (None, own_site_name)
+
+    if cache is None:
+        result = evaluate_membership(segment, site)
+        if record:
+            record_membership(segment, result)
+        return result, None
+
+    key = membership_cache_key(segment)
+    site_name = site_name or own_site_name
+    result = cache.get(site_name, key)
+    if result is not None:
+        return result, CACHE_HIT
+
+    generation = cache.generation(site_name)
+    result = evaluate_membership(segment, site)
+    cache.set(site_name, key, result, generation)
+    if record:
+        record_membership(segment, result)
+    return result, CACHE_MISS
+
+
+def segment_member_count(segment):
+    """
+    The number of members of the segment within its site, reusing any
+    cached membership.  No users are loaded.
+    """
+    cache = component.queryUtility(ISegmentMembershipCache)
+    intids, _ = segment_membership(segment, segment_site_name(segment), cache)
+    return len(intids)
+
+
+def _site_admin_intids(site):
+    intids = component.getUtility(IIntIds)
+    doc_ids = (intids.queryId(user) for user in get_site_admins(site))
+    return BTrees.family64.IF.Set(x for x in doc_ids if x is not None)
+
+
+def site_admin_intids(site=None):
+    """
+    The intids of the site admins of the given site (e.g. that of a
+    segment, see :func:`segment_site`) or the current site, shared through
+    the :class:`.ISiteAdminIntIdCache`.  Callers must treat the set as
+    read-only.
+    """
+    site = getSite() if site is None else site
+    cache = component.queryUtility(ISiteAdminIntIdCache)
+    if cache is None:
+        return _site_admin_intids(site)
+
+    site_name = site.__name__
+    result = cache.get(site_name, 'site-admins')
+    if result is None:
+        generation = cache.generation(site_name)
+        result = _site_admin_intids(site)
+        cache.set(site_name, 'site-admins', result, generation)
+    return result
@@ -10,17 +10,34 @@ from __future__ import print_function
 
 import time
 
+from zope import component
 from zope import interface
 
 from zope.container.contained import Contained
 
+from nti.app.segments.bitmap import like
+
+from nti.app.segments.cache import memoized_filter_result
+from nti.app.segments.cache import memoized_range_result
+from nti.app.segments.cache import peek_filter_result
+from nti.app.segments.cache import peek_range_result
+
+from nti.app.segments.incremental import incremental_apply
+
+from nti.app.segments.interfaces import GRANULARITY_SECONDS
+from nti.app.segments.interfaces import IAbsoluteTimeRange
 from nti.app.segments.interfaces import ICreatedTimeFilterSet
+from nti.app.segments.interfaces import IIncrementalRangeStore
 from nti.app.segments.interfaces import IIsDeactivatedFilterSet
 from nti.app.segments.interfaces import ILastActiveFilterSet
 from nti.app.segments.interfaces import IRelativeOffset
 from nti.app.segments.interfaces import ITimeRangeFilterSet
 from nti.app.segments.interfaces import RANGE_OP_AFTER
 
+from nti.app.segments.timing import timed
+
+from nti.app.segments.utils import unwrap_value_index
+
 from nti.coremetadata.interfaces import IX_IS_DEACTIVATED
 from nti.coremetadata.interfaces import IX_LASTSEEN
 from nti.coremetadata.interfaces import IX_TOPICS
@@ -40,6 +57,43 @@ logger = __import__('logging').getLogger(__name__)
 
 USER_MIME_TYPE = 'application/vnd.nextthought.user'
 
+#: Fraction of index documents assumed to fall in a range when it can't be
+#: estimated from the index
+DEFAULT_RANGE_FRACTION = 0.5
+
+
+def _normalized_bounds(normalizer, start, end):
+    if normalizer is None:
+        return start, end
+    start = normalizer.value(start) if start is not None else None
+    end = normalizer.value(end) if end is not None else None
+    return start, end
+
+
+def range_fraction(index, start, end):
+    """
+    Estimate the fraction of documents in the given value index falling
+    within [start, end), assuming values are uniformly distributed between
+    the smallest and largest indexed values.  Returns None if the index
+    doesn't expose the statistics needed.
+    """
+    value_index, normalizer = unwrap_value_index(index)
+    values = getattr(value_index, 'values_to_documents', None)
+    if not values:
+        return None
+
+    try:
+        low, high = values.minKey(), values.maxKey()
+        start, end = _normalized_bounds(normalizer, start, end)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+    start = low if start is None else max(start, low)
+    end = high if end is None else min(end, high)
+    if high <= low:
+        return 1.0 if start <= low <= end else 0.0
+    return max(0.0, min(1.0, (end - start) / float(high - low)))
+
 
 @interface.implementer(IRelativeOffset)
 class RelativeOffset(SchemaConfigured,
@@ -51,18 +105,50 @@ class RelativeOffset(SchemaConfigured,
     def __init__(self, **kwargs):
         SchemaConfigured.__init__(self, **kwargs)
 
+    @property
+    def is_stable(self):
+        """
+        Whether :attr:`range_tuple` is quantized, and thus repeats between
+        calls, making results keyed on it worth memoizing.
+        """
+        return self.granularity in GRANULARITY_SECONDS
+
+    def _snap(self, timestamp):
+        bucket = GRANULARITY_SECONDS.get(self.granularity)
+        if not bucket:
+            return timestamp
+        return timestamp - (timestamp % bucket)
+
     @property
     def range_tuple(self):
         if self.duration is None:
             return None, None
 
-        offset_time = time.time() + self.duration.total_seconds()
+        offset_time = self._snap(time.time() + self.duration.total_seconds())
         if self.operator == RANGE_OP_AFTER:
             return offset_time, None
 
         return None, offset_time
 
 
+@interface.implementer(IAbsoluteTimeRange)
+class AbsoluteTimeRange(SchemaConfigured,
+                        Contained):
+    createDirectFieldProperties(IAbsoluteTimeRange)
+
+    mimeType = mime_type = "application/vnd.nextthought.segments.absolutetimerange"
+
+    #: Fixed bounds always repeat
+    is_stable = True
+
+    def __init__(self, **kwargs):
+        SchemaConfigured.__init__(self, **kwargs)
+
+    @property
+    def range_tuple(self):
+        return self.start, self.end
+
+
 class TimeRangeFilterSet(SchemaConfigured, Contained):
     createDirectFieldProperties(ITimeRangeFilterSet)
 
@@ -91,9 +177,90 @@ class TimeRangeFilterSet(SchemaConfigured, Contained):
     def included_intids(self, start, end):
         return self.catalog.apply(self._query(start, end))
 
+    def restricted_intids(self, candidates, start, end):
+        """
+        Return those of the given candidate intids with an indexed value
+        within the range, looking up each candidate's value rather than
+        scanning the range.  Returns None if the index doesn't support
+        per-document lookups.
+        """
+        value_index, normalizer = unwrap_value_index(self.catalog[self.index_name])
+        doc_values = getattr(value_index, 'documents_to_values', None)
+        if doc_values is None:
+            return None
+
+        start, end = _normalized_bounds(normalizer, start, end)
+        result = []
+        for doc_id in candidates:
+            value = doc_values.get(doc_id)
+            if value is None:
+                continue
+            if start is not None and value < start:
+                continue
+            # Matches the exclusive upper bound of our range queries
+            if end is not None and value >= end:
+                continue
+            result.append(doc_id)
+        return self.catalog.family.IF.Set(result)
+
+    def should_restrict(self, candidate_count):
+        """
+        Whether looking up the values of the given number of candidates is
+        expected to be cheaper than scanning the catalog for the range
+        (i.e. there are fewer candidates than documents in the range).
+        """
+        index = self.catalog[self.index_name]
+        value_index, _ = unwrap_value_index(index)
+        if getattr(value_index, 'documents_to_values', None) is None:
+            return False
+        try:
+            document_count = value_index.documentCount()
+        except AttributeError:
+            return False
+
+        start, end = self.period.range_tuple
+        fraction = range_fraction(index, start, end)
+        if fraction is None:
+            fraction = DEFAULT_RANGE_FRACTION
+        return candidate_count < document_count * fraction
+
     def apply(self, initial_set):
+        with timed('apply-' + self.index_name):
+            return self._apply(initial_set)
+
+    def _apply(self, initial_set):
         start, end = self.period.range_tuple
-        return initial_set.intersection(self.included_intids(start, end))
+        absolute = IAbsoluteTimeRange.providedBy(self.period)
+        stable = getattr(self.period, 'is_stable', False)
+        key = (self.index_name, start, end)
+
+        # A shared range scan is always cheapest if we already have it
+        if absolute:
+            included = peek_range_result(self.index_name, start, end)
+        else:
+            included = peek_filter_result(key) if stable else None
+        if included is None:
+            candidates = initial_set.intids()
+            if self.should_restrict(len(candidates)):
+                restricted = self.restricted_intids(candidates, start, end)
+                if restricted is not None:
+                    return like(initial_set, restricted)
+
+            def _included():
+                return self.included_intids(start, end)
+
+            if absolute:
+                # Fixed ranges are kept until users within them change (or,
+                # unless ended, they expire)
+                included = memoized_range_result(self.index_name, start, end,
+                                                 _included)
+            elif stable:
+                # Stable ranges recur across requests, so share the scan
+                included = memoized_filter_result(key, _included)
+            else:
+                included = _included()
+
+        return initial_set.intersection(included)
 
 
 @interface.implementer(ILastActiveFilterSet)
@@ -106,6 +273,13 @@ class LastActiveFilterSet(TimeRangeFilterSet):
     def index_name(self):
         return IX_LASTSEEN
 
+    def _apply(self, initial_set):
+        store = component.queryUtility(IIncrementalRangeStore)
+        result = incremental_apply(self, initial_set, store) if store is not None else None
+        if result is None:
+            result = super(LastActiveFilterSet, self)._apply(initial_set)
+        return result
+
 
 @interface.implementer(ICreatedTimeFilterSet)
 class CreatedTimeFilterSet(TimeRangeFilterSet):
@@ -133,13 +307,41 @@ class IsDeactivatedFilterSet(SchemaConfigured):
         return get_entity_catalog()
 
     @property
-    def deactivated_intids(self):
-        deactivated_idx = self.entity_catalog[IX_TOPICS][IX_IS_DEACTIVATED]
-        deactivated_ids = self.entity_catalog.family.IF.Set(deactivated_idx.getIds() or ())
+    def deactivated_index(self):
+        return self.entity_catalog[IX_TOPICS][IX_IS_DEACTIVATED]
+
+    def _copy_deactivated_intids(self):
+        return self.entity_catalog.family.IF.Set(self.deactivated_index.getIds() or ())
 
-        return deactivated_ids
+    @property
+    def deactivated_intids(self):
+        """
+        A copy of the deactivated user intids, shared across requests until
+        a user is changed (e.g. deactivated or reactivated).
+        """
+        return memoized_filter_result((IX_TOPICS, IX_IS_DEACTIVATED),
+                                      self._copy_deactivated_intids)
+
+    def _native_deactivated_intids(self):
+        """
+        The index's own set of deactivated intids, if it can be used
+        directly in set operations, avoiding any copy.
+        """
+        family = self.entity_catalog.family
+        ids = self.deactivated_index.getIds()
+        if isinstance(ids, (family.IF.TreeSet, family.IF.Set)):
+            return ids
+        return None
 
     def apply(self, initial_set):
+        with timed('apply-deactivated'):
+            return self._apply(initial_set)
+
+    def _apply(self, initial_set):
+        deactivated_ids = self._native_deactivated_intids()
+        if deactivated_ids is None:
+            deactivated_ids = self.deactivated_intids
+
         if self.Deactivated:
-            return initial_set.intersection(self.deactivated_intids)
-        return initial_set.difference(self.deactivated_intids)
+            return initial_set.intersection(deactivated_ids)
+        return initial_set.difference(deactivated_ids)
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cost-based evaluation of user filter set trees.
+
+Composite filter sets are planned prior to evaluation: intersections are
+flattened and their children ordered by estimated result size (smallest
+first) so evaluation can stop as soon as an intermediate result is empty,
+and time range leaves sharing a catalog are combined into a single catalog
+query.  Estimates are heuristics derived from index statistics and are
+only used for ordering, never for results.
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+from nti.app.segments.bitmap import like
+from nti.app.segments.bitmap import union
+
+from nti.app.segments.cache import memoized_filter_result
+from nti.app.segments.cache import memoized_range_result
+
+from nti.app.segments.interfaces import IAbsoluteTimeRange
+from nti.app.segments.interfaces import IIsDeactivatedFilterSet
+from nti.app.segments.interfaces import ITimeRangeFilterSet
+
+from nti.app.segments.model import range_fraction
+
+from nti.segments.interfaces import IIntersectionUserFilterSet
+from nti.segments.interfaces import IUnionUserFilterSet
+
+logger = __import__('logging').getLogger(__name__)
+
+#: Fraction of the input assumed to match a filter set we can't estimate
+DEFAULT_SELECTIVITY = 0.5
+
+#: Fraction of the input assumed to be deactivated users
+DEACTIVATED_SELECTIVITY = 0.1
+
+OP_LEAF = u'leaf'
+OP_MERGED_RANGE = u'merged-range'
+OP_INTERSECTION = u'intersection'
+OP_UNION = u'union'
+
+
+def _size(intid_set):
+    return len(intid_set.intids())
+
+
+def _mime_type(filter_set):
+    return getattr(filter_set, 'mimeType', None) or type(filter_set).__name__
+
+
+class PlanNode(object):
+    """
+    A node in an evaluation plan, recording its estimate when planned and
+    its sizes and timing once executed.
+    """
+
+    operation = None
+
+    def __init__(self, filter_sets=(), children=(), estimate=0):
+        self.filter_sets = list(filter_sets)
+        self.children = list(children)
+        self.estimate = estimate
+        self.input_size = None
+        self.output_size = None
+        self.elapsed = None
+        self.skipped = False
+
+    def _empty(self, input_set):
+        return like(input_set, ())
+
+    def _execute(self, input_set):
+        raise NotImplementedError()
+
+    def execute(self, input_set):
+        start = time.time()
+        result = self._execute(input_set)
+        self.elapsed = time.time() - start
+        self.input_size = _size(input_set)
+        self.output_size = _size(result)
+        return result
+
+    def skip(self):
+        self.skipped = True
+        for child in self.children:
+            child.skip()
+
+    def to_external(self):
+        result = {
+            'Operation': self.operation,
+            'Estimate': int(round(self.estimate)),
+            'InputSize': self.input_size,
+            'OutputSize': self.output_size,
+            'ElapsedMs': None if self.elapsed is None else self.elapsed * 1000.0,
+            'Skipped': self.skipped,
+        }
+        if self.filter_sets:
+            result['FilterSets'] = [_mime_type(x) for x in self.filter_sets]
+        if self.children:
+            result['Children'] = [x.to_external() for x in self.children]
+        return result
+
+
+class LeafNode(PlanNode):
+    """
+    Evaluates a single filter set through its own ``apply``.
+    """
+
+    operation = OP_LEAF
+
+    def _execute(self, input_set):
+        return self.filter_sets[0].apply(input_set)
+
+
+class MergedRangeNode(PlanNode):
+    """
+    Evaluates several time range filter sets, sharing a catalog, as one
+    catalog query.
+    """
+
+    operation = OP_MERGED_RANGE
+
+    def _ranges(self):
+        """
+        Combine the range of each filter set per index, intersecting any
+        ranges over the same index.
+        """
+        ranges = {}
+        for filter_set in self.filter_sets:
+            start, end = filter_set.period.range_tuple
+            cur_start, cur_end = ranges.get(filter_set.index_name, (None, None))
+            if cur_start is not None:
+                start = cur_start if start is None else max(start, cur_start)
+            if cur_end is not None:
+                end = cur_end if end is None else min(end, cur_end)
+            ranges[filter_set.index_name] = (start, end)
+        return ranges
+
+    def _query(self, ranges):
+        by_index = dict((x.index_name, x) for x in self.filter_sets)
+        query = {}
+        for index_name, (start, end) in ranges.items():
+            query.update(by_index[index_name]._query(start, end))
+        return query
+
+    def _execute(self, input_set):
+        # If the input is small enough that probing each candidate is
+        # cheaper for any of the ranges, a combined range scan would be
+        # more expensive than applying each in turn
+        input_size = _size(input_set)
+        if any(x.should_restrict(input_size) for x in self.filter_sets):
+            result = input_set
+            for filter_set in self.filter_sets:
+                result = filter_set.apply(result)
+            return result
+
+        ranges = self._ranges()
+        if any(start is not None and end is not None and start >= end
+               for start, end in ranges.values()):
+            return self._empty(input_set)
+
+        catalog = self.filter_sets[0].catalog
+        query = self._query(ranges)
+
+        def _apply():
+            return catalog.apply(query)
+
+        if len(ranges) == 1 \
+                and all(IAbsoluteTimeRange.providedBy(x.period) for x in self.filter_sets):
+            # The intersection of fixed ranges is itself a fixed range
+            (index_name, (start, end)), = ranges.items()
+            included = memoized_range_result(index_name, start, end, _apply)
+        elif all(getattr(x.period, 'is_stable', False) for x in self.filter_sets):
+            key = tuple(sorted((k, v) for k, v in ranges.items()))
+            included = memoized_filter_result(key, _apply)
+        else:
+            included = _apply()
+        return input_set.intersection(included)
+
+    def to_external(self):
+        result = super(MergedRangeNode, self).to_external()
+        result['Indexes'] = sorted(set(x.index_name for x in self.filter_sets))
+        return result
+
+
+class IntersectionNode(PlanNode):
+    """
+    Applies children in order, each to the result of the previous, stopping
+    once the result is empty.
+    """
+
+    operation = OP_INTERSECTION
+
+    def _execute(self, input_set):
+        result = input_set
+        for i, child in enumerate(self.children):
+            result = child.execute(result)
+            if not _size(result):
+                for remaining in self.children[i + 1:]:
+                    remaining.skip()
+                break
+        return result
+
+
+class UnionNode(PlanNode):
+    """
+    Applies each child to the input, stopping once the union covers the
+    entire input.
+    """
+
+    operation = OP_UNION
+
+    def _execute(self, input_set):
+        input_size = _size(input_set)
+        result = self._empty(input_set)
+        for i, child in enumerate(self.children):
+            child_result = child.execute(input_set)
+            result = union(result, child_result)
+            if _size(result) >= input_size:
+                for remaining in self.children[i + 1:]:
+                    remaining.skip()
+                break
+        return result
+
+
+class FilterSetPlanner(object):
+    """
+    Builds a :class:`PlanNode` tree for a filter set, given the size of the
+    set it will be applied to.
+    """
+
+    def __init__(self, input_size):
+        self.input_size = input_size
+
+    def _estimate_time_range(self, filter_set):
+        start, end = filter_set.period.range_tuple
+        try:
+            index = filter_set.catalog[filter_set.index_name]
+        except (KeyError, TypeError):
+            return DEFAULT_SELECTIVITY
+        fraction = range_fraction(index, start, end)
+        return DEFAULT_SELECTIVITY if fraction is None else fraction
+
+    def _estimate_deactivated(self, filter_set):
+        # The index only counts deactivated users across all sites, so
+        # anything more would mean intersecting it with the input
+        if filter_set.Deactivated:
+            return DEACTIVATED_SELECTIVITY
+        return 1.0 - DEACTIVATED_SELECTIVITY
+
+    def selectivity(self, filter_set):
+        if ITimeRangeFilterSet.providedBy(filter_set):
+            return self._estimate_time_range(filter_set)
+        if IIsDeactivatedFilterSet.providedBy(filter_set):
+            return self._estimate_deactivated(filter_set)
+        return DEFAULT_SELECTIVITY
+
+    def _plan_intersection(self, filter_set):
+        children = []
+        for child in filter_set.filter_sets or ():
+            node = self.plan(child)
+            if node.operation == OP_INTERSECTION:
+                # Nested intersections are equivalent to a flat one
+                children.extend(node.children)
+            else:
+                children.append(node)
+
+        # Group time range leaves sharing a catalog so they may be merged
+        merged = []
+        by_catalog = {}
+        for node in children:
+            filter_sets = node.filter_sets
+            if node.operation == OP_LEAF \
+                    and ITimeRangeFilterSet.providedBy(filter_sets[0]):
+                by_catalog.setdefault(id(filter_sets[0].catalog), []).append(node)
+            else:
+                merged.append(node)
+        for nodes in by_catalog.values():
+            if len(nodes) == 1:
+                merged.extend(nodes)
+                continue
+            fraction = 1.0
+            for node in nodes:
+                fraction *= node.estimate / float(max(self.input_size, 1))
+            merged.append(MergedRangeNode(filter_sets=[x.filter_sets[0] for x in nodes],
+                                          estimate=fraction * self.input_size))
+
+        merged.sort(key=lambda x: x.estimate)
+
+        fraction = 1.0
+        for node in merged:
+            fraction *= node.estimate / float(max(self.input_size, 1))
+        return IntersectionNode(children=merged,
+                                estimate=fraction * self.input_size)
+
+    def _plan_union(self, filter_set):
+        children = [self.plan(x) for x in filter_set.filter_sets or ()]
+        # Largest first, making it more likely we cover the input early
+        children.sort(key=lambda x: x.estimate, reverse=True)
+        estimate = min(self.input_size, sum(x.estimate for x in children))
+        return UnionNode(children=children, estimate=estimate)
+
+    def plan(self, filter_set):
+        if IIntersectionUserFilterSet.providedBy(filter_set):
+            return self._plan_intersection(filter_set)
+        if IUnionUserFilterSet.providedBy(filter_set):
+            return self._plan_union(filter_set)
+        return LeafNode(filter_sets=(filter_set,),
+                        estimate=self.selectivity(filter_set) * self.input_size)
+
+
+def plan_filter_set(filter_set, initial_set):
+    """
+    Return the evaluation plan for applying the filter set to the given
+    :class:`IntIdSet`.
+    """
+    return FilterSetPlanner(_size(initial_set)).plan(filter_set)
+
+
+def evaluate_filter_set(filter_set, initial_set):
+    """
+    Plan and apply the filter set to the given :class:`IntIdSet`, returning
+    the resulting :class:`IntIdSet` and the executed plan.
+    """
+    plan = plan_filter_set(filter_set, initial_set)
+    return plan.execute(initial_set), plan
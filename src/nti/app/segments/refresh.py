@@ -0,0 +1,501 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Scheduled background refresh of segment membership.
+
+Segments may be given a refresh interval, after which their membership is
+re-evaluated periodically by the :class:`.ISegmentRefreshScheduler` rather
+than on the first request.  Each refresh stores a timestamped snapshot with
+the segment (and records any membership changes), which the members views
+of every process serve, with its as-of time, while it is recent enough.
+Processes share copies of snapshots through their
+:class:`.ISegmentSnapshotStore`.
+
+Since snapshots are shared, a single process refreshes segments: the
+threaded scheduler is only registered where the
+``segments-refresh-scheduler`` ZCML feature is provided.  It discovers the
+segments to refresh through the refresh interval index of each site's
+segments catalog; no external queue is involved.
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import random
+import threading
+import time
+
+from operator import attrgetter
+
+import BTrees
+
+import transaction
+
+from persistent import Persistent
+
+from six.moves import queue as Queue
+
+from zope import component
+from zope import interface
+
+from zope.annotation import factory as an_factory
+
+from zope.annotation.interfaces import IAnnotations
+
+from zope.component.hooks import site as current_site
+
+from zope.container.contained import Contained
+
+from zope.intid import IIntIds
+
+from nti.app.segments.cache import IntIdSetCache
+from nti.app.segments.cache import membership_cache_key
+
+from nti.app.segments.changes import record_membership
+
+from nti.app.segments.index import IX_REFRESH_INTERVAL
+from nti.app.segments.index import REFRESH_SETTINGS_KEY
+from nti.app.segments.index import get_segments_catalog
+
+from nti.app.segments.interfaces import ISegmentRefreshScheduler
+from nti.app.segments.interfaces import ISegmentRefreshSettings
+from nti.app.segments.interfaces import ISegmentSnapshotStore
+
+from nti.app.segments.membership import evaluate_membership
+from nti.app.segments.membership import segment_site_name
+
+from nti.app.segments.utils import dataserver_connection
+
+from nti.segments.interfaces import IUserSegment
+
+from nti.site.hostpolicy import get_all_host_sites
+from nti.site.hostpolicy import get_host_site
+
+from nti.site.interfaces import IHostPolicyFolder
+
+from nti.traversal.traversal import find_interface
+
+#: Minimum seconds between refreshes of a segment
+MIN_REFRESH_INTERVAL = 60
+
+#: Response header giving the time membership was evaluated, if served
+#: from a snapshot
+AS_OF_HEADER = 'X-NTI-Segment-As-Of'
+
+#: Multiple of its refresh interval for which a snapshot is served
+DEFAULT_SNAPSHOT_MAX_AGE_FACTOR = 2
+
+#: Maximum number of snapshot copies retained per process
+DEFAULT_SNAPSHOT_MAX_ENTRIES = 500
+
+#: Fraction of the interval by which refreshes are randomly delayed, so
+#: segments scheduled together don't stay in lockstep
+DEFAULT_REFRESH_JITTER = 0.1
+
+#: Maximum number of refreshes of a single site's segments run at once
+DEFAULT_SITE_CONCURRENCY = 1
+
+#: Number of refresh worker threads per process
+DEFAULT_REFRESH_WORKERS = 2
+
+#: Seconds between checks for due refreshes
+DEFAULT_POLL_INTERVAL = 15
+
+#: Seconds between scans of all sites for segments with refresh intervals
+DEFAULT_DISCOVERY_INTERVAL = 300
+
+logger = __import__('logging').getLogger(__name__)
+
+
+@component.adapter(IUserSegment)
+@interface.implementer(ISegmentRefreshSettings)
+class SegmentRefreshSettings(Persistent, Contained):
+
+    interval = None
+
+    snapshot = None
+
+
+_SegmentRefreshSettingsFactory = an_factory(SegmentRefreshSettings,
+                                            REFRESH_SETTINGS_KEY)
+
+
+class MembershipSnapshot(object):
+    """
+    The intids of the members of a segment as of the given time.  Shared
+    by the :class:`.ISegmentSnapshotStore`, so must be treated as
+    read-only.
+    """
+
+    def __init__(self, intids, asOf):
+        self.intids = intids
+        self.asOf = asOf
+
+
+class PersistentMembershipSnapshot(Persistent):
+    """
+    The intids of the members of a segment as of its latest refresh, and
+    the membership cache key of the filter set evaluated.
+    """
+
+    family = BTrees.family64
+
+    def __init__(self):
+        self.intids = self.family.IF.TreeSet()
+        self.asOf = None
+        self.key = None
+
+    def update(self, intids, asOf, key):
+        IF = self.family.IF
+        if not isinstance(intids, (IF.Set, IF.TreeSet)):
+            intids = IF.Set(intids)
+        # Only the buckets of users entering or leaving are written
+        self.intids.update(IF.difference(intids, self.intids))
+        for doc_id in IF.difference(self.intids, intids):
+            self.intids.remove(doc_id)
+        self.asOf = asOf
+        self.key = key
+
+
+@interface.implementer(ISegmentSnapshotStore)
+class SegmentSnapshotStore(IntIdSetCache):
+
+    def __init__(self, ttl=None, max_entries=DEFAULT_SNAPSHOT_MAX_ENTRIES):
+        super(SegmentSnapshotStore, self).__init__(ttl, max_entries)
+
+    def _copy(self, snapshot):
+        return MembershipSnapshot(self.family.IF.Set(snapshot.intids),
+                                  snapshot.asOf)
+
+
+def _refresh_settings(segment):
+    # Read without creating the settings
+    annotations = IAnnotations(segment, None)
+    return annotations.get(REFRESH_SETTINGS_KEY) if annotations is not None else None
+
+
+def refresh_interval(segment):
+    """
+    The refresh interval of the segment, if any, without creating its
+    settings.
+    """
+    return getattr(_refresh_settings(segment), 'interval', None)
+
+
+def _segment_intid(segment):
+    return component.getUtility(IIntIds).queryId(segment)
+
+
+def membership_snapshot(segment, site_name=None, now=None):
+    """
+    The latest snapshot of the segment's membership within its site, or
+    None if the segment isn't refreshed or the snapshot is too old, or for
+    a different filter set.
+    """
+    settings = _refresh_settings(segment)
+    interval = getattr(settings, 'interval', None)
+    snapshot = getattr(settings, 'snapshot', None)
+    if not interval or snapshot is None:
+        return None
+    key = membership_cache_key(segment)
+    now = time.time() if now is None else now
+    if     snapshot.key != key \
+        or now - snapshot.asOf > interval * DEFAULT_SNAPSHOT_MAX_AGE_FACTOR:
+        return None
+
+    store = component.queryUtility(ISegmentSnapshotStore)
+    doc_id = _segment_intid(segment) if store is not None else None
+    if doc_id is None:
+        return snapshot
+    site_name = site_name or segment_site_name(segment)
+    # Segments with equivalent filter sets are refreshed separately
+    key = (doc_id,) + key
+    result = store.get(site_name, key)
+    if result is None or result.asOf != snapshot.asOf:
+        # Copied only as the snapshot changes, and shared across requests
+        # and connections until then
+        store.set(site_name, key, snapshot)
+        result = store.get(site_name, key) or snapshot
+    return result
+
+
+def refresh_segment(segment, site=None):
+    """
+    Evaluate the segment's membership within the given (or current) site,
+    storing a snapshot with the segment and recording any changes.
+    """
+    as_of = time.time()
+    intids = evaluate_membership(segment, site)
+    settings = ISegmentRefreshSettings(segment)
+    if settings.snapshot is None:
+        settings.snapshot = PersistentMembershipSnapshot()
+    settings.snapshot.update(intids, as_of, membership_cache_key(segment))
+    record_membership(segment, intids)
+    return settings.snapshot
+
+
+def _schedule_after_commit(success, site_name, doc_id, interval):
+    scheduler = component.queryUtility(ISegmentRefreshScheduler)
+    if success and scheduler is not None:
+        scheduler.schedule(site_name, doc_id, interval)
+
+
+def set_refresh_interval(segment, interval):
+    """
+    Set the refresh interval of the segment, indexing it for discovery by
+    the scheduler and scheduling its refreshes, if the scheduler runs in
+    this process, once the current transaction commits.
+    """
+    settings = ISegmentRefreshSettings(segment)
+    settings.interval = interval
+    if not interval:
+        settings.snapshot = None
+    doc_id = component.getUtility(IIntIds).queryId(segment)
+    if doc_id is None:
+        return
+    catalog = get_segments_catalog(find_interface(segment, IHostPolicyFolder))
+    index = catalog.get(IX_REFRESH_INTERVAL) if catalog is not None else None
+    if index is not None:
+        index.index_doc(doc_id, segment)
+    transaction.get().addAfterCommitHook(
+        _schedule_after_commit,
+        args=(segment_site_name(segment), doc_id, interval))
+
+
+def run_refresh(site_name, doc_id, db=None):
+    """
+    Refresh the segment with the given intid in the named site, on a
+    dedicated connection, committing the calling thread's transaction (in
+    which event subscribers may also participate).  Returns the segment's
+    current refresh interval, or None if it should no longer be refreshed.
+    """
+    with dataserver_connection(db, transaction.manager) as tm:
+        site = get_host_site(site_name, True)
+        if site is None:
+            return None
+        with current_site(site):
+            segment = component.getUtility(IIntIds).queryObject(doc_id)
+            if not IUserSegment.providedBy(segment):
+                return None
+            interval = refresh_interval(segment)
+            if interval:
+                refresh_segment(segment, site)
+                tm.commit()
+            return interval
+
+
+def _last_refreshed(intids, doc_id):
+    segment = intids.queryObject(doc_id)
+    snapshot = getattr(_refresh_settings(segment), 'snapshot', None)
+    return getattr(snapshot, 'asOf', None)
+
+
+def refresh_intervals():
+    """
+    The site name, intid, refresh interval and time of the latest refresh
+    (if any) of every segment, in all host sites, with a refresh interval,
+    as indexed in the segments catalogs.
+    """
+    result = []
+    intids = component.getUtility(IIntIds)
+    for site in get_all_host_sites():
+        catalog = get_segments_catalog(site)
+        index = catalog.get(IX_REFRESH_INTERVAL) if catalog is not None else None
+        if index is None or not index.documents_to_values:
+            continue
+        for doc_id, interval in index.documents_to_values.items():
+            result.append((site.__name__, doc_id, interval,
+                           _last_refreshed(intids, doc_id)))
+    return result
+
+
+class SegmentRefresh(object):
+    """
+    The scheduled refresh of a segment.
+    """
+
+    def __init__(self, site_name, doc_id, interval, due):
+        self.site_name = site_name
+        self.doc_id = doc_id
+        self.interval = interval
+        self.due = due
+        self.running = False
+
+    @property
+    def key(self):
+        return (self.site_name, self.doc_id)
+
+
+@interface.implementer(ISegmentRefreshScheduler)
+class LocalSegmentRefreshScheduler(object):
+    """
+    Tracks scheduled refreshes, running those due in the calling thread
+    when :meth:`run_pending` is called.  A stand-in for the threaded
+    scheduler in tests.
+    """
+
+    def __init__(self, jitter=DEFAULT_REFRESH_JITTER,
+                 site_concurrency=DEFAULT_SITE_CONCURRENCY, db=None):
+        self.jitter = jitter
+        self.site_concurrency = site_concurrency
+        self.db = db
+        self._refreshes = {}
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def _delay(self, interval):
+        return random.uniform(0, interval * self.jitter)
+
+    def schedule(self, site_name, doc_id, interval, now=None, last_refreshed=None):
+        now = time.time() if now is None else now
+        key = (site_name, doc_id)
+        with self._lock:
+            if not interval:
+                self._refreshes.pop(key, None)
+                return
+            refresh = self._refreshes.get(key)
+            if refresh is None:
+                # Spread out the first refreshes, resuming from any made
+                # before we started
+                due = now if last_refreshed is None else max(now, last_refreshed + interval)
+                self._refreshes[key] = SegmentRefresh(site_name, doc_id, interval,
+                                                      due + self._delay(interval))
+            elif refresh.interval != interval:
+                refresh.interval = interval
+                refresh.due = min(refresh.due, now + interval + self._delay(interval))
+
+    def scheduled(self):
+        with self._lock:
+            return sorted(self._refreshes.values(), key=attrgetter('due'))
+
+    def due(self, now=None):
+        """
+        Claim the refreshes now due, with at most ``site_concurrency``
+        running for any one site.
+        """
+        now = time.time() if now is None else now
+        result = []
+        with self._lock:
+            for refresh in sorted(self._refreshes.values(), key=attrgetter('due')):
+                if refresh.running or refresh.due > now:
+                    continue
+                running = self._running.get(refresh.site_name, 0)
+                if running >= self.site_concurrency:
+                    continue
+                self._running[refresh.site_name] = running + 1
+                refresh.running = True
+                result.append(refresh)
+        return result
+
+    def run(self, refresh):
+        """
+        Run a claimed refresh, scheduling its next.
+        """
+        interval = refresh.interval
+        try:
+            interval = run_refresh(refresh.site_name, refresh.doc_id, self.db)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Unable to refresh segment %s in site %s',
+                             refresh.doc_id, refresh.site_name)
+        with self._lock:
+            self._running[refresh.site_name] -= 1
+            refresh.running = False
+            if not interval:
+                if self._refreshes.get(refresh.key) is refresh:
+                    del self._refreshes[refresh.key]
+                return
+            refresh.interval = interval
+            refresh.due = time.time() + interval + self._delay(interval)
+
+    def run_pending(self, now=None):
+        for refresh in self.due(now):
+            self.run(refresh)
+
+    def discover(self):
+        with dataserver_connection(self.db):
+            found = refresh_intervals()
+        keys = set()
+        for site_name, doc_id, interval, last_refreshed in found:
+            keys.add((site_name, doc_id))
+            self.schedule(site_name, doc_id, interval,
+                          last_refreshed=last_refreshed)
+        with self._lock:
+            for key in [k for k in self._refreshes if k not in keys]:
+                del self._refreshes[key]
+        return len(found)
+
+
+class ThreadPoolSegmentRefreshScheduler(LocalSegmentRefreshScheduler):
+    """
+    Runs due refreshes on a fixed number of daemon worker threads, fed by a
+    dispatcher thread that also periodically discovers the segments to
+    refresh.  Started once the database is opened, in the single process
+    providing the ``segments-refresh-scheduler`` feature.
+    """
+
+    def __init__(self, workers=DEFAULT_REFRESH_WORKERS,
+                 poll_interval=DEFAULT_POLL_INTERVAL,
+                 discovery_interval=DEFAULT_DISCOVERY_INTERVAL, **kwargs):
+        super(ThreadPoolSegmentRefreshScheduler, self).__init__(**kwargs)
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.discovery_interval = discovery_interval
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._stopped = threading.Event()
+
+    def _work(self):
+        while True:
+            refresh = self._queue.get()
+            try:
+                self.run(refresh)
+            finally:
+                self._queue.task_done()
+
+    def _dispatch(self):
+        discovered = 0
+        while not self._stopped.is_set():
+            if time.time() - discovered >= self.discovery_interval:
+                try:
+                    self.discover()
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception('Unable to discover segments to refresh')
+                discovered = time.time()
+            for refresh in self.due():
+                self._queue.put(refresh)
+            self._stopped.wait(self.poll_interval)
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def start(self, db=None):
+        with self._lock:
+            if self._threads:
+                return
+            self.db = db if db is not None else self.db
+            for i in range(self.workers):
+                self._start_thread(self._work, 'segment-refresh-%s' % i)
+            self._start_thread(self._dispatch, 'segment-refresh-dispatch')
+
+    def stop(self):
+        """
+        Stop dispatching refreshes.  Workers finish any already dispatched.
+        """
+        self._stopped.set()
+
+
+def start_refresh_scheduler(event):
+    """
+    Start the threaded scheduler, if registered, once the database is
+    opened.
+    """
+    scheduler = component.queryUtility(ISegmentRefreshScheduler)
+    start = getattr(scheduler, 'start', None)
+    if start is not None:
+        start(event.database)
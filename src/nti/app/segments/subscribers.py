@@ -7,8 +7,35 @@ from __future__ import print_function
 
 from zope import component
 
+from zope.intid.interfaces import IIntIdAddedEvent
+from zope.intid.interfaces import IIntIdRemovedEvent
+from zope.intid.interfaces import IIntIds
+
+from zope.lifecycleevent.interfaces import IObjectModifiedEvent
+
 from zope.site.interfaces import INewLocalSite
 
+from nti.app.segments.cache import invalidate_filter_results
+from nti.app.segments.cache import invalidate_index_membership
+from nti.app.segments.cache import invalidate_membership
+from nti.app.segments.cache import invalidate_range_results
+
+from nti.app.segments.export import record_external_id_types
+
+from nti.app.segments.index import get_segments_catalog
+from nti.app.segments.index import install_segments_catalog
+
+from nti.app.users.utils import get_user_creation_sitename
+
+from nti.coremetadata.interfaces import IUser
+from nti.coremetadata.interfaces import IUserLastSeenEvent
+from nti.coremetadata.interfaces import IX_LASTSEEN
+from nti.coremetadata.interfaces import IX_LASTSEEN_TIME
+
+from nti.dataserver.metadata.index import IX_CREATEDTIME
+
+from nti.segments.interfaces import ISegment
+
 from nti.segments.model import install_segments_container
 
 from nti.site.interfaces import IHostPolicyFolder
@@ -16,8 +43,106 @@ from nti.site.interfaces import IHostPolicySiteManager
 
 from nti.traversal.traversal import find_interface
 
+#: The user attribute indexed by each index absolute time ranges select on
+RANGE_INDEX_ATTRIBUTES = {
+    IX_CREATEDTIME: 'createdTime',
+    IX_LASTSEEN: 'lastSeenTime',
+}
+
 
 @component.adapter(IHostPolicySiteManager, INewLocalSite)
 def install_site_segments_container(site_manager, _unused_event=None):
     container_site = find_interface(site_manager, IHostPolicyFolder)
     install_segments_container(container_site)
+    install_segments_catalog(container_site)
+
+
+def _invalidate_user(user, index_names=None, sort_on=None):
+    # Users with no creation site may match segments in any site
+    site_name = get_user_creation_sitename(user) or None
+    if index_names is None:
+        invalidate_membership(site_name)
+    else:
+        for index_name in index_names:
+            invalidate_index_membership(index_name, site_name, sort_on)
+
+    # Only results the user was or now is within are affected
+    doc_id = component.getUtility(IIntIds).queryId(user)
+    if doc_id is None:
+        return
+    values = dict((index_name, getattr(user, attribute, None))
+                  for index_name, attribute in RANGE_INDEX_ATTRIBUTES.items()
+                  if index_names is None or index_name in index_names)
+    invalidate_filter_results(doc_id, values, other=index_names is None)
+    for index_name, value in values.items():
+        invalidate_range_results(index_name, doc_id, value)
+
+
+@component.adapter(IUser, IIntIdAddedEvent)
+def invalidate_added_user(user, _unused_event=None):
+    """
+    New users may enter any segment in their site.
+    """
+    _invalidate_user(user)
+
+
+@component.adapter(IUser, IIntIdRemovedEvent)
+def invalidate_removed_user(user, _unused_event=None):
+    # Fired prior to the intid being removed
+    _invalidate_user(user)
+
+
+@component.adapter(IUser, IObjectModifiedEvent)
+def invalidate_modified_user(user, _unused_event=None):
+    """
+    Modifications (e.g. deactivation or site admin roles) may alter
+    segment membership, or the site admins filtered from it, within the
+    user's site.
+    """
+    _invalidate_user(user)
+
+
+@component.adapter(IUser, IObjectModifiedEvent)
+def record_user_external_id_types(user, _unused_event=None):
+    # Exports need the columns before any of their rows
+    record_external_id_types(user)
+
+
+@component.adapter(IUser, IUserLastSeenEvent)
+def invalidate_seen_user(user, _unused_event=None):
+    """
+    Being seen only affects segments selecting on, and orderings by, last
+    seen times.
+    """
+    _invalidate_user(user, (IX_LASTSEEN,), IX_LASTSEEN_TIME)
+
+
+def _segments_catalog(segment):
+    site = find_interface(segment, IHostPolicyFolder)
+    return get_segments_catalog(site) if site is not None else None
+
+
+def _index_segment(segment):
+    catalog = _segments_catalog(segment)
+    doc_id = component.getUtility(IIntIds).queryId(segment)
+    if catalog is not None and doc_id is not None:
+        catalog.index_doc(doc_id, segment)
+
+
+@component.adapter(ISegment, IIntIdAddedEvent)
+def index_added_segment(segment, _unused_event=None):
+    _index_segment(segment)
+
+
+@component.adapter(ISegment, IObjectModifiedEvent)
+def reindex_modified_segment(segment, _unused_event=None):
+    _index_segment(segment)
+
+
+@component.adapter(ISegment, IIntIdRemovedEvent)
+def unindex_removed_segment(segment, _unused_event=None):
+    # Fired prior to the intid being removed
+    catalog = _segments_catalog(segment)
+    doc_id = component.getUtility(IIntIds).queryId(segment)
+    if catalog is not None and doc_id is not None:
+        catalog.unindex_doc(doc_id)
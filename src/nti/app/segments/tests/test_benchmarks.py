@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+from hamcrest import assert_that
+from hamcrest import contains
+from hamcrest import has_length
+from hamcrest import is_
+
+from nti.app.segments.benchmarks.harness import compare
+from nti.app.segments.benchmarks.harness import read_results
+from nti.app.segments.benchmarks.harness import write_results
+
+
+def _result(name, values, peak_memory=100, objects_loaded=10):
+    return {'name': name,
+            'values': values,
+            'metadata': {'peak_memory': peak_memory,
+                         'objects_loaded': objects_loaded}}
+
+
+class TestHarness(TestCase):
+
+    def test_compare(self):
+        baseline = {'benchmarks': [_result('one', [1.0, 1.0]),
+                                   _result('two', [1.0])]}
+        current = {'benchmarks': [_result('one', [1.1, 1.1]),
+                                  _result('two', [1.0], objects_loaded=20),
+                                  _result('three', [5.0])]}
+
+        regressions = compare(baseline, current)
+        assert_that(regressions, contains('two objects_loaded: 10 -> 20'))
+        assert_that(compare(baseline, current, threshold=2.5), has_length(0))
+
+    def test_write_results(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'results.json')
+            write_results(path, [_result('one', [1.0]), _result('two', [1.0])])
+            write_results(path, [_result('one', [2.0])])
+
+            results = read_results(path)['benchmarks']
+            assert_that([(result['name'], result['values']) for result in results],
+                        is_([('two', [1.0]), ('one', [2.0])]))
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from unittest import TestCase
+from unittest import skipIf
+
+import BTrees
+
+from hamcrest import assert_that
+from hamcrest import contains
+from hamcrest import has_length
+from hamcrest import instance_of
+from hamcrest import is_
+from hamcrest import same_instance
+
+from nti.app.segments.bitmap import BitMap64
+from nti.app.segments.bitmap import BitmapIntIdSet
+from nti.app.segments.bitmap import like
+from nti.app.segments.bitmap import to_btree_set
+from nti.app.segments.bitmap import union
+
+from nti.segments.model import IntIdSet
+
+family = BTrees.family64
+
+
+class TestIntIdSets(TestCase):
+
+    def test_btrees(self):
+        one = IntIdSet(family.IF.Set((1, 2, 3)))
+        two = IntIdSet(family.IF.Set((3, 4)))
+
+        assert_that(like(one, ()), instance_of(IntIdSet))
+        assert_that(list(union(one, two).intids()), contains(1, 2, 3, 4))
+        assert_that(to_btree_set(one), same_instance(one.intids()))
+        assert_that(list(to_btree_set([5, 4])), contains(4, 5))
+
+
+@skipIf(BitMap64 is None, "pyroaring is not installed")
+class TestBitmapIntIdSet(TestCase):
+
+    def test_operations(self):
+        one = family.IF.Set(range(0, 100000, 3))
+        two = family.IF.Set(range(0, 100000, 5))
+        bitmap = BitmapIntIdSet(one)
+
+        assert_that(bitmap, has_length(len(one)))
+        assert_that(list(to_btree_set(bitmap.intersection(two))),
+                    is_(list(family.IF.intersection(one, two))))
+        assert_that(list(to_btree_set(bitmap.intersection(IntIdSet(two)))),
+                    is_(list(family.IF.intersection(one, two))))
+        assert_that(list(to_btree_set(bitmap.difference(two))),
+                    is_(list(family.IF.difference(one, two))))
+        assert_that(list(to_btree_set(union(bitmap, IntIdSet(two)))),
+                    is_(list(family.IF.union(one, two))))
+        assert_that(3 in bitmap, is_(True))
+        assert_that(5 in bitmap, is_(False))
+
+    def test_btree_operands(self):
+        bitmap = BitmapIntIdSet([1, 2, 3])
+        btree = family.IF.Set((2, 3, 4))
+
+        # Combined as BTrees rather than converted to bitmaps
+        result = bitmap.intersection(btree)
+        assert_that(result, instance_of(IntIdSet))
+        assert_that(list(result.intids()), contains(2, 3))
+        assert_that(bitmap.union(IntIdSet(btree)), instance_of(IntIdSet))
+
+        # while bitmaps combine as bitmaps
+        result = bitmap.difference(BitmapIntIdSet([1]))
+        assert_that(result, instance_of(BitmapIntIdSet))
+        assert_that(list(result), contains(2, 3))
+
+    def test_conversions(self):
+        bitmap = BitmapIntIdSet([3, 1, 2])
+        assert_that(like(bitmap, [7]), instance_of(BitmapIntIdSet))
+
+        btree = to_btree_set(bitmap)
+        assert_that(btree, instance_of(family.IF.Set))
+        assert_that(list(btree), contains(1, 2, 3))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from datetime import timedelta
+
+from unittest import TestCase
+
+import BTrees
+
+from hamcrest import assert_that
+from hamcrest import contains
+from hamcrest import has_length
+from hamcrest import is_
+from hamcrest import none
+
+from zope import interface
+
+from nti.app.segments.bulk import bulk_evaluator
+from nti.app.segments.bulk import leaf_key
+
+from nti.app.segments.interfaces import IIsDeactivatedFilterSet
+from nti.app.segments.interfaces import RANGE_OP_AFTER
+
+from nti.app.segments.model import LastActiveFilterSet
+from nti.app.segments.model import RelativeOffset
+
+from nti.app.segments.tests import SharedConfiguringTestLayer
+
+from nti.segments.interfaces import IUserFilterSet
+
+from nti.segments.model import IntersectionUserFilterSet
+from nti.segments.model import UnionUserFilterSet
+
+family = BTrees.family64
+
+
+@interface.implementer(IUserFilterSet)
+class _FixedFilterSet(object):
+
+    def __init__(self, intids):
+        self.included = family.IF.Set(intids)
+        self.applied = 0
+
+    def apply(self, initial_set):
+        self.applied += 1
+        return initial_set.intersection(self.included)
+
+
+@interface.implementer(IIsDeactivatedFilterSet)
+class _DeactivatedFilterSet(_FixedFilterSet):
+
+    def __init__(self, intids, deactivated=True):
+        super(_DeactivatedFilterSet, self).__init__(intids)
+        self.Deactivated = deactivated
+
+
+class TestBulkEvaluator(TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def test_composites(self):
+        evaluator = bulk_evaluator(range(10))
+        one = _FixedFilterSet(range(0, 8))
+        two = _FixedFilterSet(range(5, 10))
+        three = _FixedFilterSet((1,))
+
+        intersection = IntersectionUserFilterSet(filter_sets=[one, two])
+        assert_that(list(evaluator.evaluate(intersection)), contains(5, 6, 7))
+
+        union = UnionUserFilterSet(filter_sets=[three, intersection])
+        assert_that(list(evaluator.evaluate(union)), contains(1, 5, 6, 7))
+
+        assert_that(list(evaluator.evaluate(None)), contains(*range(10)))
+
+    def test_shared_leaves(self):
+        evaluator = bulk_evaluator(range(10))
+        deactivated = _DeactivatedFilterSet((1, 2))
+        same = _DeactivatedFilterSet((1, 2))
+        activated = _DeactivatedFilterSet(range(3, 10), deactivated=False)
+
+        assert_that(list(evaluator.evaluate(deactivated)), contains(1, 2))
+        assert_that(list(evaluator.evaluate(same)), contains(1, 2))
+        assert_that(list(evaluator.evaluate(activated)), has_length(7))
+
+        assert_that(deactivated.applied, is_(1))
+        assert_that(same.applied, is_(0))
+        assert_that(evaluator.leaf_evaluations, is_(2))
+        assert_that(evaluator.shared_leaves, is_(1))
+
+    def test_leaf_key(self):
+        def last_active(days, **kwargs):
+            return LastActiveFilterSet(
+                period=RelativeOffset(duration=timedelta(days=days),
+                                      operator=RANGE_OP_AFTER,
+                                      **kwargs))
+
+        assert_that(leaf_key(last_active(-10)), is_(leaf_key(last_active(-10))))
+        assert_that(leaf_key(last_active(-10, granularity=u'day')),
+                    is_(leaf_key(last_active(-10, granularity=u'day'))))
+        assert_that(leaf_key(last_active(-10)) == leaf_key(last_active(-11)),
+                    is_(False))
+        assert_that(leaf_key(_FixedFilterSet(())), is_(none()))
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+from unittest import TestCase
+
+import fudge
+
+from hamcrest import assert_that
+from hamcrest import contains
+from hamcrest import has_length
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import same_instance
+
+from pyramid.testing import DummyRequest
+
+import transaction
+
+from zope import component
+
+from nti.app.segments import cache as cache_module
+
+from nti.app.segments.cache import AbsoluteRangeCache
+from nti.app.segments.cache import FilterSetResultCache
+from nti.app.segments.cache import CreatorDisplayNameCache
+from nti.app.segments.cache import SegmentMembershipCache
+from nti.app.segments.cache import SegmentSortCache
+from nti.app.segments.cache import SiteAdminIntIdCache
+from nti.app.segments.cache import SortedIntIds
+
+from nti.app.segments.interfaces import IAbsoluteRangeCache
+from nti.app.segments.interfaces import ICreatorDisplayNameCache
+from nti.app.segments.interfaces import IIntIdSetCache
+from nti.app.segments.interfaces import ISegmentMembershipCache
+from nti.app.segments.interfaces import ISegmentSortCache
+from nti.app.segments.interfaces import ISiteAdminIntIdCache
+
+from nti.app.segments.tests import SharedConfiguringTestLayer
+
+from nti.app.segments.views import creator_display_name
+
+from nti.testing.matchers import verifiably_provides
+
+
+class TestSegmentMembershipCache(TestCase):
+
+    def test_valid_interface(self):
+        assert_that(SegmentMembershipCache(),
+                    verifiably_provides(ISegmentMembershipCache))
+
+    def test_get_set(self):
+        cache = SegmentMembershipCache()
+        assert_that(cache.get('alpha', 'seg'), is_(none()))
+
+        assert_that(cache.set('alpha', 'seg', [3, 1, 2]), is_(True))
+        assert_that(list(cache.get('alpha', 'seg')), contains(1, 2, 3))
+
+        # Keys are scoped by site
+        assert_that(cache.get('beta', 'seg'), is_(none()))
+
+    def test_invalidate_site(self):
+        cache = SegmentMembershipCache()
+        cache.set('alpha', 'seg', [1])
+        cache.set('beta', 'seg', [2])
+
+        cache.invalidate('alpha')
+        assert_that(cache.get('alpha', 'seg'), is_(none()))
+        assert_that(list(cache.get('beta', 'seg')), contains(2))
+
+        cache.invalidate()
+        assert_that(cache.get('beta', 'seg'), is_(none()))
+
+    def test_stale_generation_not_stored(self):
+        cache = SegmentMembershipCache()
+        generation = cache.generation('alpha')
+        cache.invalidate('alpha')
+
+        assert_that(cache.set('alpha', 'seg', [1], generation), is_(False))
+        assert_that(cache.get('alpha', 'seg'), is_(none()))
+
+        # Other sites are unaffected
+        assert_that(cache.set('beta', 'seg', [1], cache.generation('beta')),
+                    is_(True))
+
+        # Global invalidation affects every site
+        generation = cache.generation('beta')
+        cache.invalidate()
+        assert_that(cache.set('beta', 'seg', [1], generation), is_(False))
+
+    def test_expiry(self):
+        cache = SegmentMembershipCache(ttl=-1)
+        cache.set('alpha', 'seg', [1])
+        assert_that(cache.get('alpha', 'seg'), is_(none()))
+
+    def test_lru(self):
+        cache = SegmentMembershipCache(max_entries=2)
+        cache.set('alpha', 'one', [1])
+        cache.set('alpha', 'two', [2])
+
+        # Touch 'one' so 'two' is evicted
+        cache.get('alpha', 'one')
+        cache.set('alpha', 'three', [3])
+
+        assert_that(cache, has_length(2))
+        assert_that(cache.get('alpha', 'two'), is_(none()))
+        assert_that(list(cache.get('alpha', 'one')), contains(1))
+
+    def test_invalidate_entries(self):
+        cache = SegmentMembershipCache()
+        cache.set('alpha', 'one', [1])
+        cache.set('alpha', 'two', [2])
+        cache.set('beta', 'one', [1])
+
+        generation = cache.generation('alpha')
+        cache.invalidate_entries(lambda key, _: key == 'one', 'alpha')
+        assert_that(cache.get('alpha', 'one'), is_(none()))
+        assert_that(list(cache.get('alpha', 'two')), contains(2))
+        assert_that(list(cache.get('beta', 'one')), contains(1))
+        assert_that(cache.set('alpha', 'one', [1], generation), is_(False))
+
+        cache.invalidate_entries(lambda _, intids: 1 in intids)
+        assert_that(cache, has_length(1))
+
+
+class TestInvalidation(TestCase):
+
+    def test_index_membership(self):
+        cache = SegmentSortCache()
+        lastseen = ('filter-set', 'a', ('lastseen',))
+        created = ('filter-set', 'b', ('created',))
+        unknown = ('filter-set', 'c', None)
+        by_lastseen = created + ((('sorton', 'lastSeenTime'),), None)
+        for key in (lastseen, created, unknown, by_lastseen):
+            cache.set('alpha', key, [1])
+
+        cache_module._invalidate_index(cache, 'alpha', 'lastseen',
+                                       'lastseentime')
+        assert_that(cache, has_length(1))
+        assert_that(list(cache.get('alpha', created)), contains(1))
+
+    def test_filter_results(self):
+        cache = FilterSetResultCache()
+        cache.set(None, ('lastseen', 100, 200), [1])
+        cache.set(None, ('lastseen', 200, None), [2])
+        cache.set(None, ('created', 100, 200), [3])
+        cache.set(None, (('created', (100, 200)), ('lastseen', (100, None))), [1])
+        cache.set(None, ('topics', 'deactivated'), [4])
+
+        # Users seen now fall within open ranges, and leave those they were in
+        cache_module._invalidate_filter_results(cache, 1, (('lastseen', 300),),
+                                                False)
+        assert_that(cache, has_length(2))
+        assert_that(list(cache.get(None, ('created', 100, 200))), contains(3))
+        assert_that(list(cache.get(None, ('topics', 'deactivated'))), contains(4))
+
+        # Other results only on request
+        cache_module._invalidate_filter_results(cache, 5, (('created', 50),),
+                                                True)
+        assert_that(cache, has_length(1))
+
+    def test_one_commit_hook(self):
+        txn = transaction.begin()
+        try:
+            cache = SegmentMembershipCache()
+            cache_module._invalidate(cache, 'alpha')
+            cache_module._invalidate(cache, 'alpha')
+            cache_module._invalidate(cache, 'beta')
+            assert_that(list(txn.getAfterCommitHooks()), has_length(1))
+        finally:
+            transaction.abort()
+
+
+class TestCreatorDisplayNameCache(TestCase):
+
+    def test_valid_interface(self):
+        assert_that(CreatorDisplayNameCache(),
+                    verifiably_provides(ICreatorDisplayNameCache))
+        assert_that(IIntIdSetCache.providedBy(CreatorDisplayNameCache()),
+                    is_(False))
+
+    def test_get_set(self):
+        cache = CreatorDisplayNameCache()
+        cache.set('alpha', 'creator.one', u'Creator One')
+        assert_that(cache.get('alpha', 'creator.one'), is_(u'Creator One'))
+        assert_that(cache.get('beta', 'creator.one'), is_(none()))
+
+        # Stored as given
+        display_name = u'Creator Two'
+        cache.set('alpha', 'creator.two', display_name)
+        assert_that(cache.get('alpha', 'creator.two'), same_instance(display_name))
+
+
+class TestAbsoluteRangeCache(TestCase):
+
+    def test_valid_interface(self):
+        assert_that(AbsoluteRangeCache(),
+                    verifiably_provides(IAbsoluteRangeCache))
+
+    def test_invalidate_document(self):
+        cache = AbsoluteRangeCache()
+        cache.set('lastseen', (100, 200), [1, 2])
+        cache.set('lastseen', (200, None), [3])
+        cache.set('created', (100, 200), [1])
+
+        # Documents indexed into a range
+        generation = cache.generation('lastseen')
+        cache.invalidate_document('lastseen', 4, 250)
+        assert_that(cache.get('lastseen', (200, None)), is_(none()))
+        assert_that(list(cache.get('lastseen', (100, 200))), contains(1, 2))
+        # and racing evaluations aren't stored
+        assert_that(cache.set('lastseen', (200, None), [3], generation),
+                    is_(False))
+
+        # Documents leaving a range
+        cache.invalidate_document('lastseen', 1, 300)
+        assert_that(cache.get('lastseen', (100, 200)), is_(none()))
+        assert_that(list(cache.get('created', (100, 200))), contains(1))
+
+        # Upper bounds are exclusive
+        cache.set('lastseen', (100, 200), [1, 2])
+        cache.invalidate_document('lastseen', 5, 200)
+        assert_that(cache, has_length(2))
+
+    def test_expiry(self):
+        cache = AbsoluteRangeCache(ttl=-1)
+        future = time.time() + 3600
+        cache.set('lastseen', (100, 200), [1])
+        cache.set('lastseen', (100, None), [1])
+        cache.set('lastseen', (100, future), [1])
+
+        # Only ended ranges outlive the ttl
+        assert_that(list(cache.get('lastseen', (100, 200))), contains(1))
+        assert_that(cache.get('lastseen', (100, None)), is_(none()))
+        assert_that(cache.get('lastseen', (100, future)), is_(none()))
+
+
+class TestSiteAdminIntIdCache(TestCase):
+
+    def test_valid_interface(self):
+        assert_that(SiteAdminIntIdCache(),
+                    verifiably_provides(ISiteAdminIntIdCache))
+
+
+class TestSegmentSortCache(TestCase):
+
+    def test_valid_interface(self):
+        assert_that(SegmentSortCache(),
+                    verifiably_provides(ISegmentSortCache))
+
+    def test_order_preserved(self):
+        cache = SegmentSortCache()
+        cache.set('alpha', 'seg', [3, 1, 2])
+        result = cache.get('alpha', 'seg')
+        assert_that(list(result), contains(3, 1, 2))
+        assert_that(result.complete, is_(True))
+        assert_that(result.total, is_(3))
+
+    def test_partial(self):
+        cache = SegmentSortCache()
+        cache.set('alpha', 'seg', SortedIntIds([3, 1], complete=False, total=10))
+        result = cache.get('alpha', 'seg')
+        assert_that(list(result), contains(3, 1))
+        assert_that(result.complete, is_(False))
+        assert_that(result.total, is_(10))
+
+
+class TestCreatorDisplayName(TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def setUp(self):
+        component.getUtility(ICreatorDisplayNameCache).invalidate()
+
+    def tearDown(self):
+        component.getUtility(ICreatorDisplayNameCache).invalidate()
+
+    @fudge.patch('nti.app.segments.views._resolve_creator_display_name')
+    def test_memoized(self, fake_resolve):
+        fake_resolve.expects_call().returns(u'Creator One').times_called(1)
+
+        request = DummyRequest()
+        assert_that(creator_display_name(u'creator.one', request),
+                    is_(u'Creator One'))
+        assert_that(creator_display_name(u'creator.one', request),
+                    is_(u'Creator One'))
+
+        # Other requests are served from the shared cache
+        assert_that(creator_display_name(u'creator.one', DummyRequest()),
+                    is_(u'Creator One'))
+
+    @fudge.patch('nti.app.segments.views._resolve_creator_display_name')
+    def test_expired(self, fake_resolve):
+        fake_resolve.expects_call().returns(u'Creator One').times_called(2)
+        cache = component.getUtility(ICreatorDisplayNameCache)
+
+        creator_display_name(u'creator.one', DummyRequest())
+        cache.invalidate()
+        creator_display_name(u'creator.one', DummyRequest())
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from unittest import TestCase
+
+from hamcrest import assert_that
+from hamcrest import contains
+from hamcrest import has_length
+from hamcrest import is_
+from hamcrest import none
+
+from nti.app.segments.changes import SegmentMembershipLog
+
+from nti.app.segments.interfaces import ISegmentMembershipLog
+
+from nti.testing.matchers import verifiably_provides
+
+
+class TestSegmentMembershipLog(TestCase):
+
+    def test_valid_interface(self):
+        assert_that(SegmentMembershipLog(),
+                    verifiably_provides(ISegmentMembershipLog))
+
+    def test_baseline(self):
+        log = SegmentMembershipLog()
+        entered, exited = log.diff([1, 2])
+        assert_that(list(entered), has_length(0))
+        assert_that(list(exited), has_length(0))
+
+        log.record([1, 2])
+        assert_that(log.sequence, is_(0))
+        assert_that(list(log.members), contains(1, 2))
+        assert_that(log.changes_since(0), is_(([], [])))
+
+    def test_changes_since(self):
+        log = SegmentMembershipLog()
+        log.record([1, 2])
+
+        entered, exited = log.diff([2, 3])
+        assert_that(list(entered), contains(3))
+        assert_that(list(exited), contains(1))
+        log.record([2, 3], ['user.three'], ['user.one'])
+        log.record([1, 2], ['user.one'], ['user.three'])
+        log.record([1], (), ['user.two'])
+
+        assert_that(log.sequence, is_(3))
+        assert_that(list(log.members), contains(1))
+        assert_that(log.changes_since(0), is_(([], ['user.two'])))
+        assert_that(log.changes_since(1), is_((['user.one'], ['user.three', 'user.two'])))
+        assert_that(log.changes_since(3), is_(([], [])))
+
+        # Unknown tokens
+        assert_that(log.changes_since(4), is_(none()))
+        assert_that(log.changes_since(-1), is_(none()))
+
+    def test_bounded(self):
+        log = SegmentMembershipLog()
+        log.max_entries = 2
+        log.record([])
+        for doc_id in range(1, 5):
+            log.record([doc_id], ['user.%s' % doc_id], ['user.%s' % (doc_id - 1)])
+
+        assert_that(list(log.entries.keys()), contains(3, 4))
+        assert_that(log.changes_since(1), is_(none()))
+        assert_that(log.changes_since(2), is_((['user.4'], ['user.2'])))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from unittest import TestCase
+
+from hamcrest import assert_that
+from hamcrest import contains
+from hamcrest import is_
+
+from nti.app.segments.export import csv_lines
+from nti.app.segments.export import iter_members_csv
+from nti.app.segments.export import iter_user_chunks
+
+
+class _Jar(object):
+
+    minimized = 0
+
+    def cacheMinimize(self):
+        self.minimized += 1
+
+
+class _User(object):
+
+    def __init__(self, doc_id, jar):
+        self.doc_id = doc_id
+        self._p_jar = jar
+
+
+class _IntIds(object):
+
+    def __init__(self, users):
+        self.users = dict((x.doc_id, x) for x in users)
+        self.queried = []
+
+    def queryObject(self, doc_id):
+        self.queried.append(doc_id)
+        return self.users.get(doc_id)
+
+
+class _Export(object):
+
+    def header(self, external_id_types=()):
+        return [u'username'] + list(external_id_types)
+
+    def row(self, user):
+        return {u'username': u'user%d' % user.doc_id}
+
+
+class TestExport(TestCase):
+
+    def test_csv_lines(self):
+        lines = csv_lines([[u'username', u'realname'],
+                           [u'user.one', u'Ünïcode, Name']])
+        assert_that(lines,
+                    is_(u'username,realname\r\nuser.one,"Ünïcode, Name"\r\n'.encode('utf-8')))
+
+    def test_iter_user_chunks(self):
+        jar = _Jar()
+        intids = _IntIds([_User(x, jar) for x in range(5)])
+
+        # Unresolvable intids are skipped, order is preserved
+        chunks = []
+        for chunk in iter_user_chunks((4, 3, 99, 2, 1, 0), 2, intids):
+            chunks.append([x.doc_id for x in chunk])
+        assert_that(chunks, contains([4, 3], [2, 1], [0]))
+
+        # The cache was minimized after each full chunk was consumed
+        assert_that(jar.minimized, is_(2))
+
+    def test_iter_members_csv(self):
+        intids = _IntIds([_User(x, _Jar()) for x in range(3)])
+        progress = []
+        lines = iter_members_csv((2, 0, 1), 2, intids, progress.append,
+                                 export=_Export(),
+                                 external_id_types=(u'ext id1',))
+
+        # The header, and each chunk of rows, is written as it's produced
+        assert_that(next(lines), is_(b'username,ext id1\r\n'))
+        assert_that(intids.queried, is_([]))
+        assert_that(next(lines), is_(b'user2,\r\nuser0,\r\n'))
+        assert_that(b''.join(lines), is_(b'user1,\r\n'))
+        assert_that(progress, contains(2, 1))
+
+        # Each user was visited once
+        assert_that(intids.queried, contains(2, 0, 1))
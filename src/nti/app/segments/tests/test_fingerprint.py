@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from datetime import timedelta
+
+from unittest import TestCase
+
+from hamcrest import assert_that
+from hamcrest import has_length
+from hamcrest import is_
+from hamcrest import is_not
+
+from nti.app.segments.fingerprint import canonical_filter_set
+from nti.app.segments.fingerprint import filter_set_fingerprint
+
+from nti.app.segments.interfaces import GRANULARITY_DAY
+from nti.app.segments.interfaces import RANGE_OP_AFTER
+from nti.app.segments.interfaces import RANGE_OP_BEFORE
+
+from nti.app.segments.model import CreatedTimeFilterSet
+from nti.app.segments.model import IsDeactivatedFilterSet
+from nti.app.segments.model import LastActiveFilterSet
+from nti.app.segments.model import RelativeOffset
+
+from nti.app.segments.tests import SharedConfiguringTestLayer
+
+from nti.segments.model import IntersectionUserFilterSet
+from nti.segments.model import UnionUserFilterSet
+
+
+def _offset(days, operator=RANGE_OP_AFTER, granularity=None):
+    return RelativeOffset(duration=timedelta(days=-days),
+                          operator=operator,
+                          granularity=granularity)
+
+
+def _active(days, **kwargs):
+    return LastActiveFilterSet(period=_offset(days, **kwargs))
+
+
+def _created(days, **kwargs):
+    return CreatedTimeFilterSet(period=_offset(days, **kwargs))
+
+
+class TestFingerprint(TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def _equivalent(self, first, second):
+        assert_that(canonical_filter_set(first), is_(canonical_filter_set(second)))
+        assert_that(filter_set_fingerprint(first), is_(filter_set_fingerprint(second)))
+
+    def _different(self, first, second):
+        assert_that(filter_set_fingerprint(first),
+                    is_not(filter_set_fingerprint(second)))
+
+    def test_leaves(self):
+        self._equivalent(_active(30), _active(30))
+        self._equivalent(IsDeactivatedFilterSet(Deactivated=True),
+                         IsDeactivatedFilterSet(Deactivated=True))
+
+        self._different(_active(30), _active(31))
+        self._different(_active(30), _active(30, operator=RANGE_OP_BEFORE))
+        self._different(_active(30), _active(30, granularity=GRANULARITY_DAY))
+        self._different(_active(30), _created(30))
+        self._different(IsDeactivatedFilterSet(Deactivated=True),
+                        IsDeactivatedFilterSet(Deactivated=False))
+
+        assert_that(filter_set_fingerprint(_active(30)), has_length(40))
+        self._different(None, _active(30))
+
+    def test_combinators(self):
+        deactivated = IsDeactivatedFilterSet(Deactivated=False)
+
+        # Child order doesn't matter
+        self._equivalent(
+            IntersectionUserFilterSet(filter_sets=[_active(30), _created(10), deactivated]),
+            IntersectionUserFilterSet(filter_sets=[deactivated, _created(10), _active(30)]))
+
+        # Nested combinators of the same type are flattened
+        self._equivalent(
+            UnionUserFilterSet(filter_sets=[
+                _active(30),
+                UnionUserFilterSet(filter_sets=[_created(10), deactivated])]),
+            UnionUserFilterSet(filter_sets=[_active(30), _created(10), deactivated]))
+
+        # Single children replace their combinator, duplicates collapse
+        self._equivalent(
+            IntersectionUserFilterSet(filter_sets=[
+                UnionUserFilterSet(filter_sets=[_active(30), _active(30)])]),
+            _active(30))
+
+        # but unions and intersections differ
+        self._different(
+            UnionUserFilterSet(filter_sets=[_active(30), _created(10)]),
+            IntersectionUserFilterSet(filter_sets=[_active(30), _created(10)]))
+        self._different(
+            IntersectionUserFilterSet(filter_sets=[
+                _active(30),
+                UnionUserFilterSet(filter_sets=[_created(10), deactivated])]),
+            IntersectionUserFilterSet(filter_sets=[_active(30), _created(10), deactivated]))
+
+    def test_none_children(self):
+        def _with_none(factory, *filter_sets):
+            result = factory(filter_sets=[_active(1)])
+            # Bypass validation, as for filter sets stored with missing children
+            result.__dict__['filter_sets'] = list(filter_sets) + [None]
+            return result
+
+        self._equivalent(_with_none(IntersectionUserFilterSet, _created(10), _active(30)),
+                         _with_none(IntersectionUserFilterSet, _active(30), _created(10)))
+        self._different(_with_none(UnionUserFilterSet, _active(30), _created(10)),
+                        UnionUserFilterSet(filter_sets=[_active(30), _created(10)]))
+        assert_that(canonical_filter_set(_with_none(UnionUserFilterSet)),
+                    is_((u'none',)))
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+from datetime import timedelta
+
+from unittest import TestCase
+
+import BTrees
+
+from hamcrest import assert_that
+from hamcrest import contains_inanyorder
+from hamcrest import is_
+from hamcrest import is_not
+from hamcrest import none
+from hamcrest import same_instance
+
+from zope import component
+
+from zope.intid import IIntIds
+
+from zope.lifecycleevent import modified
+
+from nti.app.segments.incremental import IncrementalRangeStore
+from nti.app.segments.incremental import incremental_apply
+from nti.app.segments.incremental import incremental_key
+
+from nti.app.segments.interfaces import IIncrementalRangeStore
+from nti.app.segments.interfaces import RANGE_OP_AFTER
+from nti.app.segments.interfaces import RANGE_OP_BEFORE
+
+from nti.app.segments.model import LastActiveFilterSet
+from nti.app.segments.model import RelativeOffset
+
+from nti.app.segments.tests import SharedConfiguringTestLayer
+
+from nti.dataserver.tests import mock_dataserver
+
+from nti.dataserver.tests.mock_dataserver import WithMockDS
+
+from nti.dataserver.users import User
+
+from nti.segments.model import IntIdSet
+
+from nti.testing.matchers import verifiably_provides
+
+family = BTrees.family64
+
+DAY = timedelta(days=1).total_seconds()
+
+
+def _active(days, operator=RANGE_OP_AFTER):
+    return LastActiveFilterSet(period=RelativeOffset(duration=timedelta(days=-days),
+                                                     operator=operator))
+
+
+class TestIncrementalRangeStore(TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def test_valid_interface(self):
+        assert_that(IncrementalRangeStore(),
+                    verifiably_provides(IIncrementalRangeStore))
+
+    def test_key(self):
+        assert_that(incremental_key(_active(30)), is_(incremental_key(_active(30))))
+        assert_that(incremental_key(_active(30, RANGE_OP_BEFORE)), is_(none()))
+
+    @WithMockDS
+    def test_incremental_apply(self):
+        store = IncrementalRangeStore()
+        now = time.time()
+        with mock_dataserver.mock_db_trans():
+            intids = component.getUtility(IIntIds)
+            users = {}
+            for username, days in ((u'user.one', 1),
+                                   (u'user.two', 20),
+                                   (u'user.three', 35),
+                                   (u'user.four', 50)):
+                user = User.create_user(username=username)
+                user.lastSeenTime = now - days * DAY
+                modified(user)
+                users[username] = intids.getId(user)
+
+        def apply_active():
+            initial = IntIdSet(family.IF.Set(users.values()))
+            result = incremental_apply(_active(30), initial, store)
+            by_intid = dict((v, k) for k, v in users.items())
+            return [by_intid[x] for x in result.intids()]
+
+        with mock_dataserver.mock_db_trans():
+            assert_that(apply_active(),
+                        contains_inanyorder(u'user.one', u'user.two'))
+            snapshot = store.get(None, incremental_key(_active(30)))
+
+            # As if evaluated ten days ago, when user.three was active
+            snapshot.start -= 10 * DAY
+            snapshot.evaluated_at -= 10 * DAY
+            snapshot.intids.add(users[u'user.three'])
+
+        with mock_dataserver.mock_db_trans():
+            # Seen since, so enters
+            user = User.get_user(u'user.four')
+            user.lastSeenTime = time.time()
+            modified(user)
+
+            # Updated in place: user.three left the window
+            assert_that(apply_active(),
+                        contains_inanyorder(u'user.one', u'user.two', u'user.four'))
+            assert_that(store.get(None, incremental_key(_active(30))),
+                        same_instance(snapshot))
+
+            # Windows shorter than the time since evaluation are re-evaluated
+            snapshot.evaluated_at = snapshot.start - DAY
+            assert_that(apply_active(),
+                        contains_inanyorder(u'user.one', u'user.two', u'user.four'))
+            assert_that(store.get(None, incremental_key(_active(30))),
+                        is_not(same_instance(snapshot)))
+
+    @WithMockDS
+    def test_filter_set_uses_store(self):
+        store = IncrementalRangeStore()
+        gsm = component.getGlobalSiteManager()
+        gsm.registerUtility(store, IIncrementalRangeStore)
+        try:
+            with mock_dataserver.mock_db_trans():
+                user = User.create_user(username=u'user.one')
+                user.lastSeenTime = time.time()
+                modified(user)
+                uid = component.getUtility(IIntIds).getId(user)
+
+            with mock_dataserver.mock_db_trans():
+                initial = IntIdSet(family.IF.Set([uid]))
+                result = _active(30).apply(initial)
+                assert_that(list(result.intids()), is_([uid]))
+                assert_that(len(store), is_(1))
+
+                # Unsupported ranges are evaluated as before
+                result = _active(30, RANGE_OP_BEFORE).apply(initial)
+                assert_that(list(result.intids()), is_([]))
+                assert_that(len(store), is_(1))
+        finally:
+            gsm.unregisterUtility(store, IIncrementalRangeStore)
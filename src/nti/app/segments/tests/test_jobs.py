@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from unittest import TestCase
+
+import fudge
+
+from hamcrest import assert_that
+from hamcrest import contains
+from hamcrest import has_length
+from hamcrest import has_properties
+from hamcrest import instance_of
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import not_none
+
+from persistent import Persistent
+
+from nti.app.segments.interfaces import IExportJobQueue
+from nti.app.segments.interfaces import IExportJobRegistry
+from nti.app.segments.interfaces import ISegmentExportJob
+
+from nti.app.segments.jobs import ExportJobRegistry
+from nti.app.segments.jobs import JOB_FAILED
+from nti.app.segments.jobs import JOB_PENDING
+from nti.app.segments.jobs import JOB_RUNNING
+from nti.app.segments.jobs import JOB_SUCCESS
+from nti.app.segments.jobs import LocalExportJobQueue
+from nti.app.segments.jobs import SegmentExportJob
+from nti.app.segments.jobs import ThreadPoolExportJobQueue
+
+from nti.testing.matchers import verifiably_provides
+
+
+def _fake_csv(doc_ids, chunk_size, on_chunk=None, db=None):
+    yield b'username\r\n'
+    for doc_id in doc_ids:
+        on_chunk(1)
+        yield b'user%d\r\n' % doc_id
+
+
+class _TransactionManager(object):
+
+    def __init__(self):
+        self.commits = 0
+        self.aborts = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def abort(self):
+        self.aborts += 1
+
+
+class TestExportJobs(TestCase):
+
+    def _job(self, doc_ids=(1, 2)):
+        return SegmentExportJob(doc_ids, u'export.csv', u'creator', 1,
+                                site_name=u'alpha')
+
+    def test_valid_interfaces(self):
+        assert_that(self._job(), verifiably_provides(ISegmentExportJob))
+        assert_that(LocalExportJobQueue(), verifiably_provides(IExportJobQueue))
+        assert_that(ThreadPoolExportJobQueue(), verifiably_provides(IExportJobQueue))
+        assert_that(ExportJobRegistry(), verifiably_provides(IExportJobRegistry))
+
+    def test_doc_ids(self):
+        job = self._job((3, 1, 2))
+        assert_that(list(job.doc_ids), contains(3, 1, 2))
+        # Held in their own records, not rewritten with the job's progress
+        assert_that(job._doc_ids, is_(instance_of(Persistent)))
+
+    @fudge.patch('nti.app.segments.jobs.iter_members_csv_detached')
+    def test_run(self, fake_iter):
+        fake_iter.is_callable().calls(_fake_csv)
+        job = self._job()
+        assert_that(job, has_properties(status=JOB_PENDING, total=2, written=0))
+
+        tm = _TransactionManager()
+        job.run(tm)
+        assert_that(job, has_properties(status=JOB_SUCCESS, written=2,
+                                        output=not_none()))
+        with job.output.open('r') as f:
+            assert_that(f.read(), is_(b'username\r\nuser1\r\nuser2\r\n'))
+
+        # Progress is committed as each chunk is written
+        assert_that(tm.commits, is_(5))
+
+    @fudge.patch('nti.app.segments.jobs.iter_members_csv_detached')
+    def test_failure(self, fake_iter):
+        fake_iter.is_callable().raises(ValueError('boom'))
+        job = self._job()
+        tm = _TransactionManager()
+        job.run(tm)
+        assert_that(job, has_properties(status=JOB_FAILED, error='boom',
+                                        output=none()))
+        assert_that(tm.aborts, is_(1))
+
+    @fudge.patch('nti.app.segments.jobs.iter_members_csv_detached')
+    def test_cancelled(self, fake_iter):
+        fake_iter.is_callable().calls(_fake_csv)
+        job = self._job()
+        job.run(_TransactionManager(), cancelled=lambda: job.written > 0)
+        assert_that(job, has_properties(status=JOB_RUNNING, written=1,
+                                        output=none()))
+
+        # Never started once cancelled
+        job = self._job()
+        job.run(_TransactionManager(), cancelled=lambda: True)
+        assert_that(job, has_properties(status=JOB_PENDING, written=0))
+
+    def test_local_queue(self):
+        queue = LocalExportJobQueue()
+        job = self._job()
+        queue.submit(job)
+        assert_that(queue.pending, contains((u'alpha', 1, job.id)))
+
+    def test_registry(self):
+        registry = ExportJobRegistry()
+        job = self._job()
+        registry.add(job)
+        assert_that(registry.get(job.id), is_(job))
+        assert_that(job.__parent__, is_(registry))
+
+        registry.remove(job.id)
+        assert_that(registry.get(job.id), is_(none()))
+
+    @fudge.patch('nti.app.segments.jobs.iter_members_csv_detached')
+    def test_registry_expiry(self, fake_iter):
+        fake_iter.is_callable().calls(_fake_csv)
+        registry = ExportJobRegistry()
+        registry.retention = -1
+        job = self._job()
+        registry.add(job)
+
+        # Unfinished jobs are retained
+        assert_that(registry.get(job.id), is_(job))
+
+        job.run(_TransactionManager())
+        assert_that(registry.get(job.id), is_(none()))
+
+        # and removed as others are added
+        registry.add(self._job())
+        assert_that(list(registry._jobs), has_length(1))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from unittest import TestCase
+
+import BTrees
+
+from hamcrest import assert_that
+from hamcrest import calling
+from hamcrest import contains
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import raises
+
+from nti.app.segments.keyset import InvalidCursor
+from nti.app.segments.keyset import decode_cursor
+from nti.app.segments.keyset import encode_cursor
+from nti.app.segments.keyset import keyset_order
+from nti.app.segments.keyset import keyset_page
+
+family = BTrees.family64
+
+
+class _ValueIndex(object):
+
+    def __init__(self, values):
+        self.values_to_documents = family.OO.BTree()
+        self.documents_to_values = family.IO.BTree()
+        for doc_id, value in values.items():
+            self.values_to_documents.setdefault(value, family.IF.TreeSet()).add(doc_id)
+            self.documents_to_values[doc_id] = value
+
+
+class TestKeyset(TestCase):
+
+    def _pages(self, members, index=None, reverse=False, limit=2):
+        ordered = keyset_order(members, index, reverse)
+        result = []
+        after = None
+        while True:
+            page, last = keyset_page(ordered, index, reverse, after, limit)
+            result.append(page)
+            if last is None:
+                return result
+            after = decode_cursor(encode_cursor(last, 'name', reverse),
+                                  'name', reverse)
+
+    def test_pages(self):
+        index = _ValueIndex({1: u'c', 2: u'a', 3: u'b', 4: u'a', 6: u'z'})
+        members = family.IF.Set([1, 2, 3, 4, 5, 7])
+
+        # Unindexed members follow, by intid
+        assert_that(self._pages(members, index),
+                    contains([2, 4], [3, 1], [5, 7]))
+        assert_that(self._pages(members, index, reverse=True),
+                    contains([1, 3], [4, 2], [7, 5]))
+        assert_that(self._pages(members),
+                    contains([1, 2], [3, 4], [5, 7]))
+
+        ordered = keyset_order(members, index)
+        assert_that(ordered, contains(2, 4, 3, 1, 5, 7))
+        page, last = keyset_page(ordered, index, limit=10)
+        assert_that(page, contains(2, 4, 3, 1, 5, 7))
+        assert_that(last, is_(none()))
+
+    def test_stable(self):
+        index = _ValueIndex({1: u'a', 2: u'b', 3: u'c'})
+        page, last = keyset_page(keyset_order([1, 2, 3], index), index,
+                                 limit=1)
+        assert_that(page, contains(1))
+
+        # Members added before, or removed from, the position don't shift
+        # the following page
+        index = _ValueIndex({1: u'a', 2: u'b', 3: u'c', 4: u'a'})
+        page, _ = keyset_page(keyset_order([2, 3, 4], index), index,
+                              after=last, limit=1)
+        assert_that(page, contains(4))
+        page, _ = keyset_page(keyset_order([3], index), index,
+                              after=(True, u'a', 4), limit=1)
+        assert_that(page, contains(3))
+
+    def test_invalid_cursors(self):
+        cursor = encode_cursor((True, u'a', 1), 'name')
+        assert_that(decode_cursor(cursor, 'name'), is_((True, u'a', 1)))
+        assert_that(calling(decode_cursor).with_args(cursor, 'other'),
+                    raises(InvalidCursor))
+        assert_that(calling(decode_cursor).with_args(cursor, 'name', True),
+                    raises(InvalidCursor))
+        assert_that(calling(decode_cursor).with_args(u'not a cursor'),
+                    raises(InvalidCursor))
@@ -18,8 +18,11 @@ from hamcrest import has_key
 from hamcrest import has_length
 from hamcrest import has_properties
 from hamcrest import is_
+from hamcrest import less_than_or_equal_to
+from hamcrest import none
 from hamcrest import not_
 from hamcrest import not_none
+from hamcrest import same_instance
 
 from zope import component
 
@@ -32,12 +35,18 @@ from zope.intid import IIntIds
 
 from zope.lifecycleevent import modified
 
+from nti.app.segments.interfaces import GRANULARITY_DAY
+from nti.app.segments.interfaces import GRANULARITY_HOUR
+from nti.app.segments.interfaces import IAbsoluteRangeCache
+from nti.app.segments.interfaces import IAbsoluteTimeRange
 from nti.app.segments.interfaces import ICreatedTimeFilterSet
+from nti.app.segments.interfaces import IFilterSetResultCache
 from nti.app.segments.interfaces import IIsDeactivatedFilterSet
 from nti.app.segments.interfaces import ILastActiveFilterSet
 from nti.app.segments.interfaces import RANGE_OP_AFTER
 from nti.app.segments.interfaces import RANGE_OP_BEFORE
 
+from nti.app.segments.model import AbsoluteTimeRange
 from nti.app.segments.model import CreatedTimeFilterSet
 from nti.app.segments.model import IsDeactivatedFilterSet
 from nti.app.segments.model import LastActiveFilterSet
@@ -127,6 +136,86 @@ class TimeRangeFilterSetModelTestMixin(object):
         assert_that(ext_filterset['period'], not_(has_key('range_tuple')))
 
 
+class TestRelativeOffset(TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def test_unsnapped(self):
+        offset = RelativeOffset(duration=timedelta(days=-1),
+                                operator=RANGE_OP_AFTER)
+        assert_that(offset.is_stable, is_(False))
+        start, end = offset.range_tuple
+        assert_that(end, is_(none()))
+        assert_that(start, is_(not_none()))
+
+    def test_snapped(self):
+        offset = RelativeOffset(duration=timedelta(days=-30),
+                                operator=RANGE_OP_BEFORE,
+                                granularity=GRANULARITY_DAY)
+        assert_that(offset.is_stable, is_(True))
+        start, end = offset.range_tuple
+        assert_that(start, is_(none()))
+        assert_that(end % timedelta(days=1).total_seconds(), is_(0))
+        thirty_days_ago = time.time() - timedelta(days=30).total_seconds()
+        assert_that(end, is_(less_than_or_equal_to(thirty_days_ago)))
+        assert_that(offset.range_tuple, is_((start, end)))
+
+        offset.granularity = GRANULARITY_HOUR
+        assert_that(offset.range_tuple[1] % 3600, is_(0))
+
+    def test_externalize_granularity(self):
+        offset = RelativeOffset(duration=timedelta(days=30),
+                                operator=RANGE_OP_AFTER,
+                                granularity=GRANULARITY_DAY)
+        assert_that(to_external_object(offset),
+                    has_entries(granularity=GRANULARITY_DAY))
+
+
+class TestAbsoluteTimeRange(TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def test_valid_interface(self):
+        assert_that(AbsoluteTimeRange(start=0.0, end=100.0),
+                    verifiably_provides(IAbsoluteTimeRange))
+
+    def test_range_tuple(self):
+        period = AbsoluteTimeRange(start=0.0, end=100.0)
+        assert_that(period.is_stable, is_(True))
+        assert_that(period.range_tuple, is_((0.0, 100.0)))
+        assert_that(AbsoluteTimeRange(end=100.0).range_tuple,
+                    is_((None, 100.0)))
+
+    def test_internalize(self):
+        ext_obj = {
+            "MimeType": CreatedTimeFilterSet.mime_type,
+            "period": {
+                "MimeType": AbsoluteTimeRange.mime_type,
+                "start": "2026-01-01T00:00:00Z",
+                "end": 1775001600,
+                # This should just get ignored
+                "range_tuple": [0, 1]
+            }
+        }
+        factory = find_factory_for(ext_obj)
+        filter_set = factory()
+        update_from_external_object(filter_set, ext_obj)
+        assert_that(filter_set.period, is_(AbsoluteTimeRange))
+        assert_that(filter_set.period.range_tuple,
+                    is_((1767225600, 1775001600)))
+
+    def test_externalize(self):
+        period = AbsoluteTimeRange(start=1767225600.0)
+        ext_period = to_external_object(period)
+        assert_that(ext_period,
+                    has_entries({
+                        "MimeType": AbsoluteTimeRange.mime_type,
+                        "start": 1767225600.0,
+                        "end": none(),
+                    }))
+        assert_that(ext_period, not_(has_key('range_tuple')))
+
+
 class TestLastActiveFilterSet(TimeRangeFilterSetModelTestMixin, TestCase):
 
     layer = SharedConfiguringTestLayer
@@ -161,9 +250,10 @@ class ApplyTimeRangeFilterSetTestMixin(object):
     factory = None
     attribute_name = None
 
-    def _create_filterset(self, duration, operator):
+    def _create_filterset(self, duration, operator, granularity=None):
         offset = RelativeOffset(duration=duration,
-                                operator=operator)
+                                operator=operator,
+                                granularity=granularity)
         filter_set = self.factory(period=offset)
 
         return filter_set
@@ -244,6 +334,140 @@ class ApplyTimeRangeFilterSetTestMixin(object):
                                                        u'user.two',
                                                        u'user.three'))
 
+    @WithMockDS
+    def test_restricted_matches_scan(self):
+        with mock_dataserver.mock_db_trans():
+            create_site('restricted-test-site')
+
+        with _provide_utility(BASEADULT, IComponents, name='genericadultbase'):
+            with mock_dataserver.mock_db_trans(site_name='restricted-test-site'):
+                now = time.time()
+                for username, days in ((u'user.one', 0),
+                                       (u'user.two', 10),
+                                       (u'user.three', 30)):
+                    user = User.create_user(username=username)
+                    setattr(user, self.attribute_name,
+                            now - timedelta(days=days).total_seconds())
+                    modified(user)
+
+            with mock_dataserver.mock_db_trans(site_name='restricted-test-site'):
+                candidates = intids_of_users_by_site(getSite(),
+                                                     filter_deactivated=False)
+                for duration, operator in ((timedelta(days=-11), RANGE_OP_BEFORE),
+                                           (timedelta(days=-11), RANGE_OP_AFTER),
+                                           (timedelta(days=0), RANGE_OP_BEFORE)):
+                    filter_set = self._create_filterset(duration, operator)
+                    start, end = filter_set.period.range_tuple
+
+                    scanned = IntIdSet(candidates).intersection(
+                        filter_set.included_intids(start, end))
+                    restricted = filter_set.restricted_intids(candidates,
+                                                              start, end)
+                    assert_that(list(restricted),
+                                is_(list(scanned.intids())))
+
+    @WithMockDS
+    def test_apply_memoized(self):
+        result_cache = component.getUtility(IFilterSetResultCache)
+        result_cache.invalidate()
+
+        with mock_dataserver.mock_db_trans():
+            create_site('memoized-test-site')
+
+        with _provide_utility(BASEADULT, IComponents, name='genericadultbase'):
+            with mock_dataserver.mock_db_trans(site_name='memoized-test-site'):
+                user_one = User.create_user(username=u'user.one')
+                setattr(user_one, self.attribute_name,
+                        time.time() - timedelta(days=10).total_seconds())
+                modified(user_one)
+
+            with mock_dataserver.mock_db_trans(site_name='memoized-test-site'):
+                filter_set = self._create_filterset(timedelta(days=-5),
+                                                    RANGE_OP_BEFORE,
+                                                    GRANULARITY_DAY)
+                assert_that(self.apply(filter_set),
+                            contains_inanyorder(u'user.one'))
+                assert_that(result_cache, has_length(1))
+
+                # Served from the memo on subsequent evaluation
+                assert_that(self.apply(filter_set),
+                            contains_inanyorder(u'user.one'))
+                assert_that(result_cache, has_length(1))
+
+                # Unquantized ranges aren't memoized
+                filter_set.period.granularity = None
+                assert_that(self.apply(filter_set),
+                            contains_inanyorder(u'user.one'))
+                assert_that(result_cache, has_length(1))
+
+            with mock_dataserver.mock_db_trans(site_name='memoized-test-site'):
+                # User changes invalidate memoized results
+                user_two = User.create_user(username=u'user.two')
+                setattr(user_two, self.attribute_name,
+                        time.time() - timedelta(days=10).total_seconds())
+                modified(user_two)
+                assert_that(result_cache, has_length(0))
+
+
+    @WithMockDS
+    def test_apply_absolute_cached(self):
+        range_cache = component.getUtility(IAbsoluteRangeCache)
+        range_cache.invalidate()
+
+        with mock_dataserver.mock_db_trans():
+            create_site('absolute-test-site')
+
+        now = time.time()
+        with _provide_utility(BASEADULT, IComponents, name='genericadultbase'):
+            with mock_dataserver.mock_db_trans(site_name='absolute-test-site'):
+                user_one = User.create_user(username=u'user.one')
+                setattr(user_one, self.attribute_name,
+                        now - timedelta(days=10).total_seconds())
+                modified(user_one)
+
+            period = AbsoluteTimeRange(start=now - timedelta(days=20).total_seconds(),
+                                       end=now - timedelta(days=5).total_seconds())
+            filter_set = self.factory(period=period)
+            with mock_dataserver.mock_db_trans(site_name='absolute-test-site'):
+                assert_that(self.apply(filter_set),
+                            contains_inanyorder(u'user.one'))
+                assert_that(range_cache, has_length(1))
+
+            with mock_dataserver.mock_db_trans(site_name='absolute-test-site'):
+                # Changes outside the range leave it cached
+                user_two = User.create_user(username=u'user.two')
+                setattr(user_two, self.attribute_name,
+                        now - timedelta(days=30).total_seconds())
+                modified(user_two)
+                assert_that(range_cache, has_length(1))
+
+            with mock_dataserver.mock_db_trans(site_name='absolute-test-site'):
+                assert_that(range_cache, has_length(1))
+                assert_that(self.apply(filter_set),
+                            contains_inanyorder(u'user.one'))
+
+                # Users moving into the range invalidate it
+                user_two = User.get_user(u'user.two')
+                setattr(user_two, self.attribute_name,
+                        now - timedelta(days=15).total_seconds())
+                modified(user_two)
+                assert_that(range_cache, has_length(0))
+
+            with mock_dataserver.mock_db_trans(site_name='absolute-test-site'):
+                assert_that(self.apply(filter_set),
+                            contains_inanyorder(u'user.one', u'user.two'))
+                assert_that(range_cache, has_length(1))
+
+                # as do users moving out of it
+                user_one = User.get_user(u'user.one')
+                setattr(user_one, self.attribute_name, now)
+                modified(user_one)
+                assert_that(range_cache, has_length(0))
+
+            with mock_dataserver.mock_db_trans(site_name='absolute-test-site'):
+                assert_that(self.apply(filter_set),
+                            contains_inanyorder(u'user.two'))
+
 
 class TestApplyLastActiveFilterSet(ApplyTimeRangeFilterSetTestMixin, TestCase):
 
@@ -304,3 +528,30 @@ class IsDeactivatedModelTest(object):
                         'MimeType': IsDeactivatedFilterSet.mime_type,
                         "Deactivated": "false"
                     }))
+
+
+class TestApplyIsDeactivatedFilterSet(TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    @WithMockDS
+    def test_deactivated_intids_shared(self):
+        component.getUtility(IFilterSetResultCache).invalidate()
+
+        with mock_dataserver.mock_db_trans():
+            User.create_user(username=u'user.one')
+
+        with mock_dataserver.mock_db_trans():
+            deactivated = IsDeactivatedFilterSet(Deactivated=True)
+            activated = IsDeactivatedFilterSet(Deactivated=False)
+
+            # Copies are shared between filter sets rather than rebuilt
+            assert_that(deactivated.deactivated_intids,
+                        is_(same_instance(activated.deactivated_intids)))
+
+            initial_intids = intids_of_users_by_site(None,
+                                                     filter_deactivated=False)
+            rs = IntIdSet(initial_intids)
+            assert_that(list(deactivated.apply(rs).intids()), has_length(0))
+            assert_that(list(activated.apply(rs).intids()),
+                        has_length(len(initial_intids)))
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+from datetime import timedelta
+
+from unittest import TestCase
+
+import BTrees
+
+from hamcrest import assert_that
+from hamcrest import contains
+from hamcrest import contains_inanyorder
+from hamcrest import has_entries
+from hamcrest import has_length
+from hamcrest import is_
+
+from zope import component
+from zope import interface
+
+from zope.intid import IIntIds
+
+from zope.lifecycleevent import modified
+
+from nti.app.segments.interfaces import RANGE_OP_AFTER
+from nti.app.segments.interfaces import RANGE_OP_BEFORE
+
+from nti.app.segments.model import CreatedTimeFilterSet
+from nti.app.segments.model import IsDeactivatedFilterSet
+from nti.app.segments.model import LastActiveFilterSet
+from nti.app.segments.model import RelativeOffset
+
+from nti.app.segments.planner import DEACTIVATED_SELECTIVITY
+from nti.app.segments.planner import OP_INTERSECTION
+from nti.app.segments.planner import OP_LEAF
+from nti.app.segments.planner import OP_MERGED_RANGE
+from nti.app.segments.planner import OP_UNION
+from nti.app.segments.planner import FilterSetPlanner
+from nti.app.segments.planner import evaluate_filter_set
+
+from nti.app.segments.tests import SharedConfiguringTestLayer
+
+from nti.dataserver.tests import mock_dataserver
+
+from nti.dataserver.tests.mock_dataserver import WithMockDS
+
+from nti.dataserver.users import User
+
+from nti.segments.interfaces import IUserFilterSet
+
+from nti.segments.model import IntersectionUserFilterSet
+from nti.segments.model import IntIdSet
+from nti.segments.model import UnionUserFilterSet
+
+family = BTrees.family64
+
+
+@interface.implementer(IUserFilterSet)
+class _FixedFilterSet(object):
+
+    mimeType = 'application/vnd.nextthought.segments.test.fixed'
+
+    def __init__(self, intids):
+        self.included = family.IF.Set(intids)
+        self.applied = 0
+
+    def apply(self, initial_set):
+        self.applied += 1
+        return initial_set.intersection(self.included)
+
+
+class _DeactivatedFilterSet(IsDeactivatedFilterSet):
+
+    @property
+    def deactivated_intids(self):
+        raise AssertionError('The index is not copied')
+
+    def _native_deactivated_intids(self):
+        raise AssertionError('The index is not counted')
+
+
+class TestPlanner(TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def _initial(self, count=10):
+        return IntIdSet(family.IF.Set(range(count)))
+
+    def test_intersection(self):
+        one = _FixedFilterSet(range(0, 8))
+        two = _FixedFilterSet(range(5, 10))
+        filter_set = IntersectionUserFilterSet(filter_sets=[one, two])
+
+        result, plan = evaluate_filter_set(filter_set, self._initial())
+        assert_that(list(result.intids()), contains(5, 6, 7))
+        assert_that(plan.operation, is_(OP_INTERSECTION))
+        assert_that(plan.children, has_length(2))
+        assert_that(plan.to_external(), has_entries(InputSize=10,
+                                                    OutputSize=3))
+
+    def test_intersection_short_circuit(self):
+        empty = _FixedFilterSet(())
+        other = _FixedFilterSet(range(10))
+        filter_set = IntersectionUserFilterSet(filter_sets=[other, empty, other])
+
+        result, plan = evaluate_filter_set(filter_set, self._initial())
+        assert_that(list(result.intids()), has_length(0))
+
+        # Unknown leaves all share an estimate, so only stop after the
+        # first empty result
+        skipped = [child.skipped for child in plan.children]
+        assert_that(skipped, contains(False, False, True))
+        assert_that(other.applied, is_(1))
+
+    def test_nested_intersection_flattened(self):
+        one = _FixedFilterSet(range(0, 8))
+        two = _FixedFilterSet(range(5, 10))
+        nested = IntersectionUserFilterSet(filter_sets=[two])
+        filter_set = IntersectionUserFilterSet(filter_sets=[one, nested])
+
+        result, plan = evaluate_filter_set(filter_set, self._initial())
+        assert_that(list(result.intids()), contains(5, 6, 7))
+        assert_that([x.operation for x in plan.children],
+                    contains(OP_LEAF, OP_LEAF))
+
+    def test_union(self):
+        one = _FixedFilterSet((1, 2))
+        two = _FixedFilterSet((2, 3))
+        filter_set = UnionUserFilterSet(filter_sets=[one, two])
+
+        result, plan = evaluate_filter_set(filter_set, self._initial())
+        assert_that(list(result.intids()), contains(1, 2, 3))
+        assert_that(plan.operation, is_(OP_UNION))
+
+    def test_union_short_circuit(self):
+        everyone = _FixedFilterSet(range(10))
+        other = _FixedFilterSet((1,))
+        filter_set = UnionUserFilterSet(filter_sets=[everyone, other])
+
+        result, plan = evaluate_filter_set(filter_set, self._initial())
+        assert_that(list(result.intids()), has_length(10))
+        assert_that(plan.children[1].skipped, is_(True))
+
+
+class TestPlannerMergedRanges(TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    @WithMockDS
+    def test_merged_ranges(self):
+        with mock_dataserver.mock_db_trans():
+            now = time.time()
+            intids = component.getUtility(IIntIds)
+            user_intids = []
+            for username, last_seen, created in ((u'user.one', 1, 20),
+                                                 (u'user.two', 1, 1),
+                                                 (u'user.three', 20, 1)):
+                user = User.create_user(username=username)
+                user.lastSeenTime = now - timedelta(days=last_seen).total_seconds()
+                user.createdTime = now - timedelta(days=created).total_seconds()
+                modified(user)
+                user_intids.append(intids.getId(user))
+
+        with mock_dataserver.mock_db_trans():
+            active = LastActiveFilterSet(
+                period=RelativeOffset(duration=timedelta(days=-10),
+                                      operator=RANGE_OP_AFTER))
+            old = CreatedTimeFilterSet(
+                period=RelativeOffset(duration=timedelta(days=-10),
+                                      operator=RANGE_OP_BEFORE))
+            filter_set = IntersectionUserFilterSet(filter_sets=[active, old])
+
+            initial = IntIdSet(family.IF.Set(user_intids))
+            result, plan = evaluate_filter_set(filter_set, initial)
+
+            expected = active.apply(old.apply(initial))
+            assert_that(list(result.intids()),
+                        contains_inanyorder(*list(expected.intids())))
+            assert_that(list(result.intids()), has_length(1))
+
+            assert_that(plan.children, has_length(1))
+            assert_that(plan.children[0].operation, is_(OP_MERGED_RANGE))
+            assert_that(plan.to_external(), has_entries(
+                Children=contains(has_entries(Operation=OP_MERGED_RANGE,
+                                              OutputSize=1))))
+
+    def test_deactivated_estimate(self):
+        # Independent of the size of the input
+        for planner in (FilterSetPlanner(10), FilterSetPlanner(100000)):
+            assert_that(planner.selectivity(_DeactivatedFilterSet(Deactivated=True)),
+                        is_(DEACTIVATED_SELECTIVITY))
+            assert_that(planner.selectivity(_DeactivatedFilterSet(Deactivated=False)),
+                        is_(1.0 - DEACTIVATED_SELECTIVITY))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from unittest import TestCase
+
+import fudge
+
+from zope import component
+
+from hamcrest import assert_that
+from hamcrest import contains
+from hamcrest import greater_than_or_equal_to
+from hamcrest import has_length
+from hamcrest import has_properties
+from hamcrest import is_
+from hamcrest import less_than_or_equal_to
+from hamcrest import none
+from hamcrest import same_instance
+
+from nti.app.segments.interfaces import ISegmentRefreshScheduler
+from nti.app.segments.interfaces import ISegmentRefreshSettings
+from nti.app.segments.interfaces import ISegmentSnapshotStore
+
+from nti.app.segments.refresh import LocalSegmentRefreshScheduler
+from nti.app.segments.refresh import MembershipSnapshot
+from nti.app.segments.refresh import PersistentMembershipSnapshot
+from nti.app.segments.refresh import SegmentRefreshSettings
+from nti.app.segments.refresh import SegmentSnapshotStore
+from nti.app.segments.refresh import ThreadPoolSegmentRefreshScheduler
+from nti.app.segments.refresh import membership_snapshot
+
+from nti.testing.matchers import verifiably_provides
+
+
+class TestSegmentRefresh(TestCase):
+
+    def test_valid_interfaces(self):
+        assert_that(SegmentRefreshSettings(),
+                    verifiably_provides(ISegmentRefreshSettings))
+        assert_that(SegmentSnapshotStore(),
+                    verifiably_provides(ISegmentSnapshotStore))
+        assert_that(LocalSegmentRefreshScheduler(),
+                    verifiably_provides(ISegmentRefreshScheduler))
+        assert_that(ThreadPoolSegmentRefreshScheduler(),
+                    verifiably_provides(ISegmentRefreshScheduler))
+
+    def test_snapshot_store(self):
+        store = SegmentSnapshotStore()
+        store.set('alpha', 1, MembershipSnapshot([3, 1, 2], 100.0))
+        snapshot = store.get('alpha', 1)
+        assert_that(list(snapshot.intids), contains(1, 2, 3))
+        assert_that(snapshot.asOf, is_(100.0))
+
+        # Not expired with age
+        assert_that(store.ttl, is_(none()))
+
+    @fudge.patch('nti.app.segments.refresh._refresh_settings',
+                 'nti.app.segments.refresh.membership_cache_key',
+                 'nti.app.segments.refresh._segment_intid')
+    def test_membership_snapshot_per_segment(self, mock_settings, mock_key, mock_intid):
+        store = SegmentSnapshotStore()
+        component.getGlobalSiteManager().registerUtility(store, ISegmentSnapshotStore)
+        self.addCleanup(component.getGlobalSiteManager().unregisterUtility,
+                        store, ISegmentSnapshotStore)
+
+        # Two segments with equivalent filter sets, refreshed at different times
+        snapshots = {}
+        for doc_id, as_of in ((1, 100.0), (2, 200.0)):
+            snapshot = PersistentMembershipSnapshot()
+            snapshot.update([doc_id], as_of, 'key')
+            snapshots[doc_id] = fudge.Fake().has_attr(interval=3600,
+                                                      snapshot=snapshot)
+        mock_settings.is_callable().calls(lambda segment: snapshots[segment])
+        mock_key.is_callable().returns('key')
+        mock_intid.is_callable().calls(lambda segment: segment)
+
+        first = membership_snapshot(1, 'alpha', now=300.0)
+        second = membership_snapshot(2, 'alpha', now=300.0)
+        assert_that(list(first.intids), contains(1))
+        assert_that(list(second.intids), contains(2))
+
+        # Served from the store without copying again
+        assert_that(membership_snapshot(1, 'alpha', now=300.0),
+                    same_instance(first))
+        assert_that(membership_snapshot(2, 'alpha', now=300.0),
+                    same_instance(second))
+
+    def test_persistent_snapshot(self):
+        snapshot = PersistentMembershipSnapshot()
+        snapshot.update([1, 2, 3], 100.0, 'key')
+        snapshot.update([2, 3, 4], 200.0, 'key')
+        assert_that(list(snapshot.intids), contains(2, 3, 4))
+        assert_that(snapshot, has_properties(asOf=200.0, key='key'))
+
+    def test_schedule_resumes(self):
+        scheduler = LocalSegmentRefreshScheduler(jitter=0)
+        # Refreshed by a previous scheduler
+        scheduler.schedule('alpha', 1, 100, now=1000, last_refreshed=950)
+        scheduler.schedule('alpha', 2, 100, now=1000, last_refreshed=500)
+        first, second = scheduler.scheduled()
+        assert_that(first, has_properties(doc_id=2, due=1000))
+        assert_that(second, has_properties(doc_id=1, due=1050))
+
+    def test_schedule(self):
+        scheduler = LocalSegmentRefreshScheduler(jitter=0.1)
+        scheduler.schedule('alpha', 1, 100, now=1000)
+        refresh, = scheduler.scheduled()
+        # First refreshes are spread over the jitter
+        assert_that(refresh.due, greater_than_or_equal_to(1000))
+        assert_that(refresh.due, less_than_or_equal_to(1010))
+
+        # Shortening the interval brings the refresh forward
+        refresh.due = 5000
+        scheduler.schedule('alpha', 1, 50, now=1000)
+        assert_that(refresh, has_properties(interval=50))
+        assert_that(refresh.due, less_than_or_equal_to(1055))
+
+        scheduler.schedule('alpha', 1, None)
+        assert_that(scheduler.scheduled(), has_length(0))
+
+    def test_site_concurrency(self):
+        scheduler = LocalSegmentRefreshScheduler(site_concurrency=1)
+        for doc_id in (1, 2):
+            scheduler.schedule('alpha', doc_id, 100, now=0)
+        scheduler.schedule('beta', 3, 100, now=0)
+
+        claimed = scheduler.due(now=1000)
+        assert_that(sorted(x.site_name for x in claimed),
+                    contains('alpha', 'beta'))
+        # Nothing further until those finish
+        assert_that(scheduler.due(now=1000), has_length(0))
+
+    @fudge.patch('nti.app.segments.refresh.run_refresh')
+    def test_run(self, fake_refresh):
+        scheduler = LocalSegmentRefreshScheduler(jitter=0)
+        scheduler.schedule('alpha', 1, 100, now=0)
+        scheduler.schedule('alpha', 2, 100, now=0)
+
+        # Refreshes of deleted segments are dropped, failures retried
+        fake_refresh.is_callable().calls(
+            lambda site_name, doc_id, db: None if doc_id == 1 else 1 / 0)
+        scheduler.run_pending(now=1000)
+        refresh, = scheduler.scheduled()
+        assert_that(refresh, has_properties(doc_id=2, running=False))
+        assert_that(refresh.due, greater_than_or_equal_to(100))
+        assert_that(scheduler.due(now=refresh.due - 1), has_length(0))
+
+        # Picking up interval changes made elsewhere
+        fake_refresh.is_callable().returns(300)
+        scheduler.run_pending(now=refresh.due)
+        assert_that(refresh, has_properties(interval=300))
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import pstats
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+import fudge
+
+from hamcrest import assert_that
+from hamcrest import contains
+from hamcrest import has_entries
+from hamcrest import has_entry
+from hamcrest import has_length
+from hamcrest import is_
+from hamcrest import none
+from hamcrest import starts_with
+
+from pyramid.response import Response
+
+from pyramid.testing import DummyRequest
+
+from zope import component
+
+from nti.app.segments.interfaces import IMetricsSink
+from nti.app.segments.interfaces import IRequestProfiler
+
+from nti.app.segments.tests import SharedConfiguringTestLayer
+
+from nti.app.segments.timing import DEFAULT_PROFILE_THRESHOLD
+from nti.app.segments.timing import PROFILE_THRESHOLD_SETTING
+from nti.app.segments.timing import SERVER_TIMING_HEADER
+from nti.app.segments.timing import InMemoryMetricsSink
+from nti.app.segments.timing import RequestProfiler
+from nti.app.segments.timing import RequestTimings
+from nti.app.segments.timing import profiled
+from nti.app.segments.timing import request_timings
+from nti.app.segments.timing import timed
+from nti.app.segments.timing import timed_iterable
+
+from nti.testing.matchers import verifiably_provides
+
+
+class TestRequestTimings(TestCase):
+
+    def test_server_timing(self):
+        timings = RequestTimings()
+        timings.add('scan', 0.012)
+        timings.add('apply-deactivated', 0.001)
+        timings.add('apply-deactivated', 0.002)
+        assert_that(timings.timings,
+                    has_entries({'scan': (0.012, 1),
+                                 'apply-deactivated': (0.003, 2)}))
+        assert_that(timings.server_timing(),
+                    is_('scan;dur=12.00, apply-deactivated;dur=3.00'))
+
+    def test_outside_request(self):
+        with timed('scan'):
+            pass
+        assert_that(request_timings(), is_(none()))
+
+
+class TestTimed(TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    def setUp(self):
+        self.sink = InMemoryMetricsSink()
+        component.getGlobalSiteManager().registerUtility(self.sink, IMetricsSink)
+
+    def tearDown(self):
+        component.getGlobalSiteManager().unregisterUtility(self.sink, IMetricsSink)
+
+    def test_valid_interface(self):
+        assert_that(self.sink, verifiably_provides(IMetricsSink))
+        assert_that(RequestProfiler(), verifiably_provides(IRequestProfiler))
+
+    def test_reported(self):
+        request = DummyRequest()
+        with timed('scan', request):
+            pass
+        with timed('sort', request):
+            pass
+
+        response = Response()
+        for callback in request.response_callbacks:
+            callback(request, response)
+
+        header = response.headers[SERVER_TIMING_HEADER]
+        assert_that(header, starts_with('scan;dur='))
+        assert_that(header.split(', '), has_length(2))
+        assert_that(self.sink.timed_names(),
+                    contains('nti.app.segments.scan', 'nti.app.segments.sort'))
+        assert_that(self.sink.counters,
+                    has_entry('nti.app.segments.scan.count', 1))
+
+    def test_timed_iterable(self):
+        assert_that(list(timed_iterable('csv-stream', [1, 2])), contains(1, 2))
+        assert_that(self.sink.timed_names(),
+                    contains('nti.app.segments.csv-stream'))
+
+    def test_profiled(self):
+        tmpdir = tempfile.mkdtemp()
+        profiler = RequestProfiler(threshold=0, directory=tmpdir)
+        gsm = component.getGlobalSiteManager()
+        gsm.registerUtility(profiler, IRequestProfiler)
+        try:
+            request = DummyRequest()
+            with profiled('members', request):
+                # Nested use is only timed
+                with profiled('members-csv', request):
+                    sum(range(100))
+
+            filenames = os.listdir(tmpdir)
+            assert_that(filenames, has_length(1))
+            assert_that(filenames[0], starts_with('segments-members-'))
+            pstats.Stats(os.path.join(tmpdir, filenames[0]))
+            assert_that(request_timings(request).timings,
+                        has_length(2))
+
+            # Fast requests are not kept
+            profiler.threshold = 60
+            with profiled('members', DummyRequest()):
+                pass
+            assert_that(os.listdir(tmpdir), has_length(1))
+        finally:
+            gsm.unregisterUtility(profiler, IRequestProfiler)
+            shutil.rmtree(tmpdir)
+
+    @fudge.patch('nti.app.segments.timing.get_current_registry')
+    def test_profile_threshold_setting(self, fake_registry):
+        registry = fudge.Fake().has_attr(settings={})
+        fake_registry.is_callable().returns(registry)
+        profiler = RequestProfiler()
+        assert_that(profiler.threshold, is_(DEFAULT_PROFILE_THRESHOLD))
+
+        registry.settings[PROFILE_THRESHOLD_SETTING] = '0.5'
+        assert_that(profiler.threshold, is_(0.5))
+
+        # An explicit threshold wins
+        profiler.threshold = 2
+        assert_that(profiler.threshold, is_(2))
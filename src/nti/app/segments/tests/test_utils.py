@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from unittest import TestCase
+
+from hamcrest import assert_that
+from hamcrest import contains
+
+from zope import component
+
+from zope.intid import IIntIds
+
+from nti.app.segments.tests import SharedConfiguringTestLayer
+
+from nti.app.segments.utils import intids_for_usernames
+
+from nti.dataserver.tests import mock_dataserver
+
+from nti.dataserver.tests.mock_dataserver import WithMockDS
+
+from nti.dataserver.users import User
+
+
+class TestIntidsForUsernames(TestCase):
+
+    layer = SharedConfiguringTestLayer
+
+    @WithMockDS
+    def test_intids_for_usernames(self):
+        with mock_dataserver.mock_db_trans():
+            User.create_user(username=u'user.one')
+            User.create_user(username=u'user.two')
+
+        with mock_dataserver.mock_db_trans():
+            intids = component.getUtility(IIntIds)
+            one = intids.getId(User.get_user(u'user.one'))
+            two = intids.getId(User.get_user(u'user.two'))
+
+            result = intids_for_usernames([u'user.two',
+                                           u'User.One',
+                                           u'missing.user',
+                                           u'',
+                                           u'user.two'])
+            assert_that(result, contains(two, one, None, None, two))
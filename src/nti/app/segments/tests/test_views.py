@@ -15,9 +15,12 @@ from hamcrest import assert_that
 from hamcrest import contains
 from hamcrest import contains_string
 from hamcrest import described_as
+from hamcrest import does_not
 from hamcrest import has_entries
 from hamcrest import has_entry
 from hamcrest import has_item
+from hamcrest import has_items
+from hamcrest import has_key
 from hamcrest import has_length
 from hamcrest import is_
 from hamcrest import is_not
@@ -26,14 +29,33 @@ from hamcrest import not_none
 
 from webob.cookies import parse_cookie
 
+from zope import component
 from zope import lifecycleevent
 
+from zope.intid.interfaces import IIntIds
+
+from zope.lifecycleevent.interfaces import IObjectModifiedEvent
+
 from zope.security.interfaces import IPrincipal
 
 from zope.securitypolicy.principalrole import principalRoleManager
 
+from nti.app.segments.index import IX_CREATEDTIME
+from nti.app.segments.index import get_segments_catalog
+
+from nti.app.segments.interfaces import IExportJobQueue
+from nti.app.segments.interfaces import IMetricsSink
+from nti.app.segments.interfaces import ISegmentRefreshScheduler
+from nti.app.segments.interfaces import ISegmentSnapshotStore
+from nti.app.segments.interfaces import ISiteAdminIntIdCache
+from nti.app.segments.interfaces import IUserSegmentMembershipEvent
+
+from nti.app.segments.membership import site_admin_intids
+
 from nti.app.segments.model import IsDeactivatedFilterSet
 
+from nti.app.segments.subscribers import reindex_modified_segment
+
 from nti.app.segments.tests import SegmentApplicationTestLayer
 from nti.app.segments.tests import SiteAdminTestMixin
 
@@ -62,10 +84,14 @@ from nti.identifiers.interfaces import IUserExternalIdentityContainer
 
 from nti.ntiids.ntiids import find_object_with_ntiid
 
+from nti.segments.interfaces import ISegment
+
 from nti.segments.model import IntersectionUserFilterSet
 from nti.segments.model import UnionUserFilterSet
 from nti.segments.model import UserSegment
 
+from nti.site.hostpolicy import get_host_site
+
 
 class WorkspaceTestMixin(TestBaseMixin):
 
@@ -150,6 +176,9 @@ class SegmentManagementMixin(AppTestBaseMixin,
                 if last_modified is not None:
                     segment.lastModified = last_modified
 
+                # Changed without an event, so must be reindexed
+                reindex_modified_segment(segment)
+
         return res
 
     def _list_segments(self, via_workspace=True, **kwargs):
@@ -418,6 +447,50 @@ class TestCreateSegments(SegmentManagementTest,
         assert_order({'sortOn': 'lastmodified'},
                      (title_two, title_three, title_one))
 
+    @WithSharedApplicationMockDS(users=True,
+                                 testapp=True,
+                                 default_authenticate=True)
+    def test_list_filter(self):
+        self._create_segment(u'Active Learners')
+        inactive = self._create_segment(u'Inactive Learners').json_body
+        instructors = self._create_segment(u'Instructors').json_body
+
+        with mock_ds.mock_db_trans(site_name='alpha.nextthought.com'):
+            inactive_name = find_object_with_ntiid(inactive['NTIID']).__name__
+
+        def titles(params):
+            res = self._list_segments(params=params).json_body
+            return [item['title'] for item in res['Items']]
+
+        # Filtering matches segment names
+        assert_that(titles({'filter': inactive_name}),
+                    contains(u'Inactive Learners'))
+        assert_that(titles({'filter': u'no such segment'}), has_length(0))
+
+        # Title changes don't affect names
+        self.testapp.put_json(inactive['href'], {'title': u'Dormant Users'})
+        assert_that(titles({'filter': inactive_name}),
+                    contains(u'Dormant Users'))
+
+        # Segments lacking a sort value are still listed
+        with mock_ds.mock_db_trans(site_name='alpha.nextthought.com'):
+            segment = find_object_with_ntiid(instructors['NTIID'])
+            catalog = get_segments_catalog()
+            doc_id = component.getUtility(IIntIds).getId(segment)
+            catalog[IX_CREATEDTIME].unindex_doc(doc_id)
+        assert_that(titles({}), has_length(3))
+
+        # Creator sorting is limited to the batch
+        res = self._list_segments(params={'sortOn': 'creator',
+                                          'batchSize': '1'}).json_body
+        assert_that(res, has_entries(Total=3, ItemCount=1))
+        self.require_link_href_with_rel(res, 'batch-next')
+
+        # and deleted segments unindexed
+        self.testapp.delete(inactive['href'])
+        assert_that(titles({}),
+                    contains(u'Active Learners', u'Instructors'))
+
 
 class SegmentMembersViewMixin(SegmentManagementMixin,
                               SiteAdminTestMixin):
@@ -562,6 +635,428 @@ class SegmentMembersViewMixin(SegmentManagementMixin,
 
 class TestSegmentMembersView(SegmentManagementTest, SegmentMembersViewMixin):
 
+    @WithSharedApplicationMockDS(users=True, testapp=True, default_authenticate=True)
+    def test_explain(self):
+        with mock_ds.mock_db_trans(site_name='alpha.nextthought.com'):
+            self._create_user('user.one')
+            self._create_user('user.two')
+
+        activated_filter_set = {
+            "MimeType": IsDeactivatedFilterSet.mime_type,
+            "Deactivated": False
+        }
+        segment = self._create_segment(
+            'Activated Users',
+            simple_filter_set=activated_filter_set).json_body
+
+        explain_url = self.require_link_href_with_rel(segment, 'explain')
+        res = self.testapp.get(explain_url).json_body
+        assert_that(res, has_entries({
+            'Class': 'SegmentPlan',
+            'SiteUsers': 2,
+            'MemberCount': 2,
+            'Plan': has_entries({
+                'Operation': 'intersection',
+                'OutputSize': 2,
+                'Children': contains(has_entries({
+                    'Operation': 'union',
+                    'Children': contains(has_entries({
+                        'Operation': 'leaf',
+                        'FilterSets': contains(IsDeactivatedFilterSet.mime_type),
+                        'ElapsedMs': not_none(),
+                    }))
+                }))
+            })
+        }))
+
+        # Unfiltered segments have no plan
+        segment = self._create_segment('Null Filter').json_body
+        explain_url = self.require_link_href_with_rel(segment, 'explain')
+        res = self.testapp.get(explain_url).json_body
+        assert_that(res, has_entries(Plan=none(), MemberCount=2))
+
+    @WithSharedApplicationMockDS(users=True, testapp=True, default_authenticate=True)
+    def test_membership_cache(self):
+        with mock_ds.mock_db_trans(site_name='alpha.nextthought.com'):
+            self._create_user('user.one')
+            self._create_user('user.two')
+
+        activated_filter_set = {
+            "MimeType": IsDeactivatedFilterSet.mime_type,
+            "Deactivated": False
+        }
+        segment = self._create_segment(
+            'Activated Users',
+            simple_filter_set=activated_filter_set).json_body
+        members_url = self._members_url(segment)
+
+        sink = component.getUtility(IMetricsSink)
+        sink.clear()
+        res = self._segment_members(members_url)
+        assert_that(res.headers, has_entry('X-NTI-Segment-Cache', 'miss'))
+        assert_that(res.json_body['Items'], has_length(2))
+
+        # Timings are reported on the response and to the metrics sink
+        timings = [x.split(';')[0]
+                   for x in res.headers['Server-Timing'].split(', ')]
+        assert_that(timings, has_items('membership', 'scan', 'evaluate',
+                                       'apply-deactivated', 'sort',
+                                       'externalize', 'members'))
+        assert_that(sink.timed_names(), has_item('nti.app.segments.scan'))
+
+        res = self._segment_members(members_url)
+        assert_that(res.headers, has_entry('X-NTI-Segment-Cache', 'hit'))
+        assert_that(res.json_body['Items'], has_length(2))
+
+        # Exports read from the same cache
+        res = self.testapp.get(members_url,
+                               headers={'accept': str('text/csv')})
+        assert_that(res.headers, has_entry('X-NTI-Segment-Cache', 'hit'))
+
+        # Deactivation invalidates
+        self._deactivate_user('user.two')
+        res = self._segment_members(members_url)
+        assert_that(res.headers, has_entry('X-NTI-Segment-Cache', 'miss'))
+        assert_that(res.json_body['Items'], has_length(1))
+
+        # Membership is keyed by the filter set, so is unaffected by
+        # other changes to the segment
+        res = self.testapp.put_json(segment['href'], {'title': u'Renamed'}).json_body
+        assert_that(res['FilterSetFingerprint'], is_(segment['FilterSetFingerprint']))
+        res = self._segment_members(members_url)
+        assert_that(res.headers, has_entry('X-NTI-Segment-Cache', 'hit'))
+
+        # and shared by segments with equivalent filter sets
+        twin = self._create_segment('Twin', simple_filter_set=activated_filter_set).json_body
+        assert_that(twin['FilterSetFingerprint'], is_(segment['FilterSetFingerprint']))
+        res = self._segment_members(self._members_url(twin))
+        assert_that(res.headers, has_entry('X-NTI-Segment-Cache', 'hit'))
+
+        # Changing the filter set does not
+        deactivated_filter_set = dict(activated_filter_set, Deactivated=True)
+        res = self._create_segment('Deactivated Users',
+                                   simple_filter_set=deactivated_filter_set).json_body
+        assert_that(res['FilterSetFingerprint'],
+                    is_not(segment['FilterSetFingerprint']))
+        res = self._segment_members(self._members_url(res))
+        assert_that(res.headers, has_entry('X-NTI-Segment-Cache', 'miss'))
+
+    @WithSharedApplicationMockDS(users=True, testapp=True, default_authenticate=True)
+    def test_bulk_evaluate(self):
+        with mock_ds.mock_db_trans(site_name='alpha.nextthought.com'):
+            self._create_user('user.one')
+            self._create_user('user.two')
+        self._deactivate_user('user.two')
+
+        activated_filter_set = {
+            "MimeType": IsDeactivatedFilterSet.mime_type,
+            "Deactivated": False
+        }
+        one = self._create_segment('Activated One',
+                                   simple_filter_set=activated_filter_set).json_body
+        two = self._create_segment('Activated Two',
+                                   simple_filter_set=activated_filter_set).json_body
+        everyone = self._create_segment('Everyone').json_body
+
+        bulk_url = '/dataserver2/++etc++hostsites/alpha.nextthought.com/' \
+                   '++etc++site/default/segments-container/@@BulkEvaluate'
+        res = self.testapp.get(bulk_url).json_body
+        assert_that(res, has_entries(Class='SegmentsBulkEvaluation',
+                                     Total=3,
+                                     SiteUsers=2,
+                                     LeafEvaluations=1,
+                                     SharedLeaves=0))
+        assert_that(res['Items'], has_entries({
+            one['NTIID']: has_entries(MemberCount=1),
+            two['NTIID']: has_entries(MemberCount=1),
+            everyone['NTIID']: has_entries(MemberCount=2, Cache='miss'),
+        }))
+        # Equivalent filter sets share cached membership
+        assert_that(sorted(res['Items'][x['NTIID']]['Cache'] for x in (one, two)),
+                    contains('hit', 'miss'))
+        assert_that(res['Items'][one['NTIID']], does_not(has_key('Intids')))
+
+        # Results are cached for the members views, and vice versa
+        res = self._segment_members(self._members_url(one))
+        assert_that(res.headers, has_entry('X-NTI-Segment-Cache', 'hit'))
+
+        res = self.testapp.post_json(bulk_url, {'ntiids': [one['NTIID']],
+                                                'intids': True}).json_body
+        assert_that(res, has_entries(Total=1))
+        assert_that(res, does_not(has_key('SiteUsers')))
+        assert_that(res['Items'][one['NTIID']],
+                    has_entries(MemberCount=1,
+                                Cache='hit',
+                                Intids=has_length(1)))
+
+    @WithSharedApplicationMockDS(users=True, testapp=True, default_authenticate=True)
+    def test_membership_changes(self):
+        with mock_ds.mock_db_trans(site_name='alpha.nextthought.com'):
+            self._create_user('user.one')
+            self._create_user('user.two')
+
+        activated_filter_set = {
+            "MimeType": IsDeactivatedFilterSet.mime_type,
+            "Deactivated": False
+        }
+        segment = self._create_segment(
+            'Activated Users',
+            simple_filter_set=activated_filter_set).json_body
+        changes_url = self.require_link_href_with_rel(segment, 'member-changes')
+
+        # The first recording is a baseline
+        res = self.testapp.post(changes_url).json_body
+        assert_that(res, has_entries(Class='SegmentMembershipChanges',
+                                     Token='0',
+                                     Reset=True,
+                                     Entered=has_length(0),
+                                     Exited=has_length(0)))
+
+        events = []
+        gsm = component.getGlobalSiteManager()
+
+        def handler(event):
+            events.append((type(event).__name__, event.object.username))
+
+        gsm.registerHandler(handler, (IUserSegmentMembershipEvent,))
+        try:
+            with mock_ds.mock_db_trans(site_name='alpha.nextthought.com'):
+                self._create_user('user.three')
+            self._deactivate_user('user.two')
+
+            # Reads don't record
+            self._segment_members(self._members_url(segment))
+            res = self.testapp.get(changes_url, params={'since': '0'}).json_body
+            assert_that(res, has_entries(Token='0',
+                                         Entered=has_length(0),
+                                         Exited=has_length(0)))
+            assert_that(events, has_length(0))
+
+            res = self.testapp.post(changes_url + '?since=0').json_body
+            assert_that(res, has_entries(Token='1',
+                                         Reset=False,
+                                         Entered=contains('user.three'),
+                                         Exited=contains('user.two')))
+        finally:
+            gsm.unregisterHandler(handler, (IUserSegmentMembershipEvent,))
+
+        assert_that(sorted(events),
+                    contains(('UserEnteredSegment', 'user.three'),
+                             ('UserExitedSegment', 'user.two')))
+
+        # The events don't invalidate the membership they came from
+        res = self._segment_members(self._members_url(segment))
+        assert_that(res.headers, has_entry('X-NTI-Segment-Cache', 'hit'))
+
+        # Nothing further
+        res = self.testapp.get(changes_url, params={'since': '1'}).json_body
+        assert_that(res, has_entries(Token='1', Reset=False,
+                                     Entered=has_length(0),
+                                     Exited=has_length(0)))
+
+        # Unknown tokens require a reset
+        res = self.testapp.get(changes_url, params={'since': '5'}).json_body
+        assert_that(res, has_entries(Token='1', Reset=True))
+        self.testapp.get(changes_url, params={'since': 'abc'}, status=422)
+
+    @WithSharedApplicationMockDS(users=True, testapp=True, default_authenticate=True)
+    def test_background_refresh(self):
+        with mock_ds.mock_db_trans(site_name='alpha.nextthought.com'):
+            self._create_user('user.one')
+
+        segment = self._create_segment('Everyone').json_body
+        refresh_url = self.require_link_href_with_rel(segment, 'refresh')
+        members_url = self._members_url(segment)
+
+        self.testapp.put_json(refresh_url, {'interval': 10}, status=422)
+        self.testapp.put_json(refresh_url, {'interval': 'abc'}, status=422)
+        res = self.testapp.put_json(refresh_url, {'interval': 3600}).json_body
+        assert_that(res, has_entries(Class='SegmentRefreshSettings',
+                                     Interval=3600,
+                                     AsOf=none()))
+
+        # Evaluated on demand until first refreshed
+        res = self._segment_members(members_url)
+        assert_that(res.headers, does_not(has_key('X-NTI-Segment-As-Of')))
+        assert_that(res.json_body, does_not(has_key('AsOf')))
+
+        scheduler = component.getUtility(ISegmentRefreshScheduler)
+        assert_that(scheduler.scheduled(), has_length(1))
+        scheduler.run_pending(now=time.time() + 3600)
+
+        res = self.testapp.get(refresh_url).json_body
+        assert_that(res, has_entries(Interval=3600, AsOf=not_none()))
+        as_of = res['AsOf']
+
+        # Served from the snapshot, even as users are added, and stored
+        # with the segment for other processes
+        with mock_ds.mock_db_trans(site_name='alpha.nextthought.com'):
+            self._create_user('user.two')
+        component.getUtility(ISegmentSnapshotStore).invalidate()
+        res = self._segment_members(members_url)
+        assert_that(res.headers, has_entry('X-NTI-Segment-As-Of', str(as_of)))
+        assert_that(res.json_body, has_entries(AsOf=as_of,
+                                               Items=has_length(1)))
+
+        count_url = self.require_link_href_with_rel(segment, 'member-count')
+        res = self.testapp.get(count_url).json_body
+        assert_that(res, has_entries(MemberCount=1, AsOf=as_of))
+
+        # until the next refresh
+        scheduler.run_pending(now=time.time() + 7200)
+        res = self._segment_members(members_url).json_body
+        assert_that(res['AsOf'], is_not(as_of))
+        assert_that(res['Items'], has_length(2))
+
+        res = self.testapp.put_json(refresh_url, {'interval': None}).json_body
+        assert_that(res, has_entries(Interval=none(), AsOf=none()))
+        assert_that(scheduler.scheduled(), has_length(0))
+        res = self._segment_members(members_url)
+        assert_that(res.headers, does_not(has_key('X-NTI-Segment-As-Of')))
+
+    @WithSharedApplicationMockDS(users=True, testapp=True, default_authenticate=True)
+    def test_member_count(self):
+        with mock_ds.mock_db_trans(site_name='alpha.nextthought.com'):
+            self._create_user('user.one')
+            self._create_user('user.two')
+            self._create_user('site.admin')
+            self.make_site_admins('site.admin')
+
+        segment = self._create_segment('Null Filter').json_body
+        assert_that(segment, does_not(has_key('MemberCount')))
+
+        count_url = self.require_link_href_with_rel(segment, 'member-count')
+        res = self.testapp.get(count_url)
+        assert_that(res.json_body, has_entries(Class='SegmentMemberCount',
+                                               MemberCount=3))
+        assert_that(res.headers, has_entry('X-NTI-Segment-Cache', 'miss'))
+
+        res = self.testapp.get(count_url, params={'filterAdmins': 'true'})
+        assert_that(res.json_body['MemberCount'], is_(2))
+        assert_that(res.headers, has_entry('X-NTI-Segment-Cache', 'hit'))
+        admin_cache = component.getUtility(ISiteAdminIntIdCache)
+        assert_that(admin_cache.get('alpha.nextthought.com', 'site-admins'),
+                    has_length(1))
+
+        # Granting the role invalidates the cached site admins
+        with mock_ds.mock_db_trans(site_name='alpha.nextthought.com'):
+            self.make_site_admins('user.two')
+        assert_that(admin_cache.get('alpha.nextthought.com', 'site-admins'),
+                    is_(none()))
+        res = self.testapp.get(count_url, params={'filterAdmins': 'true'})
+        assert_that(res.json_body['MemberCount'], is_(1))
+
+        # The given site is used, rather than the current site
+        admin_cache.invalidate()
+        with mock_ds.mock_db_trans():
+            site = get_host_site('alpha.nextthought.com')
+            assert_that(site_admin_intids(site), has_length(2))
+        assert_that(admin_cache.get('alpha.nextthought.com', 'site-admins'),
+                    has_length(2))
+
+        # Counts agree with listings
+        res = self._segment_members(self._members_url(segment)).json_body
+        assert_that(res['Items'], has_length(3))
+
+        # Opt-in count on the segment itself
+        res = self.testapp.get(segment['href'],
+                               params={'memberCount': 'true'}).json_body
+        assert_that(res, has_entry('MemberCount', 3))
+
+    @WithSharedApplicationMockDS(users=True, testapp=True, default_authenticate=True)
+    def test_sorted_member_pages(self):
+        with mock_ds.mock_db_trans(site_name='alpha.nextthought.com'):
+            for username, realname in ((u'user.one', u'Charlie'),
+                                       (u'user.two', u'Alpha'),
+                                       (u'user.three', u'Bravo')):
+                self._create_user(username,
+                                  external_value={'realname': realname})
+
+        segment = self._create_segment('Null Filter').json_body
+        members_url = self._members_url(segment)
+
+        def page(start, order='ascending'):
+            params = {'sortOn': 'realname',
+                      'sortOrder': order,
+                      'batchStart': str(start),
+                      'batchSize': '1'}
+            return self.testapp.get(members_url, params=params)
+
+        # The first page only needs a partial ordering
+        res = page(0)
+        assert_that(res.headers, has_entry('X-NTI-Segment-Cache', 'miss'))
+        assert_that(res.json_body, has_entries(Total=3, ItemCount=1))
+        assert_that(res.json_body['Items'][0]['Username'], is_('user.two'))
+
+        # ...which is reused for that page
+        res = page(0)
+        assert_that(res.headers, has_entry('X-NTI-Segment-Cache', 'hit'))
+
+        usernames = [page(x).json_body['Items'][0]['Username'] for x in range(3)]
+        assert_that(usernames, contains('user.two', 'user.three', 'user.one'))
+
+        res = page(2)
+        assert_that(res.headers, has_entry('X-NTI-Segment-Cache', 'hit'))
+        assert_that(res.json_body['Total'], is_(3))
+
+        # Orderings are cached independently
+        res = page(0, order='descending')
+        assert_that(res.json_body['Items'][0]['Username'], is_('user.one'))
+
+        # and invalidated with membership
+        with mock_ds.mock_db_trans(site_name='alpha.nextthought.com'):
+            self._create_user(u'user.four',
+                              external_value={'realname': u'Aardvark'})
+        res = page(0)
+        assert_that(res.headers, has_entry('X-NTI-Segment-Cache', 'miss'))
+        assert_that(res.json_body['Total'], is_(4))
+        assert_that(res.json_body['Items'][0]['Username'], is_('user.four'))
+
+    @WithSharedApplicationMockDS(users=True, testapp=True, default_authenticate=True)
+    def test_member_cursor_pages(self):
+        with mock_ds.mock_db_trans(site_name='alpha.nextthought.com'):
+            for username, realname in ((u'user.one', u'Charlie'),
+                                       (u'user.two', u'Alpha'),
+                                       (u'user.three', u'Bravo')):
+                self._create_user(username,
+                                  external_value={'realname': realname})
+
+        segment = self._create_segment('Null Filter').json_body
+        members_url = self._members_url(segment)
+
+        def page(cursor=u'', order='ascending', status=200):
+            params = {'sortOn': 'realname',
+                      'sortOrder': order,
+                      'cursor': cursor,
+                      'batchSize': '1'}
+            return self.testapp.get(members_url, params=params, status=status)
+
+        res = page().json_body
+        assert_that(res, has_entries(Total=3, ItemCount=1,
+                                     NextCursor=not_none()))
+        assert_that(res['Items'][0]['Username'], is_('user.two'))
+
+        # Members added before the cursor don't shift later pages
+        with mock_ds.mock_db_trans(site_name='alpha.nextthought.com'):
+            self._create_user(u'user.four',
+                              external_value={'realname': u'Aardvark'})
+
+        usernames = []
+        cursor = res['NextCursor']
+        while cursor:
+            res = page(cursor).json_body
+            usernames.extend(x['Username'] for x in res['Items'])
+            cursor = res['NextCursor']
+        assert_that(usernames, contains('user.three', 'user.one'))
+        assert_that(res['Total'], is_(4))
+
+        res = page(order='descending').json_body
+        assert_that(res['Items'][0]['Username'], is_('user.one'))
+
+        # Cursors only resume the ordering they were issued for
+        page(res['NextCursor'], status=422)
+        page(u'not-a-cursor', status=422)
+
     @WithSharedApplicationMockDS(users=True, testapp=True, default_authenticate=True)
     def test_export_members(self):
         with mock_ds.mock_db_trans():
@@ -636,6 +1131,17 @@ class TestSegmentMembersView(SegmentManagementTest, SegmentMembersViewMixin):
         assert_that(rows[2], is_('user.two,User Two,User Two,two@user.org,,,'))
         assert_that(rows[3], is_('site.admin,Admin One,Admin One,site.admin@user.org,,,'))
 
+        # Streaming produces the same rows
+        stream_params = csv_params.copy()
+        stream_params['stream'] = 'true'
+        streamed = self.testapp.get(members_url, params=stream_params)
+        assert_that(streamed.content_disposition,
+                    is_('attachment; filename="users_export-Activated_Users.csv"'))
+        _, streamed_rows = self.normalize_userinfo_csv(streamed.body)
+        _, rows = self.normalize_userinfo_csv(members.body)
+        assert_that(streamed_rows, has_length(4))
+        assert_that(sorted(streamed_rows), is_(sorted(rows)))
+
         # Filter by specific usernames
         usernames = {'usernames': ['user.one', 'user.two']}
         members = self.testapp.post_json(export_members_url, params=usernames)
@@ -649,6 +1155,14 @@ class TestSegmentMembersView(SegmentManagementTest, SegmentMembersViewMixin):
         assert_that(rows[1], is_('user.one,User One,User One,one@user.org,,,aaaaaaa'))
         assert_that(rows[2], is_('user.two,User Two,User Two,two@user.org,,,'))
 
+        #   and may be streamed, preserving the requested order
+        members = self.testapp.post_json(export_members_url + '&stream=true',
+                                         params={'usernames': ['user.two', 'user.one']})
+        _, rows = self.normalize_userinfo_csv(members.body)
+        assert_that(rows, has_length(3))
+        assert_that(rows[1], is_('user.two,User Two,User Two,two@user.org,,,'))
+        assert_that(rows[2], is_('user.one,User One,User One,one@user.org,,,aaaaaaa'))
+
         # Check filtering
         params['filterAdmins'] = True
         members = self.testapp.get(members_url, params=params, headers=headers)
@@ -680,6 +1194,66 @@ class TestSegmentMembersView(SegmentManagementTest, SegmentMembersViewMixin):
         normalized_body, _ = self.normalize_userinfo_csv(members.body)
         assert_that(normalized_body, is_(csv_contents))
 
+    @WithSharedApplicationMockDS(users=('site.admin.one',), testapp=True,
+                                 default_authenticate=True)
+    def test_export_job(self):
+        with mock_ds.mock_db_trans(site_name='alpha.nextthought.com'):
+            self._create_user('user.one',
+                              external_value={'realname': u'user one',
+                                              'email': u'one@user.org'})
+            self._create_user('user.two',
+                              external_value={'realname': u'user two',
+                                              'email': u'two@user.org'})
+            self.make_site_admins('site.admin.one')
+
+        segment = self._create_segment('Everyone').json_body
+        export_url = self.require_link_href_with_rel(segment, 'export-members')
+        export_url = "%s?format=text/csv&async=true" % (export_url,)
+
+        # Members are the two users and the site admin
+        res = self.testapp.post(export_url, status=202).json_body
+        assert_that(res, has_entries(Class='SegmentExportJob',
+                                     Status='Pending',
+                                     RowsWritten=0,
+                                     Total=3))
+        status_url = self.require_link_href_with_rel(res, 'status')
+        self.require_link_href_with_rel(res, 'cancel')
+        self.forbid_link_with_rel(res, 'download')
+
+        # Only visible to the user that started it
+        site_admin_env = self._make_extra_environ(username='site.admin.one')
+        self.testapp.get(status_url, extra_environ=site_admin_env, status=404)
+
+        component.getUtility(IExportJobQueue).run_pending()
+
+        res = self.testapp.get(status_url).json_body
+        assert_that(res, has_entries(Status='Success',
+                                     RowsWritten=3,
+                                     Total=3))
+        self.forbid_link_with_rel(res, 'cancel')
+        download_url = self.require_link_href_with_rel(res, 'download')
+
+        members = self.testapp.get(download_url)
+        assert_that(members.content_disposition,
+                    is_('attachment; filename="users_export-Everyone.csv"'))
+        rows = members.body.decode('utf-8').rstrip().split('\r\n')
+        assert_that(rows, has_length(4))
+        assert_that(rows[0], is_('username,realname,alias,email,createdTime,lastLoginTime'))
+        assert_that(rows, has_item(contains_string('user.one,User One,User One,one@user.org')))
+        assert_that(rows, has_item(contains_string('user.two,User Two,User Two,two@user.org')))
+
+        # Removing the job discards it
+        self.testapp.delete(status_url, status=204)
+        self.testapp.get(status_url, status=404)
+        self.testapp.get(download_url, status=404)
+
+        # Jobs may be cancelled before running
+        res = self.testapp.post(export_url, status=202).json_body
+        cancel_url = self.require_link_href_with_rel(res, 'cancel')
+        self.testapp.delete(cancel_url, status=204)
+        component.getUtility(IExportJobQueue).run_pending()
+        self.testapp.get(cancel_url, status=404)
+
     @staticmethod
     def normalize_userinfo_csv(csv_contents):
         """
@@ -750,11 +1324,27 @@ class TestSegmentMembersPreviewView(SegmentManagementTest,
         assert_that(deactivated_res['Items'], has_length(1))
         assert_that(deactivated_res['Items'][0], has_entries(Username=test_username))
 
-        # Preview with deactivated changed
+        # Preview with deactivated changed, which fires no events
+        events = []
+        gsm = component.getGlobalSiteManager()
+
+        def handler(segment, unused_event):
+            events.append(segment)
+
         updated_filter_set = copy.deepcopy(deactivated_seg)
         updated_filter_set['filter_set']['filter_sets'][0]['filter_sets'][0]['Deactivated'] = False
-        activated_res = self._segment_members(preview_url, params=updated_filter_set).json_body
+        gsm.registerHandler(handler, (ISegment, IObjectModifiedEvent))
+        try:
+            activated_res = self._segment_members(preview_url,
+                                                  params=updated_filter_set).json_body
+        finally:
+            gsm.unregisterHandler(handler, (ISegment, IObjectModifiedEvent))
         assert_that(activated_res['Items'], has_length(2))
+        assert_that(events, has_length(0))
+
+        res = self.testapp.get(deactivated_seg['href']).json_body
+        assert_that(res['Last Modified'], is_(deactivated_seg['Last Modified']))
+        assert_that(res['filter_set'], is_(deactivated_seg['filter_set']))
 
         # Ensure change wasn't persisted
         activated_res = self._segment_members(preview_url, params=None).json_body
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Timing instrumentation for segment requests.
+
+Work done on behalf of a request is timed with :func:`timed`, accumulating
+per name in the request.  When the response is produced the timings are
+reported in its ``Server-Timing`` header and sent to the registered
+:class:`.IMetricsSink`.  Timed work outside of a request is not recorded.
+
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import cProfile
+import os
+import tempfile
+import time
+
+from collections import OrderedDict
+
+from contextlib import contextmanager
+
+from perfmetrics import statsd_client
+
+from pyramid.threadlocal import get_current_registry
+from pyramid.threadlocal import get_current_request
+
+from zope import component
+from zope import interface
+
+from nti.app.segments.interfaces import IMetricsSink
+from nti.app.segments.interfaces import IRequestProfiler
+
+#: Request environ key for the timings of a request
+TIMINGS_KEY = 'nti.app.segments.timings'
+
+#: Request environ key marking a request as being profiled
+PROFILING_KEY = 'nti.app.segments.profiling'
+
+SERVER_TIMING_HEADER = 'Server-Timing'
+
+#: Prefix of the metrics sent to the :class:`.IMetricsSink`
+METRIC_PREFIX = 'nti.app.segments.'
+
+#: Seconds a request may take before its profile is kept
+DEFAULT_PROFILE_THRESHOLD = 5.0
+
+#: Application setting overriding :data:`DEFAULT_PROFILE_THRESHOLD`
+PROFILE_THRESHOLD_SETTING = 'nti.app.segments.profile_threshold'
+
+logger = __import__('logging').getLogger(__name__)
+
+
+class RequestTimings(object):
+    """
+    The accumulated durations, in seconds, and counts of the named work
+    done for a request.
+    """
+
+    def __init__(self):
+        self.timings = OrderedDict()
+
+    def add(self, name, elapsed):
+        total, count = self.timings.get(name, (0, 0))
+        self.timings[name] = (total + elapsed, count + 1)
+
+    def server_timing(self):
+        return ', '.join('%s;dur=%.2f' % (name, total * 1000)
+                         for name, (total, _) in self.timings.items())
+
+
+def _emit(name, elapsed, count=1):
+    sink = component.queryUtility(IMetricsSink)
+    if sink is not None:
+        sink.timing(METRIC_PREFIX + name, elapsed * 1000)
+        sink.incr(METRIC_PREFIX + name + '.count', count)
+
+
+def _report_timings(request, response):
+    timings = request.environ.get(TIMINGS_KEY)
+    if not timings or not timings.timings:
+        return
+    response.headers[SERVER_TIMING_HEADER] = timings.server_timing()
+    for name, (total, count) in timings.timings.items():
+        _emit(name, total, count)
+
+
+def request_timings(request=None):
+    """
+    The :class:`RequestTimings` of the given (or current) request, or None
+    outside of a request.
+    """
+    request = get_current_request() if request is None else request
+    if request is None:
+        return None
+    timings = request.environ.get(TIMINGS_KEY)
+    if timings is None:
+        timings = request.environ[TIMINGS_KEY] = RequestTimings()
+        request.add_response_callback(_report_timings)
+    return timings
+
+
+@contextmanager
+def timed(name, request=None):
+    """
+    Time the enclosed work, recording it under ``name`` for the given (or
+    current) request.
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings = request_timings(request)
+        if timings is not None:
+            timings.add(name, time.time() - start)
+
+
+def timed_iterable(name, iterable):
+    """
+    Time the consumption of an iterable, such as a streamed response body,
+    which may complete after the response has been produced.  The duration
+    goes to the :class:`.IMetricsSink` only.
+    """
+    start = time.time()
+    try:
+        for item in iterable:
+            yield item
+    finally:
+        _emit(name, time.time() - start)
+
+
+@contextmanager
+def profiled(name, request):
+    """
+    Time the enclosed request handling as ``name``, profiling it if an
+    :class:`.IRequestProfiler` is registered and keeping the profile if the
+    request was slow.  Nested use within a request is only timed.
+    """
+    profiler = component.queryUtility(IRequestProfiler)
+    if profiler is None or request.environ.get(PROFILING_KEY):
+        with timed(name, request):
+            yield
+        return
+
+    request.environ[PROFILING_KEY] = True
+    profile = cProfile.Profile()
+    start = time.time()
+    profile.enable()
+    try:
+        with timed(name, request):
+            yield
+    finally:
+        profile.disable()
+        request.environ[PROFILING_KEY] = False
+        elapsed = time.time() - start
+        if elapsed >= profiler.threshold:
+            path = profiler.dump(profile, name, elapsed)
+            logger.warning("Segment request %s took %.2fs, profile written to %s",
+                           request.path, elapsed, path)
+
+
+@interface.implementer(IMetricsSink)
+class StatsdMetricsSink(object):
+    """
+    Sends metrics to the statsd client configured for perfmetrics, if any.
+    """
+
+    def timing(self, name, value):
+        client = statsd_client()
+        if client is not None:
+            client.timing(name, value)
+
+    def incr(self, name, count=1):
+        client = statsd_client()
+        if client is not None:
+            client.incr(name, count)
+
+
+@interface.implementer(IMetricsSink)
+class InMemoryMetricsSink(object):
+    """
+    Retains metrics in memory, for tests.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.timings = []
+        self.counters = {}
+
+    def timing(self, name, value):
+        self.timings.append((name, value))
+
+    def incr(self, name, count=1):
+        self.counters[name] = self.counters.get(name, 0) + count
+
+    def timed_names(self):
+        return [name for name, _ in self.timings]
+
+
+@interface.implementer(IRequestProfiler)
+class RequestProfiler(object):
+    """
+    Writes the profiles of slow requests, in :mod:`pstats` format, to a
+    directory (by default, the temporary directory).  Unless given, the
+    threshold is read from the :data:`PROFILE_THRESHOLD_SETTING`
+    application setting as requests are profiled.
+    """
+
+    def __init__(self, threshold=None, directory=None):
+        self._threshold = threshold
+        self.directory = directory
+
+    @property
+    def threshold(self):
+        if self._threshold is not None:
+            return self._threshold
+        settings = getattr(get_current_registry(), 'settings', None) or {}
+        value = settings.get(PROFILE_THRESHOLD_SETTING)
+        return float(value) if value else DEFAULT_PROFILE_THRESHOLD
+
+    @threshold.setter
+    def threshold(self, value):
+        self._threshold = value
+
+    def dump(self, profile, name, elapsed):
+        directory = self.directory or tempfile.gettempdir()
+        filename = 'segments-%s-%d-%dms.prof' % (name, time.time() * 1000,
+                                                 elapsed * 1000)
+        path = os.path.join(directory, filename)
+        profile.dump_stats(path)
+        return path
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+.. $Id$
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from contextlib import contextmanager
+
+import transaction
+
+from zope import component
+
+from zope.component.hooks import site as current_site
+
+from zope.intid import IIntIds
+
+from nti.dataserver.interfaces import IDataserver
+
+from nti.dataserver.users import get_entity_catalog
+from nti.dataserver.users import User
+
+from nti.dataserver.users.index import IX_USERNAME
+
+logger = __import__('logging').getLogger(__name__)
+
+
+@contextmanager
+def dataserver_connection(db=None, tm=None):
+    """
+    Open a dedicated connection to the (given or dataserver's) database,
+    with the given (or a new) transaction manager, within the dataserver
+    site.  Yields the transaction manager; anything uncommitted is aborted.
+    """
+    db = db if db is not None else component.getUtility(IDataserver).db
+    tm = tm if tm is not None else transaction.TransactionManager()
+    conn = db.open(transaction_manager=tm)
+    try:
+        tm.begin()
+        ds_folder = conn.root()['nti.dataserver']
+        with current_site(ds_folder):
+            yield tm
+    finally:
+        tm.abort()
+        conn.close()
+
+
+def unwrap_value_index(index):
+    """
+    Return the underlying value index and normalizer (if any) for a,
+    possibly normalization-wrapped, catalog index.
+    """
+    return getattr(index, 'index', index), getattr(index, 'normalizer', None)
+
+
+def _lookup_usernames(usernames):
+    """
+    Slow path, resolving each user object.
+    """
+    intids = component.getUtility(IIntIds)
+    result = []
+    for username in usernames:
+        user = User.get_user(username)
+        doc_id = intids.queryId(user) if user is not None else None
+        result.append(doc_id)
+    return result
+
+
+def intids_for_usernames(usernames):
+    """
+    Map the given usernames to user intids, in order, with None for any
+    that can't be resolved.  Usernames are looked up directly in the entity
+    catalog's username index, so no user objects are loaded.
+    """
+    usernames = list(usernames)
+    try:
+        index = get_entity_catalog()[IX_USERNAME]
+    except (KeyError, TypeError):
+        index = None
+    value_index, normalizer = unwrap_value_index(index)
+    values_to_documents = getattr(value_index, 'values_to_documents', None)
+    if values_to_documents is None:
+        return _lookup_usernames(usernames)
+
+    result = []
+    for username in usernames:
+        if not username:
+            result.append(None)
+            continue
+        # Usernames are case insensitive
+        candidates = (normalizer.value(username),) if normalizer is not None \
+                     else (username, username.lower())
+        doc_id = None
+        for candidate in candidates:
+            docs = values_to_documents.get(candidate)
+            if docs:
+                doc_id = next(iter(docs))
+                break
+        result.append(doc_id)
+    return result
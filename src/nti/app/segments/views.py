@@ -5,14 +5,23 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import copy
+import time
+
+from itertools import islice
+
 from operator import attrgetter
 
-import transaction
+import BTrees
+
+import six
 
 from pyramid import httpexceptions as hexc
 
 from pyramid.config import not_
 
+from pyramid.response import FileResponse
+
 from pyramid.view import view_config
 from pyramid.view import view_defaults
 
@@ -25,6 +34,8 @@ from zope import interface
 
 from zope.cachedescriptors.property import Lazy
 
+from zope.component.hooks import getSite
+
 from zope.intid import IIntIds
 
 from nti.app.base.abstract_views import AbstractAuthenticatedView
@@ -35,14 +46,77 @@ from nti.app.externalization.view_mixins import ModeledContentUploadRequestUtils
 
 from nti.app.renderers.interfaces import IUncacheableInResponse
 
+from nti.app.segments import MEMBERS
+from nti.app.segments import VIEW_BULK_EVALUATE
+from nti.app.segments import VIEW_EXPLAIN
+from nti.app.segments import VIEW_EXPORT_JOB
+from nti.app.segments import VIEW_EXPORT_JOB_DOWNLOAD
 from nti.app.segments import VIEW_EXPORT_MEMBERS
+from nti.app.segments import VIEW_MEMBER_CHANGES
+from nti.app.segments import VIEW_MEMBER_COUNT
 from nti.app.segments import VIEW_MEMBERS_PREVIEW
+from nti.app.segments import VIEW_REFRESH
+
+from nti.app.segments.bitmap import new_intid_set
+
+from nti.app.segments.bulk import bulk_evaluator
+
+from nti.app.segments.cache import CACHE_HIT
+from nti.app.segments.cache import CACHE_MISS
+from nti.app.segments.cache import CACHE_STATUS_HEADER
+from nti.app.segments.cache import SortedIntIds
+from nti.app.segments.cache import membership_cache_key
+
+from nti.app.segments.changes import record_membership
 
+from nti.app.segments.export import iter_members_csv_detached
+
+from nti.app.segments.index import IX_CREATEDTIME as IX_SEGMENT_CREATEDTIME
+from nti.app.segments.index import IX_CREATOR
+from nti.app.segments.index import IX_LASTMODIFIED
+from nti.app.segments.index import IX_NAME
+from nti.app.segments.index import IX_TITLE
+from nti.app.segments.index import get_segments_catalog
+
+from nti.app.segments.interfaces import ICreatorDisplayNameCache
+from nti.app.segments.interfaces import IExportJobRegistry
+from nti.app.segments.interfaces import ISegmentMembershipCache
+from nti.app.segments.interfaces import ISegmentMembershipLog
+from nti.app.segments.interfaces import ISegmentSortCache
 from nti.app.segments.interfaces import ISegmentsCollection
 
+from nti.app.segments.jobs import JOB_SUCCESS
+from nti.app.segments.jobs import SegmentExportJob
+from nti.app.segments.jobs import query_export_jobs
+from nti.app.segments.jobs import submit_export_job
+
+from nti.app.segments.keyset import InvalidCursor
+from nti.app.segments.keyset import decode_cursor
+from nti.app.segments.keyset import encode_cursor
+from nti.app.segments.keyset import keyset_order
+from nti.app.segments.keyset import keyset_page
+
+from nti.app.segments.membership import segment_membership
+from nti.app.segments.membership import segment_site
+from nti.app.segments.membership import segment_site_name
+from nti.app.segments.membership import site_admin_intids
+
+from nti.app.segments.planner import evaluate_filter_set
+
+from nti.app.segments.refresh import AS_OF_HEADER
+from nti.app.segments.refresh import MIN_REFRESH_INTERVAL
+from nti.app.segments.refresh import membership_snapshot
+from nti.app.segments.refresh import refresh_interval
+from nti.app.segments.refresh import set_refresh_interval
+
+from nti.app.segments.timing import profiled
+from nti.app.segments.timing import timed
+from nti.app.segments.timing import timed_iterable
+
 from nti.app.segments.traversal import MembersPathAdapter
 
-from nti.app.users.utils import get_site_admins
+from nti.app.segments.utils import intids_for_usernames
+from nti.app.segments.utils import unwrap_value_index
 
 from nti.app.users.views.view_mixins import AbstractEntityViewMixin
 from nti.app.users.views.view_mixins import UsersCSVExportMixin
@@ -72,23 +146,28 @@ from nti.dataserver.users import User
 
 from nti.dataserver.users.utils import intids_of_users_by_site
 
+from nti.externalization.externalization import to_external_object
+
 from nti.externalization.interfaces import LocatedExternalDict
 from nti.externalization.interfaces import StandardExternalFields
 
+from nti.links import Link
+
 from nti.namedfile.file import safe_filename
 
 from nti.segments.interfaces import ISegment
 from nti.segments.interfaces import ISegmentsContainer
 from nti.segments.interfaces import IUserSegment
 
-from nti.segments.model import IntIdSet
-
 from nti.site.interfaces import IHostPolicyFolder
 
 from nti.traversal.traversal import find_interface
 
 CLASS = StandardExternalFields.CLASS
 ITEMS = StandardExternalFields.ITEMS
+LAST_MODIFIED = StandardExternalFields.LAST_MODIFIED
+ITEM_COUNT = StandardExternalFields.ITEM_COUNT
+LINKS = StandardExternalFields.LINKS
 MIMETYPE = StandardExternalFields.MIMETYPE
 TOTAL = StandardExternalFields.TOTAL
 
@@ -190,14 +269,9 @@ class SegmentMembersView(AbstractEntityViewMixin):
     @Lazy
     def site_admin_intids(self):
         """
-        Return a set of site admin intids.
+        Return a set of the intids of the site admins of the segment's site.
         """
-        intids = component.getUtility(IIntIds)
-        all_site_admins = get_site_admins()
-        result = set()
-        for user in all_site_admins:
-            result.add(intids.getId(user))
-        return result
+        return site_admin_intids(segment_site(self.segment))
 
     def get_externalizer(self, user):
         # pylint: disable=no-member
@@ -221,13 +295,53 @@ class SegmentMembersView(AbstractEntityViewMixin):
             IX_LASTSEEN_TIME: get_metadata_catalog(),
         }
 
+    @Lazy
+    def sort_on(self):
+        """
+        The requested sort index name, or None.
+        """
+        # pylint: disable=no-member
+        sort_on = (self.params.get('sortOn') or '').lower()
+        return dict((x.lower(), x) for x in self.sortMap).get(sort_on)
+
+    @Lazy
+    def sort_reverse(self):
+        # pylint: disable=no-member
+        sort_order = self.params.get('sortOrder') or ''
+        return sort_order.lower() == 'descending'
+
+    def sort_intids(self, doc_ids, limit=None):
+        """
+        Order the given intids per the requested ``sortOn`` and ``sortOrder``
+        using the corresponding catalog index.  Documents missing from the
+        index follow, in their original order.
+
+        If a ``limit`` is given, only that many of the leading intids are
+        ordered and returned, allowing the index to avoid a full sort.
+        """
+        doc_ids = tuple(doc_ids)
+        complete = limit is None or limit >= len(doc_ids)
+        if complete:
+            limit = None
+
+        sort_on = self.sort_on
+        if sort_on is None:
+            return SortedIntIds(doc_ids[:limit], complete, len(doc_ids))
+
+        reverse = self.sort_reverse
+        index = self.sortMap[sort_on][sort_on]
+        result = list(index.sort(doc_ids, reverse=reverse, limit=limit))
+        needed = len(doc_ids) if limit is None else limit
+        if len(result) < needed:
+            seen = set(result)
+            missing = (x for x in doc_ids if x not in seen)
+            result.extend(islice(missing, needed - len(result)))
+        return SortedIntIds(result, complete, len(doc_ids))
+
     def search_include(self, doc_id):
-        # Users only and filter site admins if requested
-        result = self.mime_type(doc_id) == 'application/vnd.nextthought.user' \
-                 and super(SegmentMembersView, self).search_include(doc_id)
-        if result and self.filterAdmins:
-            result = doc_id not in self.site_admin_intids
-        return result
+        # Users only, site admins are filtered from the entity intids
+        return self.mime_type(doc_id) == 'application/vnd.nextthought.user' \
+           and super(SegmentMembersView, self).search_include(doc_id)
 
     @Lazy
     def site_name(self):
@@ -238,21 +352,481 @@ class SegmentMembersView(AbstractEntityViewMixin):
     def segment(self):
         return find_interface(self.context, IUserSegment)
 
+    #: Whether membership may be served from (and stored in) the
+    #: :class:`.ISegmentMembershipCache`
+    use_membership_cache = True
+
+    #: Whether evaluations are recorded in the segment's
+    #: :class:`.ISegmentMembershipLog`, firing entered and exited events.
+    #: Recording writes, so reads leave it to the background refresh and
+    #: explicit POSTs.
+    record_membership_changes = False
+
+    #: Whether membership may be served from the snapshot of a background
+    #: refresh, if recent enough
+    use_snapshots = True
+
+    @Lazy
+    def membership_cache(self):
+        if not self.use_membership_cache:
+            return None
+        return component.queryUtility(ISegmentMembershipCache)
+
+    @Lazy
+    def snapshot(self):
+        if not self.use_snapshots:
+            return None
+        result = membership_snapshot(self.segment, self.site_name)
+        if result is not None:
+            self.request.response.headers[AS_OF_HEADER] = str(result.asOf)
+        return result
+
     def get_entity_intids(self, site=None):
         # The parent class will handle any deactivated entity filtering.
-        initial_intids = intids_of_users_by_site(site, filter_deactivated=False)
+        result = self.segment_member_intids(site)
+        if self.filterAdmins:
+            # Excluded as a whole rather than checking each member
+            result = BTrees.family64.IF.difference(result, self.site_admin_intids)
+        return result
+
+    def segment_member_intids(self, site=None):
+        """
+        The intids of all members of the segment within the given site (or
+        its own site), including site admins.
+        """
+        site_name = getattr(site, '__name__', site)
+        if self.snapshot is not None and site_name in (None, self.site_name):
+            return self.snapshot.intids
+        with timed('membership'):
+            result, status = segment_membership(self.segment, site,
+                                                self.membership_cache,
+                                                self.record_membership_changes)
+        if status is not None:
+            self.request.response.headers[CACHE_STATUS_HEADER] = status
+        return result
+
+    @Lazy
+    def sort_cache(self):
+        if not self.use_membership_cache:
+            return None
+        return component.queryUtility(ISegmentSortCache)
+
+    #: Request parameters affecting neither the members listed nor their
+    #: order, and so not part of the sort cache key
+    _PAGING_PARAMS = ('batchstart', 'batchsize', 'cursor', 'format', 'stream', 'async')
+
+    def _sort_cache_key(self):
+        key = membership_cache_key(self.segment)
+        # pylint: disable=no-member
+        params = sorted((k.lower(), v) for k, v in self.params.items()
+                        if k.lower() not in self._PAGING_PARAMS)
+        # Snapshot and evaluated memberships are ordered separately
+        as_of = self.snapshot.asOf if self.snapshot is not None else None
+        return key + (tuple(params), as_of)
+
+    def sorted_member_intids(self, limit=None):
+        """
+        The filtered member intids in the requested order, holding at least
+        the leading ``limit`` intids (or all of them, if None).  Orderings
+        are shared across pages through the :class:`.ISegmentSortCache`.
+        """
+        cache = self.sort_cache
+        if cache is None:
+            return self._timed_sort_intids(limit)
+
+        key = self._sort_cache_key()
+        result = cache.get(self.site_name, key)
+        if result is not None \
+                and (result.complete or (limit is not None and len(result) >= limit)):
+            self.request.response.headers[CACHE_STATUS_HEADER] = CACHE_HIT
+            return result
+
+        generation = cache.generation(self.site_name)
+        result = self._timed_sort_intids(limit)
+        cache.set(self.site_name, key, result, generation)
+        return result
+
+    def keyset_member_intids(self, index=None):
+        """
+        The filtered member intids in their keyset order for the requested
+        sort, shared across pages through the :class:`.ISegmentSortCache`.
+        """
+        cache = self.sort_cache
+        if cache is None:
+            return self._timed_keyset_order(index)
+
+        key = self._sort_cache_key() + ('keyset',)
+        result = cache.get(self.site_name, key)
+        if result is not None:
+            self.request.response.headers[CACHE_STATUS_HEADER] = CACHE_HIT
+            return result
+
+        generation = cache.generation(self.site_name)
+        result = self._timed_keyset_order(index)
+        cache.set(self.site_name, key, result, generation)
+        return result
+
+    def _timed_keyset_order(self, index=None):
+        members = self.filtered_intids
+        with timed('sort'):
+            return keyset_order(members, index, self.sort_reverse)
+
+    def _timed_sort_intids(self, limit=None):
+        doc_ids = self.filtered_intids
+        with timed('sort'):
+            return self.sort_intids(doc_ids, limit)
+
+    def _batch_members(self, result):
+        batch_size, batch_start = self._get_batch_size_start()
+        # One beyond the requested page, so we know whether a next exists
+        limit = None if batch_size is None else batch_start + batch_size + 1
+        doc_ids = self.sorted_member_intids(limit)
+
+        result[TOTAL] = doc_ids.total
+        with timed('batch'):
+            self._batch_items_iterable(result, doc_ids,
+                                       number_items_needed=doc_ids.total)
+
+    def _page_members(self, result, cursor):
+        """
+        The page of members following the given cursor (or the first page,
+        if empty), along with a ``NextCursor`` for the following page, if
+        any.  Pages are resumed by bisecting the (cached) ordering of the
+        members for the cursor, rather than skipping through them.
+        """
+        batch_size, _ = self._get_batch_size_start()
+        try:
+            after = decode_cursor(cursor, self.sort_on, self.sort_reverse) if cursor else None
+        except InvalidCursor:
+            raise hexc.HTTPUnprocessableEntity(u'Invalid cursor.')
+
+        index = self.sortMap[self.sort_on][self.sort_on] if self.sort_on else None
+        ordered = self.keyset_member_intids(index)
+        with timed('batch'):
+            page, last = keyset_page(ordered, index, self.sort_reverse,
+                                     after, batch_size)
+
+        result[TOTAL] = len(ordered)
+        result[ITEMS] = page
+        result['NextCursor'] = None
+        if last is not None:
+            result['NextCursor'] = encode_cursor(last, self.sort_on,
+                                                 self.sort_reverse)
+
+    def _list_members(self):
+        result = LocatedExternalDict()
+        # pylint: disable=no-member
+        cursor = self.params.get('cursor')
+        if cursor is not None:
+            self._page_members(result, cursor)
+        else:
+            self._batch_members(result)
+
+        intids = component.getUtility(IIntIds)
+        items = []
+        with timed('externalize'):
+            for doc_id in result.get(ITEMS) or ():
+                user = intids.queryObject(doc_id)
+                if user is not None:
+                    items.append(to_external_object(user,
+                                                    name=self.get_externalizer(user)))
+        result[ITEMS] = items
+        result[ITEM_COUNT] = len(items)
+        if self.snapshot is not None:
+            result['AsOf'] = self.snapshot.asOf
+        return result
+
+    def __call__(self):
+        with profiled('members', self.request):
+            result = self._list_members()
+        interface.alsoProvides(result, IUncacheableInResponse)
+        return result
+
+
+@view_config(route_name='objects.generic.traversal',
+             request_method='GET',
+             renderer='rest',
+             context=MembersPathAdapter,
+             name=VIEW_MEMBER_COUNT,
+             permission=ACT_SEARCH)
+class SegmentMemberCountView(SegmentMembersView):
+    """
+    The number of members the members view would list given the same
+    parameters, computed from their intids alone.
+    """
+
+    def member_count(self):
+        # Any ordering of the same members already carries their count
+        cache = self.sort_cache
+        key = self._sort_cache_key() if cache is not None else None
+        ordered = cache.get(self.site_name, key) if cache is not None else None
+        if ordered is not None:
+            self.request.response.headers[CACHE_STATUS_HEADER] = CACHE_HIT
+            return ordered.total
+        return len(self.filtered_intids)
+
+    def __call__(self):
+        result = LocatedExternalDict()
+        result[MIMETYPE] = 'application/vnd.nextthought.segments.membercount'
+        result[CLASS] = 'SegmentMemberCount'
+        with profiled('member-count', self.request):
+            result['MemberCount'] = self.member_count()
+        if self.snapshot is not None:
+            result['AsOf'] = self.snapshot.asOf
+        interface.alsoProvides(result, IUncacheableInResponse)
+        return result
+
+
+@view_config(route_name='objects.generic.traversal',
+             request_method=('GET', 'POST'),
+             renderer='rest',
+             context=MembersPathAdapter,
+             name=VIEW_MEMBER_CHANGES,
+             permission=ACT_SEARCH)
+class SegmentMembershipChangesView(SegmentMembersView):
+    """
+    The users that entered and left the segment since a prior response,
+    as recorded.  A POST first records the current membership, bringing
+    the changes up to date.
+
+    since
+            The ``Token`` of a prior response.  If omitted, or if the
+            changes since are no longer retained, ``Reset`` is true and
+            consumers should fetch the full membership.
+    """
+
+    def _since(self):
+        since = self.request.params.get('since')
+        if not since:
+            return None
+        try:
+            return int(since)
+        except ValueError:
+            raise hexc.HTTPUnprocessableEntity(u'Invalid token.')
+
+    def __call__(self):
+        since = self._since()
+        if self.request.method == 'POST':
+            record_membership(self.segment, self.segment_member_intids())
+
+        log = ISegmentMembershipLog(self.segment)
+        changes = log.changes_since(since) if since is not None else None
+
+        result = LocatedExternalDict()
+        result[MIMETYPE] = 'application/vnd.nextthought.segments.membershipchanges'
+        result[CLASS] = 'SegmentMembershipChanges'
+        result['Token'] = str(log.sequence)
+        result['Reset'] = changes is None
+        result['Entered'], result['Exited'] = changes or ((), ())
+        interface.alsoProvides(result, IUncacheableInResponse)
+        return result
+
+
+@view_config(route_name='objects.generic.traversal',
+             request_method='GET',
+             renderer='rest',
+             context=IUserSegment,
+             name=VIEW_EXPLAIN,
+             permission=ACT_SEARCH)
+class ExplainSegmentView(AbstractAuthenticatedView):
+    """
+    Evaluate the segment, returning the plan chosen for its filter set along
+    with the estimated and actual sizes and timings of each node.
+    """
+
+    @Lazy
+    def site_name(self):
+        return find_interface(self.context, IHostPolicyFolder).__name__
+
+    def __call__(self):
+        result = LocatedExternalDict()
+        result[MIMETYPE] = 'application/vnd.nextthought.segments.segmentplan'
+        result[CLASS] = 'SegmentPlan'
+
+        start = time.time()
+        initial_intids = intids_of_users_by_site(self.site_name,
+                                                 filter_deactivated=False)
+        result['SiteUsers'] = len(initial_intids)
+        result['SiteScanMs'] = (time.time() - start) * 1000.0
+
+        plan = None
+        member_count = result['SiteUsers']
+        if self.context.filter_set is not None:
+            rs, plan = evaluate_filter_set(self.context.filter_set,
+                                           new_intid_set(initial_intids))
+            member_count = len(rs.intids())
+            plan = plan.to_external()
+
+        result['Plan'] = plan
+        result['MemberCount'] = member_count
+        result['ElapsedMs'] = (time.time() - start) * 1000.0
+        interface.alsoProvides(result, IUncacheableInResponse)
+        return result
+
+
+@view_config(route_name='objects.generic.traversal',
+             request_method=('GET', 'POST'),
+             renderer='rest',
+             context=ISegmentsContainer,
+             name=VIEW_BULK_EVALUATE,
+             permission=ACT_SEARCH)
+class BulkEvaluateSegmentsView(AbstractAuthenticatedView,
+                               ModeledContentUploadRequestUtilsMixin):
+    """
+    Evaluate all user segments of the site (or those requested) in a single
+    pass, scanning the site users once and sharing identical filters across
+    segments.  Membership is read from, and stored in, the membership cache.
+    Evaluations are recorded in the membership log of each segment only
+    when POSTed.
+
+    ntiids
+            The NTIIDs (or names) of the segments to evaluate.  Defaults
+            to all segments.
+
+    intids
+            Whether to include the intids of the members of each segment.
+    """
+
+    # Set once the site users have been scanned
+    _site_scan_time = None
+
+    @Lazy
+    def _params(self):
+        if self.request.body:
+            return CaseInsensitiveDict(self.readInput())
+        result = CaseInsensitiveDict(self.request.params)
+        result['ntiids'] = self.request.params.getall('ntiids')
+        return result
+
+    @Lazy
+    def site_name(self):
+        return find_interface(self.context, IHostPolicyFolder).__name__
 
-        if self.segment.filter_set is not None:
-            rs = IntIdSet(initial_intids)
-            initial_intids = self.segment.filter_set.apply(rs).intids()
+    @Lazy
+    def evaluator(self):
+        start = time.time()
+        result = bulk_evaluator(intids_of_users_by_site(self.site_name,
+                                                        filter_deactivated=False))
+        self._site_scan_time = time.time() - start
+        return result
 
-        return initial_intids
+    def _segments(self):
+        segments = [x for x in self.context.values() if IUserSegment.providedBy(x)]
+        requested = self._params.get('ntiids') or ()
+        if isinstance(requested, six.string_types):
+            requested = (requested,)
+        if not requested:
+            return segments
+        requested = set(requested)
+        return [x for x in segments
+                if x.__name__ in requested or getattr(x, 'ntiid', None) in requested]
+
+    def _membership(self, segment, cache):
+        if cache is None:
+            return self.evaluator.evaluate(segment.filter_set), CACHE_MISS
+
+        key = membership_cache_key(segment)
+        result = cache.get(self.site_name, key)
+        if result is not None:
+            return result, CACHE_HIT
+
+        generation = cache.generation(self.site_name)
+        result = self.evaluator.evaluate(segment.filter_set)
+        cache.set(self.site_name, key, result, generation)
+        return result, CACHE_MISS
 
     def __call__(self):
-        result = self._do_call()
+        start = time.time()
+        include_intids = is_true(self._params.get('intids'))
+        cache = component.queryUtility(ISegmentMembershipCache)
+
+        record = self.request.method == 'POST'
+        items = {}
+        for segment in self._segments():
+            members, status = self._membership(segment, cache)
+            if record:
+                record_membership(segment, members)
+            item = {
+                'MemberCount': len(members),
+                'Cache': status,
+            }
+            if include_intids:
+                item['Intids'] = list(members)
+            items[getattr(segment, 'ntiid', None) or segment.__name__] = item
+
+        result = LocatedExternalDict()
+        result[MIMETYPE] = 'application/vnd.nextthought.segments.bulkevaluation'
+        result[CLASS] = 'SegmentsBulkEvaluation'
+        result[ITEMS] = items
+        result[TOTAL] = len(items)
+        if self._site_scan_time is not None:
+            result['SiteUsers'] = len(self.evaluator.initial_set.intids())
+            result['SiteScanMs'] = self._site_scan_time * 1000.0
+            result['LeafEvaluations'] = self.evaluator.leaf_evaluations
+            result['SharedLeaves'] = self.evaluator.shared_leaves
+        result['ElapsedMs'] = (time.time() - start) * 1000.0
+        interface.alsoProvides(result, IUncacheableInResponse)
+        return result
+
+
+@view_config(route_name='objects.generic.traversal',
+             request_method='GET',
+             renderer='rest',
+             context=IUserSegment,
+             name=VIEW_REFRESH,
+             permission=ACT_READ)
+class SegmentRefreshView(AbstractAuthenticatedView):
+    """
+    The background refresh interval of the segment, in seconds, and the
+    time of its latest refresh, if still served.
+    """
+
+    def _external(self):
+        snapshot = membership_snapshot(self.context)
+        result = LocatedExternalDict()
+        result[MIMETYPE] = 'application/vnd.nextthought.segments.refreshsettings'
+        result[CLASS] = 'SegmentRefreshSettings'
+        result['Interval'] = refresh_interval(self.context)
+        result['AsOf'] = snapshot.asOf if snapshot is not None else None
         interface.alsoProvides(result, IUncacheableInResponse)
         return result
 
+    def __call__(self):
+        return self._external()
+
+
+@view_config(route_name='objects.generic.traversal',
+             request_method='PUT',
+             renderer='rest',
+             context=IUserSegment,
+             name=VIEW_REFRESH,
+             permission=ACT_UPDATE)
+class UpdateSegmentRefreshView(SegmentRefreshView,
+                               ModeledContentUploadRequestUtilsMixin):
+    """
+    Set the background refresh interval of the segment.
+
+    interval
+            Seconds between refreshes, at least a minute, or null to
+            only evaluate the segment on demand.
+    """
+
+    def _interval(self):
+        interval = CaseInsensitiveDict(self.readInput()).get('interval')
+        if interval is None:
+            return None
+        try:
+            interval = float(interval)
+        except (TypeError, ValueError):
+            raise hexc.HTTPUnprocessableEntity(u'Invalid interval.')
+        if interval < MIN_REFRESH_INTERVAL:
+            raise hexc.HTTPUnprocessableEntity(u'Interval too short.')
+        return interval
+
+    def __call__(self):
+        set_refresh_interval(self.context, self._interval())
+        return self._external()
+
 
 @view_config(route_name='objects.generic.traversal',
              request_method='PUT',
@@ -261,15 +835,32 @@ class SegmentMembersView(AbstractEntityViewMixin):
              accept='application/json',
              permission=ACT_SEARCH)
 class PreviewSegmentMembersView(SegmentMembersView,
-                                UGDPutView):
+                                ModeledContentUploadRequestUtilsMixin):
+    """
+    The members the segment would have with the changes in the request
+    body applied.  Changes are applied to a transient copy of the segment,
+    without firing events, so nothing is written.
+    """
 
-    def __call__(self):
-        try:
-            UGDPutView.__call__(self)
-            return super(PreviewSegmentMembersView, self).__call__()
-        finally:
-            # Essentially a preflight, so abandon changes
-            transaction.doom()
+    # Previews evaluate unsaved changes, which must never be cached
+    # or recorded
+    use_membership_cache = False
+    record_membership_changes = False
+    use_snapshots = False
+
+    @Lazy
+    def segment(self):
+        segment = find_interface(self.context, IUserSegment)
+        # A copy that is never added to a connection, sharing nothing
+        # that internalization may update in place
+        result = copy.copy(segment)
+        # Parent references of the filter sets resolve to the copy,
+        # rather than copying upward through the site
+        result.filter_set = copy.deepcopy(segment.filter_set,
+                                          {id(segment): result})
+        if self.request.body:
+            self.updateContentObject(result, self.readInput(), notify=False)
+        return result
 
 
 @view_defaults(route_name='objects.generic.traversal',
@@ -285,20 +876,64 @@ class SegmentMembersCSVView(SegmentMembersView,
     def _get_filename(self):
         return safe_filename(u'users_export-%s.csv' % (self.segment.title,))
 
+    @Lazy
+    def streaming(self):
+        """
+        Whether rows should be streamed to the client as they are produced,
+        rather than building the entire export prior to responding.
+        """
+        return is_true(self.request.params.get('stream'))
+
+    def _get_stream_intids(self):
+        """
+        The intids of the users to export, in order.
+        """
+        return self.sorted_member_intids()
+
+    def _create_streaming_response(self):
+        response = self.request.response
+        response.content_type = 'text/csv'
+        response.charset = 'utf-8'
+        response.content_disposition = 'attachment; filename="%s"' % (self._get_filename(),)
+        # Users are resolved from a dedicated connection, in chunks, as the
+        # body is consumed, which may be after our transaction completes
+        # Rows are built without the request, which may have ended by the
+        # time they are produced
+        rows = iter_members_csv_detached(self._get_stream_intids())
+        response.app_iter = timed_iterable('csv-stream', rows)
+        return response
+
+    def _create_csv_response(self):
+        with timed('csv'):
+            return super(SegmentMembersCSVView, self)._create_csv_response()
+
     def __call__(self):
         self.check_access()
-        return self._create_csv_response()
+        with profiled('members-csv', self.request):
+            if self.streaming:
+                return self._create_streaming_response()
+            return self._create_csv_response()
 
 
 @view_config(route_name='objects.generic.traversal',
              request_method='POST',
              context=MembersPathAdapter,
              name=VIEW_EXPORT_MEMBERS,
+             renderer='rest',
              decorator=download_cookie_decorator,
              permission=ACT_SEARCH,
              request_param='format=text/csv')
 class SegmentMembersCSVPOSTView(SegmentMembersCSVView,
                                 ModeledContentUploadRequestUtilsMixin):
+    """
+    Export the segment members, or the posted usernames among them, as
+    CSV.  Given ``async=true`` the export is run in the background instead,
+    returning the job, with links to poll its status and download the
+    result once complete.
+    """
+
+    # Exports only write their jobs, so nothing may be recorded
+    record_membership_changes = False
 
     def readInput(self):
         if self.request.POST:
@@ -313,47 +948,204 @@ class SegmentMembersCSVPOSTView(SegmentMembersCSVView,
     def _params(self):
         return self.readInput()
 
+    @Lazy
+    def streaming(self):
+        return is_true(self._params.get('stream')
+                       or self.request.params.get('stream'))
+
+    def _get_requested_intids(self):
+        """
+        Intids of the posted usernames, in the order requested, limited to
+        members of the segment.
+        """
+        requested = [x for x in intids_for_usernames(self._params.get('usernames', ()))
+                     if x is not None]
+
+        # Validate the users are in the original result set
+        family = BTrees.family64
+        filtered = self.filtered_intids
+        if not isinstance(filtered, (family.IF.Set, family.IF.TreeSet)):
+            filtered = family.IF.Set(filtered)
+        members = family.IF.intersection(family.IF.Set(requested), filtered)
+        return [x for x in requested if x in members]
+
+    def _get_stream_intids(self):
+        if not self._params.get('usernames', ()):
+            return super(SegmentMembersCSVPOSTView, self)._get_stream_intids()
+        return self._get_requested_intids()
+
     def _get_result_iter(self):
-        usernames = self._params.get('usernames', ())
-        if not usernames:
+        if not self._params.get('usernames', ()):
             return super(SegmentMembersCSVPOSTView, self)._get_result_iter()
         intids = component.getUtility(IIntIds)
-        result = []
-        for username in usernames:
-            user = User.get_user(username)
-            if user is None:
-                continue
-            user_intid = intids.queryId(user)
-            if user_intid is None:
-                continue
-            # Validate the user is in the original result set
-            if user_intid in self.filtered_intids:
-                result.append(user)
-        return result
+        return [intids.getObject(x) for x in self._get_requested_intids()]
+
+    def _start_export_job(self):
+        self.check_access()
+        segment = self.segment
+        job = SegmentExportJob(self._get_stream_intids(),
+                               filename=self._get_filename(),
+                               creator=self.remoteUser.username,
+                               segment_id=_segment_intid(segment),
+                               site_name=segment_site_name(segment))
+        IExportJobRegistry(segment).add(job)
+        # Run once the job is committed
+        submit_export_job(job)
+        self.request.response.status_int = 202
+        return _export_job_external(job, segment)
 
     def __call__(self):
+        if is_true(self.request.params.get('async')):
+            return self._start_export_job()
         try:
             return super(SegmentMembersCSVPOSTView, self).__call__()
         finally:
             self.request.environ['nti.commit_veto'] = 'abort'
 
 
+def _segment_intid(segment):
+    return component.getUtility(IIntIds).queryId(segment)
+
+
+def _export_job_external(job, segment):
+    result = LocatedExternalDict()
+    result[MIMETYPE] = 'application/vnd.nextthought.segments.exportjob'
+    result[CLASS] = 'SegmentExportJob'
+    result['JobId'] = job.id
+    result['Status'] = job.status
+    result['RowsWritten'] = job.written
+    result['Total'] = job.total
+    result['Error'] = job.error
+    result['CreatedTime'] = job.createdTime
+    result[LAST_MODIFIED] = job.lastModified
+
+    job_elements = (MEMBERS, '@@' + VIEW_EXPORT_JOB, job.id)
+    links = [Link(segment, rel='status', elements=job_elements, method='GET')]
+    if not job.finished:
+        links.append(Link(segment, rel='cancel', elements=job_elements,
+                          method='DELETE'))
+    if job.status == JOB_SUCCESS:
+        links.append(Link(segment, rel='download',
+                          elements=(MEMBERS, '@@' + VIEW_EXPORT_JOB_DOWNLOAD, job.id),
+                          method='GET'))
+    result[LINKS] = links
+    interface.alsoProvides(result, IUncacheableInResponse)
+    return result
+
+
+class AbstractSegmentExportJobView(AbstractAuthenticatedView):
+    """
+    Views on an export job, identified by the first subpath element, which
+    are only available to the user that started the job.
+    """
+
+    @Lazy
+    def segment(self):
+        return find_interface(self.context, IUserSegment)
+
+    @Lazy
+    def job_registry(self):
+        return query_export_jobs(self.segment)
+
+    @Lazy
+    def job(self):
+        subpath = self.request.subpath
+        registry = self.job_registry
+        job = registry.get(subpath[0]) if subpath and registry is not None else None
+        if      job is None \
+                or job.creator != self.remoteUser.username \
+                or job.segment_id != _segment_intid(self.segment):
+            raise hexc.HTTPNotFound()
+        return job
+
+
+@view_config(route_name='objects.generic.traversal',
+             request_method='GET',
+             context=MembersPathAdapter,
+             name=VIEW_EXPORT_JOB,
+             renderer='rest',
+             permission=ACT_SEARCH)
+class SegmentExportJobView(AbstractSegmentExportJobView):
+
+    def __call__(self):
+        return _export_job_external(self.job, self.segment)
+
+
+@view_config(route_name='objects.generic.traversal',
+             request_method='DELETE',
+             context=MembersPathAdapter,
+             name=VIEW_EXPORT_JOB,
+             renderer='rest',
+             permission=ACT_SEARCH)
+class CancelSegmentExportJobView(AbstractSegmentExportJobView):
+
+    def __call__(self):
+        self.job_registry.remove(self.job.id)
+        return hexc.HTTPNoContent()
+
+
+@view_config(route_name='objects.generic.traversal',
+             request_method='GET',
+             context=MembersPathAdapter,
+             name=VIEW_EXPORT_JOB_DOWNLOAD,
+             permission=ACT_SEARCH)
+class SegmentExportJobDownloadView(AbstractSegmentExportJobView):
+
+    def __call__(self):
+        job = self.job
+        if job.status != JOB_SUCCESS or job.output is None:
+            raise hexc.HTTPConflict()
+        response = FileResponse(job.output.committed(),
+                                request=self.request,
+                                content_type='text/csv')
+        response.content_disposition = 'attachment; filename="%s"' % (job.filename,)
+        return response
+
+
+#: Request environ key for the creator display names resolved by a request
+CREATOR_DISPLAY_NAMES_KEY = 'nti.app.segments.creator_display_names'
+
+
+def _resolve_creator_display_name(creator, request):
+    user = User.get_user(creator)
+    display_name_generator = component.queryMultiAdapter((user, request),
+                                                         IDisplayNameGenerator)
+    if display_name_generator is None:
+        return creator
+
+    return display_name_generator()
+
+
+def creator_display_name(creator, request):
+    """
+    The display name for the given creator username, resolved at most once
+    per request and shared across requests through any registered
+    :class:`.ICreatorDisplayNameCache`.
+    """
+    names = request.environ.setdefault(CREATOR_DISPLAY_NAMES_KEY, {})
+    if creator in names:
+        return names[creator]
+
+    cache = component.queryUtility(ICreatorDisplayNameCache)
+    scope = getattr(getSite(), '__name__', None)
+    result = cache.get(scope, creator) if cache is not None else None
+    if result is None:
+        result = _resolve_creator_display_name(creator, request)
+        if cache is not None and result is not None:
+            cache.set(scope, creator, result)
+    names[creator] = result
+    return result
+
+
 class SegmentSummary(object):
 
     def __init__(self, segment, request):
         self.segment = segment
         self.request = request
 
-    @property
+    @Lazy
     def creator_display_name(self):
-        segment = self.segment
-        user = User.get_user(segment.creator)
-        display_name_generator = component.queryMultiAdapter((user, self.request),
-                                                             IDisplayNameGenerator)
-        if display_name_generator is None:
-            return segment.creator
-
-        return display_name_generator()
+        return creator_display_name(self.segment.creator, self.request)
 
     def __getattr__(self, item):
         return getattr(self.segment, item)
@@ -392,11 +1184,12 @@ class SiteSegmentsView(BatchingUtilsMixin,
     _DEFAULT_BATCH_START = 0
 
     _default_sort = 'title'
+    # Read from the segment directly rather than through the summary
     _sort_keys = {
-        'title': attrgetter('title'),
+        'title': attrgetter('segment.title'),
         'creator': attrgetter('creator_display_name'),
-        'createdtime': attrgetter('createdTime'),
-        'lastmodified': attrgetter('lastModified'),
+        'createdtime': attrgetter('segment.createdTime'),
+        'lastmodified': attrgetter('segment.lastModified'),
     }
 
     def _get_sorted_result_set(self, items, sort_key, sort_desc=False):
@@ -406,11 +1199,20 @@ class SiteSegmentsView(BatchingUtilsMixin,
         items = sorted(items, key=sort_key, reverse=sort_desc)
         return items
 
-    def _get_sort_params(self):
+    #: Catalog indexes for sort keys other than ``creator``
+    _sort_indexes = {
+        'title': IX_TITLE,
+        'createdtime': IX_SEGMENT_CREATEDTIME,
+        'lastmodified': IX_LASTMODIFIED,
+    }
+
+    def _get_sort_on(self):
         sort_on = self.request.params.get('sortOn') or ''
         sort_on = sort_on.lower()
-        sort_on = sort_on if sort_on in self._sort_keys else self._default_sort
-        sort_key = self._sort_keys.get(sort_on)
+        return sort_on if sort_on in self._sort_keys else self._default_sort
+
+    def _get_sort_params(self):
+        sort_key = self._sort_keys.get(self._get_sort_on())
 
         # Ascending is default
         sort_order = self.request.params.get('sortOrder')
@@ -436,6 +1238,81 @@ class SiteSegmentsView(BatchingUtilsMixin,
     def _container(self):
         return self.context
 
+    @Lazy
+    def _catalog(self):
+        site = find_interface(self._container, IHostPolicyFolder)
+        return get_segments_catalog(site) if site is not None else None
+
+    def _catalog_intids(self, filter_param):
+        """
+        The intids of all cataloged segments or, given a filter, of those
+        with names containing it.
+        """
+        family = BTrees.family64
+        # Every segment has a name, so its index covers the catalog
+        index, _ = unwrap_value_index(self._catalog[IX_NAME])
+        if not filter_param:
+            return family.IF.Set(index.documents_to_values.keys())
+        return family.IF.multiunion([docs for name, docs in index.values_to_documents.items()
+                                     if filter_param in name])
+
+    def _sort_intids_by_creator(self, doc_ids, sort_descending, limit=None):
+        # Display names are resolved once per creator, not per segment
+        family = BTrees.family64
+        index, _ = unwrap_value_index(self._catalog[IX_CREATOR])
+        groups = []
+        for creator, docs in index.values_to_documents.items():
+            docs = family.IF.intersection(doc_ids, docs)
+            if docs:
+                groups.append((creator_display_name(creator, self.request), docs))
+        groups.sort(key=lambda x: x[0], reverse=sort_descending)
+        ordered = (doc_id for _, docs in groups for doc_id in docs)
+        return list(islice(ordered, limit))
+
+    def _sort_intids(self, doc_ids, sort_on, sort_descending, limit=None):
+        """
+        Order the leading ``limit`` (or all) of the given segment intids,
+        with any lacking a value for the sort key following.
+        """
+        if sort_on == 'creator':
+            result = self._sort_intids_by_creator(doc_ids, sort_descending,
+                                                  limit)
+        else:
+            index, _ = unwrap_value_index(self._catalog[self._sort_indexes[sort_on]])
+            result = list(index.sort(doc_ids, reverse=sort_descending, limit=limit))
+        needed = len(doc_ids) if limit is None else min(limit, len(doc_ids))
+        if len(result) < needed:
+            seen = set(result)
+            missing = (x for x in doc_ids if x not in seen)
+            result.extend(islice(missing, needed - len(result)))
+        return result[:needed]
+
+    def _get_catalog_items(self, result_dict, filter_param):
+        """
+        Filter, sort and batch using the segments catalog, only loading the
+        segments in the requested batch.
+        """
+        doc_ids = self._catalog_intids(filter_param)
+        _, sort_descending = self._get_sort_params()
+        batch_size, batch_start = self._get_batch_size_start()
+        # One beyond the requested page, so we know whether a next exists
+        limit = None if batch_size is None else batch_start + batch_size + 1
+        result_set = self._sort_intids(doc_ids, self._get_sort_on(),
+                                       sort_descending, limit)
+
+        total_items = result_dict[TOTAL] = len(doc_ids)
+        self._batch_items_iterable(result_dict,
+                                   result_set,
+                                   number_items_needed=total_items)
+
+        intids = component.getUtility(IIntIds)
+        items = []
+        for doc_id in result_dict.get(ITEMS) or ():
+            segment = intids.queryObject(doc_id)
+            if segment is not None:
+                items.append(SegmentSummary(segment, self.request))
+        return items
+
     def _get_items(self, result_dict):
         """
         Sort and batch records.
@@ -443,6 +1320,9 @@ class SiteSegmentsView(BatchingUtilsMixin,
         search = self.request.params.get('filter')
         filter_param = search and search.lower()
 
+        if self._catalog is not None:
+            return self._get_catalog_items(result_dict, filter_param)
+
         items = [SegmentSummary(segment, self.request)
                  for segment in self._container.values()]
         if filter_param: